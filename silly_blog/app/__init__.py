@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 import os
+import getpass
+import hashlib
+import tempfile
 import functools
 import logging.config
 import logging
 
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_cors import CORS
 from werkzeug.exceptions import HTTPException
@@ -15,6 +17,11 @@ from silly_blog.contrib.auth import HTTPTokenAuth
 from silly_blog.contrib.jwtoken import JSONWebSignature
 from silly_blog.contrib.utils import make_error_response
 from silly_blog.contrib.middleware import SizeLimitMiddleware
+from silly_blog.contrib.hashing import PasswordHasher
+from silly_blog.contrib.fastjson import JSONEncoder
+from silly_blog.contrib.cache import private_directory
+from silly_blog.contrib.engine import SQLAlchemy
+from silly_blog.contrib.instrument import QueryInstrumentation
 
 
 LOG = logging.getLogger(__name__)
@@ -26,12 +33,17 @@ jws = JSONWebSignature()
 cors = CORS()
 
 
-def create_app():
-    """Create a flask application."""
+def create_app(config_object=None):
+    """Create a flask application.
+
+    :param config_object: the config object, defaults to the one of the
+        environment named by `FLASK_ENV`.
+    """
     path = os.path.abspath(
         os.path.join(os.path.dirname(__file__), os.path.pardir, 'instance'))
     app = Flask(__name__, instance_path=path, instance_relative_config=True)
-    config_object = get_config(app.config['ENV'])  # respect FLASK_ENV env
+    if config_object is None:
+        config_object = get_config(app.config['ENV'])  # respect FLASK_ENV env
     app.config.from_object(config_object)
     # NOTE: we can use instance folders to store config files and
     # here use "from_pyfile" to load them.
@@ -47,6 +59,7 @@ def create_app():
     # globally disable strict slashes
     app.url_map.strict_slashes = False
 
+    init_runtime_dirs(app)
     initialize_extensions(app)
     register_blueprints(app)
     minor_repairs(app)
@@ -54,14 +67,50 @@ def create_app():
 
     # Add `sizelimit` middleware
     app.wsgi_app = SizeLimitMiddleware(app)
+    # Add opt-in profiling middleware
+    if app.config.get('PROFILE_ENABLED'):
+        from silly_blog.contrib.profiling import ProfilingMiddleware
+        app.wsgi_app = ProfilingMiddleware(app)
 
     return app
 
 
+# subdirectories of `RUNTIME_DIR` for directories not configured
+RUNTIME_SUBDIRS = {
+    "VERSION_STAMP_DIR": "stamps",
+    "RESPONSE_CACHE_DIR": "responses",
+    "METRICS_DIR": "metrics",
+    "PROFILE_DIR": "profiles",
+    "REPLICA_STICKY_DIR": "sticky",
+    "PASSWORD_HASH_SLOTS_DIR": "hash-slots",
+}
+
+
+def init_runtime_dirs(app):
+    """Fill in directories shared by worker processes of the instance."""
+    runtime_dir = app.config.get("RUNTIME_DIR")
+    if runtime_dir is None:
+        digest = hashlib.sha1(app.config.get(
+            "SQLALCHEMY_DATABASE_URI", "").encode("utf-8")).hexdigest()
+        runtime_dir = os.path.join(tempfile.gettempdir(), "silly-blog-%s-%s"
+                                   % (getpass.getuser(), digest[:12]))
+        app.config["RUNTIME_DIR"] = runtime_dir
+    private_directory(runtime_dir)
+    for key, name in RUNTIME_SUBDIRS.items():
+        if app.config.get(key) is None:
+            app.config[key] = os.path.join(runtime_dir, name)
+
+
 def initialize_extensions(app):
     """Initialize initialize_extensions with specified app."""
     # db related
     db.init_app(app)
+    # NOTE: go first, so queries of other `before_request` are counted
+    QueryInstrumentation(app)
+    # metrics of requests shared by worker processes
+    if app.config.get("METRICS_ENABLED"):
+        from silly_blog.app.metrics import RequestMetrics
+        RequestMetrics(app)
     migrate.init_app(app, db=db)
     # auth related
     auth.init_app(app)
@@ -69,6 +118,38 @@ def initialize_extensions(app):
     jws.init_app(app)
     # enable CORS
     cors.init_app(app)
+    # encoder of API responses
+    app.extensions["json_encoder"] = JSONEncoder(
+        app.config["JSON_BACKEND"], sort_keys=app.config["JSON_SORT_KEYS"])
+    # hash passwords off the request path
+    app.extensions["password_hasher"] = PasswordHasher(
+        app.config["PASSWORD_HASH_METHOD"],
+        salt_length=app.config["PASSWORD_SALT_LENGTH"],
+        workers=app.config["PASSWORD_HASH_WORKERS"],
+        max_pending=app.config["PASSWORD_HASH_MAX_PENDING"],
+        slots_dir=app.config["PASSWORD_HASH_SLOTS_DIR"],
+        slots=app.config["PASSWORD_HASH_SLOTS"])
+    # versions of tables bumped by commits, validators of lists
+    from silly_blog.app.table_versions import TableVersions
+    TableVersions(app)
+    # in-process cache of category tree
+    if app.config.get("CATEGORY_CACHE_ENABLED", True):
+        from silly_blog.app.category_tree import CategoryTreeCache
+        CategoryTreeCache(app)
+    # cache of token principals
+    from silly_blog.app.principals import PrincipalCache
+    PrincipalCache(app)
+    # write-behind article counters
+    from silly_blog.app.counters import ArticleCounters
+    ArticleCounters(app)
+    # read-only requests from replicas
+    if app.config.get("SQLALCHEMY_REPLICAS"):
+        from silly_blog.app.replicas import ReplicaRouter
+        ReplicaRouter(app)
+    # cache responses of anonymous GET requests
+    if app.config.get("RESPONSE_CACHE_BACKEND"):
+        from silly_blog.app.response_cache import ResponseCache
+        ResponseCache(app)
 
     @auth.unauthorized_handler
     def handle_unauthorized():
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Category tree for serializing categories and articles.
+
+Categories change rarely but are read on nearly every request, so each
+worker keeps a versioned in-memory snapshot of the whole tree. Commits
+which change categories bump a shared `VersionStamp`, then every worker
+reloads its snapshot on the next read.
+
+With `CATEGORY_CACHE_ENABLED` off, the tree is read from the closure
+table on every call instead.
+"""
+import os
+import threading
+import logging
+
+from flask import current_app, has_app_context
+
+from silly_blog.app import db
+from silly_blog.app.models import Category
+from silly_blog.contrib.changes import on_commit
+from silly_blog.contrib.stamp import VersionStamp
+
+
+LOG = logging.getLogger(__name__)
+
+# tables of the category tree
+CATEGORY_TABLES = frozenset(("categories", "category_closure"))
+
+
+def _sort_subs(subs):
+    """Sort subs the same as `ORDER BY display_order ASC`, NULLs first"""
+    subs.sort(key=lambda c: (c["display_order"] is not None,
+                             c["display_order"]))
+
+
+class CategoryTree(object):
+    """An in-memory snapshot of all categories."""
+
+    def __init__(self, categories, version=None):
+        self.version = version
+        self.infos = {}
+        self.parents = {}
+        self.children = {}
+        self.last_modified = None
+        for category in categories:
+            if (self.last_modified is None or
+                    (category.updated_at is not None and
+                     category.updated_at > self.last_modified)):
+                self.last_modified = category.updated_at
+            info = category.to_dict()
+            self.infos[category.id] = info
+            self.parents[category.id] = category.parent_id
+            if not category.protected:
+                self.children.setdefault(category.parent_id, []).append(info)
+        for subs in self.children.values():
+            _sort_subs(subs)
+
+    @classmethod
+    def load(cls, version=None):
+        """Load all categories in one query."""
+        return cls(Category.query.all(), version)
+
+    def validators(self):
+        """Returns `(count, max(updated_at))` of categories, any change of
+        the tree changes them.
+        """
+        return len(self.infos), self.last_modified
+
+    def lineages(self, category_ids):
+        """Returns a dict maps category id to a list of `(id, name)`
+        tuples, which starts from the root category and ends with itself.
+        """
+        lineages = {}
+        for category_id in set(category_ids):
+            lineage = []
+            current = category_id
+            while current in self.infos and len(lineage) < len(self.infos):
+                lineage.insert(0, (current, self.infos[current]["name"]))
+                current = self.parents[current]
+            if lineage:
+                lineages[category_id] = lineage
+        return lineages
+
+    def _with_subs(self, info, depth=0):
+        result = dict(info)
+        # NOTE: guard against cycles in dirty data
+        subs = (self.children.get(info["id"], [])
+                if depth < len(self.infos) else [])
+        result["subs"] = [self._with_subs(sub, depth + 1) for sub in subs]
+        return result
+
+    def get(self, category_id):
+        """Returns details of a category with its subs, or None."""
+        info = self.infos.get(category_id)
+        return self._with_subs(info) if info is not None else None
+
+    def to_dicts(self, categories):
+        """Returns a list of categories' details with their subs."""
+        return [self._with_subs(self.infos.get(category.id) or
+                                category.to_dict())
+                for category in categories]
+
+
+class QueryCategoryTree(object):
+    """Category tree which reads the closure table for every call."""
+
+    @staticmethod
+    def validators():
+        return db.session.query(
+            db.func.count(Category.id), db.func.max(Category.updated_at)).one()
+
+    @staticmethod
+    def lineages(category_ids):
+        return Category.get_lineages(category_ids)
+
+    def get(self, category_id):
+        category = Category.query.get(category_id)
+        return self.to_dicts([category])[0] if category else None
+
+    @staticmethod
+    def to_dicts(categories):
+        """Subtrees of all categories are loaded in one query."""
+        subtrees = Category.get_subtrees(c.id for c in categories)
+        return CategoryTree(subtrees).to_dicts(categories)
+
+
+class CategoryTreeCache(object):
+    """Per worker cache of the category tree."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self.stamp = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.stamp = VersionStamp(os.path.join(
+            app.config["VERSION_STAMP_DIR"], "categories.stamp"))
+        app.extensions["category_tree"] = self
+
+    def get(self):
+        # NOTE: read version before loading, so a concurrent change will
+        # be found on the next call.
+        version = self.stamp.current()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != version:
+            snapshot = CategoryTree.load(version)
+            with self._lock:
+                self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+        try:
+            self.stamp.bump()
+        except OSError:
+            LOG.exception("Bump version stamp %r failed", self.stamp.path)
+
+
+def get_category_tree():
+    """Returns the category tree for current app."""
+    cache = current_app.extensions.get("category_tree")
+    return cache.get() if cache is not None else QueryCategoryTree()
+
+
+@on_commit
+def _invalidate_on_commit(tables):
+    if not CATEGORY_TABLES.isdisjoint(tables) and has_app_context():
+        cache = current_app.extensions.get("category_tree")
+        if cache is not None:
+            cache.invalidate()
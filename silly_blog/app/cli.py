@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 import os
+import time
 
 import click
+from flask import current_app
 from flask.cli import with_appcontext
 from flask_migrate import cli
 
@@ -32,6 +34,150 @@ def tests_command():
     pytest.main('--rootdir=%s' % TESTS_DIR)
 
 
+@click.group('search')
+def search_command():
+    """Manage full-text search index of articles."""
+
+
+@search_command.command('rebuild')
+@with_appcontext
+def search_rebuild_command():
+    """Rebuild search index from all articles."""
+    from silly_blog.app import db
+    from silly_blog.app.search import rebuild
+    with db.engine.begin() as connection:
+        rebuild(connection)
+    click.echo('Rebuilt the search index.')
+
+
+@click.group('articles')
+def articles_command():
+    """Import or export articles as JSON Lines."""
+
+
+def _echo_progress(verb, count, started):
+    elapsed = max(time.time() - started, 1e-6)
+    click.echo('%s %d articles in %.1fs, %.0f rows/s'
+               % (verb, count, elapsed, count / elapsed), err=True)
+
+
+@articles_command.command('import')
+@click.argument('path')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Number of articles inserted per transaction.')
+@click.option('--gzip/--no-gzip', 'compress', default=None,
+              help='Whether the file is gzipped, guess by ".gz" suffix '
+                   'by default.')
+@with_appcontext
+def articles_import_command(path, batch_size, compress):
+    """Import articles from PATH, "-" for stdin."""
+    from silly_blog.app.transfer import Importer, open_jsonl
+    importer = Importer(batch_size)
+    started = time.time()
+    with open_jsonl(path, 'r', compress) as fp:
+        try:
+            for _ in importer.run(fp):
+                _echo_progress('Imported', importer.imported, started)
+        except ValueError as ex:
+            raise click.ClickException(str(ex))
+    _echo_progress('Imported', importer.imported, started)
+    if importer.skipped:
+        click.echo('Skipped %d existing articles.' % importer.skipped,
+                   err=True)
+    missing = importer.users.missing
+    if missing:
+        click.echo('Unknown users: %s.' % ', '.join(sorted(missing)),
+                   err=True)
+
+
+@articles_command.command('export')
+@click.argument('path')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Number of articles fetched at a time.')
+@click.option('--gzip/--no-gzip', 'compress', default=None,
+              help='Whether to gzip the file, guess by ".gz" suffix '
+                   'by default.')
+@with_appcontext
+def articles_export_command(path, batch_size, compress):
+    """Export articles to PATH, "-" for stdout."""
+    from silly_blog.app.transfer import Exporter, open_jsonl
+    exporter = Exporter(batch_size)
+    started = time.time()
+    with open_jsonl(path, 'w', compress) as fp:
+        for _ in exporter.run(fp):
+            _echo_progress('Exported', exporter.exported, started)
+    _echo_progress('Exported', exporter.exported, started)
+
+
+@click.command('seed')
+@click.option('--articles', default=10000, show_default=True,
+              help='Number of articles.')
+@click.option('--users', default=100, show_default=True,
+              help='Number of users, whose password is "silly123".')
+@click.option('--sources', default=3, show_default=True,
+              help='Number of sources.')
+@click.option('--tags', default=2000, show_default=True,
+              help='Number of tags.')
+@click.option('--categories-depth', 'depth', default=4, show_default=True,
+              help='Levels of the category tree.')
+@click.option('--categories-fanout', 'fanout', default=4, show_default=True,
+              help='Children of every category.')
+@click.option('--max-tags', default=5, show_default=True,
+              help='Maximum number of tags per article.')
+@click.option('--max-comments', default=3, show_default=True,
+              help='Maximum number of comments per article.')
+@click.option('--content-size', default=2000, show_default=True,
+              help='Mean size of contents in characters.')
+@click.option('--content-distribution', 'distribution', default='lognormal',
+              show_default=True,
+              type=click.Choice(['lognormal', 'uniform', 'fixed']),
+              help='Distribution of content sizes.')
+@click.option('--workers', default=0,
+              help='Number of processes generating articles, the number '
+                   'of CPUs by default.')
+@click.option('--batch-size', default=5000, show_default=True,
+              help='Number of articles inserted per transaction.')
+@click.option('--seed', default=0, show_default=True,
+              help='Seed of the random generator, the same seed and '
+                   'options generate the same data.')
+@with_appcontext
+def seed_command(seed, **options):
+    """Generate synthetic data for load testing."""
+    from silly_blog.app.seed import Seeder
+    try:
+        seeder = Seeder(seed=seed, **options)
+        started = time.time()
+        for _ in seeder.run():
+            _echo_progress('Seeded', seeder.inserted, started)
+    except ValueError as ex:
+        raise click.ClickException(str(ex))
+    _echo_progress('Seeded', seeder.inserted, started)
+
+
+@click.group('replicas')
+def replicas_command():
+    """Manage read replicas."""
+
+
+@replicas_command.command('sync')
+@with_appcontext
+def replicas_sync_command():
+    """Copy the primary SQLite database into replica SQLite files, for
+    local development of replicas.
+    """
+    from silly_blog.app import db
+    from silly_blog.app.replicas import copy_sqlite
+    keys = current_app.config['SQLALCHEMY_REPLICAS']
+    if not keys:
+        raise click.ClickException('No replicas are configured.')
+    try:
+        for key in keys:
+            copy_sqlite(db.engine, db.get_engine(bind=key))
+            click.echo('Synced replica %s.' % key)
+    except ValueError as ex:
+        raise click.ClickException(str(ex))
+
+
 def _db_upgrade_command():
     """Hack `flask_migrate.cli`.
 
@@ -50,4 +196,6 @@ db_upgrade_command = _db_upgrade_command()
 del _db_upgrade_command
 
 # All commands which will be added
-COMMANDS = (deploy_command, tests_command, db_upgrade_command)
+COMMANDS = (deploy_command, tests_command, db_upgrade_command,
+            search_command, articles_command, seed_command,
+            replicas_command)
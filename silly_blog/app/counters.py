@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Write-behind `views` and `stars` counters of articles.
+
+Increments are buffered in each worker process and flushed in batches:
+- by a background thread every `COUNTER_FLUSH_INTERVAL` seconds, uWSGI
+  needs `enable-threads` for it;
+- or at the end of a request once the interval passed, if
+  `COUNTER_FLUSH_THREAD` is off;
+- and before the process exits gracefully.
+"""
+import os
+import atexit
+import weakref
+import threading
+import logging
+
+from flask import current_app
+
+from silly_blog.app import db
+from silly_blog.app.models import Article
+from silly_blog.contrib.changes import publish
+from silly_blog.contrib.counters import CounterBuffer
+
+
+LOG = logging.getLogger(__name__)
+
+# counters of live apps, flushed by one exit handler of the process
+_live_counters = weakref.WeakSet()
+
+
+class ArticleCounters(object):
+    """Per worker buffer of article counters."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.buffer = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.buffer = CounterBuffer(
+            Article.__table__, ("views", "stars"),
+            interval=app.config["COUNTER_FLUSH_INTERVAL"],
+            untouched=("updated_at",))
+        app.extensions["counters"] = self
+        if not app.config["COUNTER_FLUSH_THREAD"]:
+            app.teardown_request(self._flush_if_due)
+        _live_counters.add(self)
+
+    def incr(self, article_id, column, delta=1):
+        self.buffer.incr(article_id, column, delta)
+        if self.app.config["COUNTER_FLUSH_THREAD"]:
+            self._ensure_thread()
+
+    def merge(self, info):
+        """Add pending deltas to counters of an article's details."""
+        return self.buffer.merge(info, info["id"])
+
+    def flush(self):
+        with self.app.app_context():
+            try:
+                count = self.buffer.flush(db.engine)
+            except Exception:
+                LOG.exception("Flush article counters failed")
+            else:
+                if count:
+                    LOG.debug("Flushed %d article counters", count)
+                    # NOTE: the engine's transaction isn't tracked by
+                    # sessions, validators and caches of articles are
+                    # invalidated here
+                    publish(Article.__tablename__)
+
+    def close(self):
+        self._stopped.set()
+        self.flush()
+
+    def _flush_if_due(self, exc=None):
+        if self.buffer.due():
+            self.flush()
+
+    def _ensure_thread(self):
+        # NOTE: threads don't survive fork, start one in every worker
+        pid = os.getpid()
+        if self._thread_pid == pid:
+            return
+        with self._lock:
+            if self._thread_pid == pid:
+                return
+            thread = threading.Thread(target=self._run,
+                                      name="article-counters", daemon=True)
+            thread.start()
+            self._thread_pid = pid
+
+    def _run(self):
+        while not self._stopped.wait(self.buffer.interval):
+            self.flush()
+
+
+@atexit.register
+def _close_all():
+    for counters in list(_live_counters):
+        counters.close()
+
+
+def get_counters():
+    """Returns article counters of current app."""
+    return current_app.extensions["counters"]
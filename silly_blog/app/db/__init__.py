@@ -15,9 +15,12 @@ def _init_app(self, app):
 
     1. Models are loaded when `init_app` is executed.
     2. Register exception filters for current engine.
+    3. Record queries of requests executed by current engine.
     """
     from silly_blog.app.db import models, exc_filters
+    from silly_blog.contrib.instrument import instrument_engine
     retval = _original_init(app)
     with app.app_context():
         exc_filters.register_engine(self.engine)
+        instrument_engine(self.engine)
     return retval
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics of requests, database pools and caches for Prometheus.
+
+Values are shared by all worker processes through `METRICS_DIR`, see
+`silly_blog.contrib.metrics`, and exposed by the `/metrics` endpoint.
+Endpoints are labeled by names of resources, e.g. "articles", "tags".
+"""
+import time
+
+from flask import current_app, g, request, has_app_context
+
+from silly_blog.app import db
+from silly_blog.contrib.metrics import (
+    MetricsStore, Metric, Counter, Gauge, Histogram, expose)
+
+
+# gauges of `PoolMetrics` snapshots
+_POOL_GAUGES = (
+    ("size", "Configured size of the pool."),
+    ("checkedin", "Idle connections in the pool."),
+    ("checkedout", "Connections in use."),
+    ("overflow", "Connections over the size of the pool."),
+    ("connects", "Connections opened by the workers alive."),
+    ("checkouts", "Checkouts of the workers alive."),
+    ("invalidations", "Invalidated connections of the workers alive."),
+)
+
+
+class HitRatio(Metric):
+    """Ratio of hits to lookups of each cache, derived from a counter
+    labeled by "cache" and "result".
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, counter):
+        super().__init__(counter.store, name, documentation, ["cache"])
+        self.counter = counter
+
+    def samples(self, values):
+        lookups, hits = {}, {}
+        for _, labels, value in self.counter.samples(values):
+            labels = dict(labels)
+            cache = labels["cache"]
+            lookups[cache] = lookups.get(cache, 0) + value
+            if labels["result"] == "hit":
+                hits[cache] = hits.get(cache, 0) + value
+        for cache in sorted(lookups):
+            if lookups[cache]:
+                yield (self.name, [("cache", cache)],
+                       hits.get(cache, 0) / lookups[cache])
+
+
+class RequestMetrics(object):
+    """Collect metrics of requests of every worker process."""
+
+    # seconds between updates of pool gauges of a worker
+    POOL_INTERVAL = 1.0
+
+    def __init__(self, app=None):
+        self.store = None
+        self.metrics = []
+        self._binds = ()
+        self._pool_updated = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.store = store = MetricsStore(app.config["METRICS_DIR"])
+        self.requests = Counter(
+            store, "http_requests_total",
+            "Requests by endpoint, method and status code.",
+            ["endpoint", "method", "status"])
+        self.latency = Histogram(
+            store, "http_request_duration_seconds",
+            "Latency of requests by endpoint and method.",
+            ["endpoint", "method"], buckets=app.config["METRICS_BUCKETS"])
+        self.in_progress = Gauge(
+            store, "http_requests_in_progress",
+            "Requests in progress by endpoint.", ["endpoint"])
+        self.pool = [(key, Gauge(store, "db_pool_" + key, doc, ["bind"]))
+                     for key, doc in _POOL_GAUGES]
+        self.cache_lookups = Counter(
+            store, "cache_lookups_total", "Lookups of caches by result.",
+            ["cache", "result"])
+        self.metrics = [self.requests, self.latency, self.in_progress] + \
+            [gauge for _, gauge in self.pool] + [
+                self.cache_lookups,
+                HitRatio("cache_hit_ratio", "Ratio of hits of caches.",
+                         self.cache_lookups)]
+        self._binds = [None] + list(app.config.get("SQLALCHEMY_REPLICAS", ()))
+
+        app.extensions["metrics"] = self
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    @staticmethod
+    def _endpoint():
+        # "api.articles" -> "articles"
+        return (request.endpoint or "none").rsplit(".", 1)[-1]
+
+    def _start(self):
+        g.metrics_started = time.perf_counter()
+        self.in_progress.inc(endpoint=self._endpoint())
+
+    def _finish(self, response):
+        started = g.get("metrics_started")
+        if started is not None:
+            endpoint = self._endpoint()
+            self.latency.observe(time.perf_counter() - started,
+                                 endpoint=endpoint, method=request.method)
+            self.requests.inc(endpoint=endpoint, method=request.method,
+                              status=str(response.status_code))
+        if time.time() - self._pool_updated > self.POOL_INTERVAL:
+            self.update_pool()
+        return response
+
+    def _teardown(self, exc=None):
+        if g.pop("metrics_started", None) is not None:
+            self.in_progress.dec(endpoint=self._endpoint())
+
+    def update_pool(self):
+        """Write pool gauges of this worker."""
+        self._pool_updated = time.time()
+        for bind in self._binds:
+            snapshot = db.pool_metrics(bind=bind)
+            for key, gauge in self.pool:
+                if key in snapshot:
+                    gauge.set(snapshot[key], bind=bind or "primary")
+
+    def record_cache(self, cache, hit):
+        self.cache_lookups.inc(cache=cache, result="hit" if hit else "miss")
+
+    def render(self):
+        """Returns metrics of all workers in the Prometheus text format."""
+        self.update_pool()
+        return expose(self.metrics, self.store.collect())
+
+
+def record_cache(cache, hit):
+    """Count a lookup of a cache, if metrics are enabled."""
+    if not has_app_context():
+        return
+    metrics = current_app.extensions.get("metrics")
+    if metrics is not None:
+        metrics.record_cache(cache, hit)
@@ -4,14 +4,19 @@ import uuid
 import random
 import datetime
 import logging
+import collections
 
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import func
+from flask import current_app
+from sqlalchemy import func, event
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import deferred
+from sqlalchemy.ext import baked
 from sqlalchemy.ext.hybrid import hybrid_property
 
-from silly_blog.app import db, auth, jws
-from silly_blog.contrib.utils import isotime
+from silly_blog.app import db, jws
+from silly_blog.contrib.hashing import HasherBusy
+from silly_blog.contrib.serializer import Serializer
+from silly_blog.contrib.changes import mark_changed
 
 
 LOG = logging.getLogger(__name__)
@@ -32,6 +37,13 @@ class UUIDMixin(object):
     id = db.Column(db.String(64), primary_key=True, default=_get_uuid)
 
 
+_bakery = baked.bakery()
+
+
+def _password_hasher():
+    return current_app.extensions["password_hasher"]
+
+
 class TimestampMixin(object):
     """Timestamp Mixin"""
     created_at = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow)
@@ -39,6 +51,10 @@ class TimestampMixin(object):
                            onupdate=datetime.datetime.utcnow)
 
 
+# serializers of models by `(model, included columns)`
+_serializers = {}
+
+
 class ModelBase(db.Model):
     """Extended base model class"""
     __abstract__ = True
@@ -51,33 +67,39 @@ class ModelBase(db.Model):
         new_d = d.copy()
         return cls(**new_d)
 
-    @staticmethod
-    def _converter(obj):
-        """Convert non-json-able object"""
-        mapper = {
-            datetime.datetime: (lambda x: isotime(x)),
-        }
-        converter = mapper.get(type(obj))
-        return converter(obj) if converter else obj
-
-    def to_dict(self, **kwargs):
-        """Returns the models'a attributes as a dictionary.
+    @classmethod
+    def serializer(cls, **kwargs):
+        """Returns a `Serializer` of the model, which is generated once for
+        every combination of included columns.
 
         The column in the `exclude` list will not be include, you can change
         this by set column name to True in `kwargs`.
         """
-        names = (column.name for column in self.__table__.columns
-                 if kwargs.get(column.name, False) or
-                 column.name not in self.excludes)
+        includes = frozenset(name for name, value in kwargs.items() if value)
+        key = (cls, includes)
+        serializer = _serializers.get(key)
+        if serializer is None:
+            serializer = Serializer(
+                cls, excludes=set(cls.excludes).difference(includes))
+            _serializers[key] = serializer
+        return serializer
 
-        return {name: self._converter(getattr(self, name)) for name in names}
+    def to_dict(self, **kwargs):
+        """Returns the models'a attributes as a dictionary, see
+        `serializer` for `kwargs`.
+        """
+        return self.serializer(**kwargs)(self)
 
-    def update(self, **kwargs):
+    def update(self, commit=True, **kwargs):
+        """Update attributes, and commit unless `commit` is False, so
+        the caller can write more in the same transaction.
+        """
         for key, value in kwargs.items():
             if hasattr(self, key):
                 setattr(self, key, value)
         db.session.add(self)
-        db.session.commit()
+        if commit:
+            db.session.commit()
 
     def delete(self):
         db.session.delete(self)
@@ -144,6 +166,12 @@ class FederatedUser(IdMixin, TimestampMixin, ModelBase):
 class LocalUser(IdMixin, TimestampMixin, ModelBase):
     """Local User Model"""
     __tablename__ = "local_users"
+    # keyset pagination of sortable columns, see `UserResource`
+    __table_args__ = (
+        db.Index("ix_local_users_name_user_id", "name", "user_id"),
+        db.Index("ix_local_users_created_at_user_id", "created_at", "user_id"),
+        db.Index("ix_local_users_updated_at_user_id", "updated_at", "user_id"),
+    )
     excludes = ["id", "user_id", "password"]
 
     user_id = db.Column(db.String(64),
@@ -237,13 +265,29 @@ class User(UUIDMixin, ModelBase):
     @password.setter
     def password(self, value):
         self.local_user = self.local_user or LocalUser()
-        self.local_user.password = generate_password_hash(value)
+        self.local_user.password = _password_hasher().hash(value)
 
     def check_password(self, password):
-        """Check that a plaintext password matches hashed."""
+        """Check that a plaintext password matches hashed.
+
+        :raise HasherBusy: too many pending password hashes
+        """
         if self.password is None or password is None:
             return False
-        return check_password_hash(self.password, password)
+        return _password_hasher().verify(self.password, password)
+
+    def rehash_password(self, password):
+        """Upgrade the stored hash to configured method and cost, returns
+        whether it is changed. The password must have been checked.
+        """
+        if not _password_hasher().needs_rehash(self.password):
+            return False
+        try:
+            self.password = password
+        except HasherBusy:
+            # try again on next login
+            return False
+        return True
 
     @staticmethod
     def get(user_id=None, name_email=None):
@@ -252,13 +296,36 @@ class User(UUIDMixin, ModelBase):
         if user_id:
             return User.query.get(user_id)
         elif name_email:
-            local_user = LocalUser.query.join(LocalUser.user).filter(db.or_(
-                LocalUser.name == name_email, LocalUser.email == name_email
-            )).first()
-            return local_user.user if local_user else None
+            return User.get_by_name_email(name_email)
         else:
             return None
 
+    @staticmethod
+    def get_by_name_email(name_email):
+        """Get user by name or email for login.
+
+        `name = ? OR email = ?` may not use the unique indexes of both
+        columns, probe them separately with a UNION instead. User, local
+        user and role are loaded in one query, which is baked.
+        """
+        return _bakery(User._login_query)(db.session()).params(
+            name_email=name_email).first()
+
+    @staticmethod
+    def _login_query(session):
+        name_email = db.bindparam("name_email")
+        probes = db.union(
+            db.select([LocalUser.user_id]).where(LocalUser.name == name_email),
+            db.select([LocalUser.user_id]).where(LocalUser.email == name_email),
+        ).alias("probes")
+        return session.query(User).\
+            join(probes, probes.c.user_id == User.id).\
+            join(User.local_user).\
+            outerjoin(User.role).\
+            options(db.contains_eager(User.local_user),
+                    db.contains_eager(User.role),
+                    db.lazyload(User.federated_users))
+
     def generate_auth_token(self):
         """Generate a `JWS` token for user"""
         data = dict(id=self.id)
@@ -278,6 +345,27 @@ class User(UUIDMixin, ModelBase):
             else:
                 return User.query.get(data["id"])
 
+    @staticmethod
+    def get_names(user_ids):
+        """Get names of users in batches, returns a dict maps id to name."""
+        user_ids = set(user_ids)
+        user_ids.discard(None)
+        if not user_ids:
+            return {}
+
+        names = dict(db.session.query(LocalUser.user_id, LocalUser.name).
+                     filter(LocalUser.user_id.in_(user_ids)))
+        # fall back to federated users, the same as `User.name`
+        missing = user_ids.difference(names)
+        if missing:
+            query = db.session.query(FederatedUser.user_id,
+                                     FederatedUser.unique_id).\
+                filter(FederatedUser.user_id.in_(missing)).\
+                order_by(FederatedUser.id.asc())
+            for user_id, unique_id in query:
+                names.setdefault(user_id, unique_id)
+        return names
+
     @staticmethod
     def insert_default_values():
         users = [
@@ -303,18 +391,30 @@ class User(UUIDMixin, ModelBase):
         db.session.commit()
 
 
-@auth.user_loader
-def _load_user(token):
-    """Register loader user callback for `HTTPTokenAuth`"""
-    if not token:
-        return None
-
-    return User.verify_auth_token(token)
+# Closure Table: materialize all ancestor-descendant paths of categories,
+# every category has a path to itself whose depth is 0.
+category_closure = db.Table(
+    "category_closure",
+    ModelBase.metadata,
+    db.Column("ancestor_id", db.String(64),
+              db.ForeignKey("categories.id", ondelete="CASCADE"),
+              primary_key=True),
+    db.Column("descendant_id", db.String(64),
+              db.ForeignKey("categories.id", ondelete="CASCADE"),
+              primary_key=True),
+    db.Column("depth", db.Integer, nullable=False),
+    db.Index("ix_category_closure_descendant", "descendant_id", "depth"),
+)
 
 
 class Category(UUIDMixin, TimestampMixin, ModelBase):
     """Article Category Model"""
     __tablename__ = "categories"
+    # keyset pagination of sortable columns, see `CategoryResource`
+    __table_args__ = (
+        db.Index("ix_categories_display_order_id", "display_order", "id"),
+        db.Index("ix_categories_name_id", "name", "id"),
+    )
 
     name = db.Column(db.String(255), unique=True, nullable=False)
     description = db.Column(db.Text, nullable=True)
@@ -369,6 +469,48 @@ class Category(UUIDMixin, TimestampMixin, ModelBase):
         generator = mapper.get(method)
         return generator() if generator else None
 
+    @classmethod
+    def get_lineages(cls, category_ids):
+        """Get hierarchies of categories in one query.
+
+        Returns a dict maps category id to a list of `(id, name)` tuples,
+        which starts from the root category and ends with itself.
+        """
+        category_ids = set(category_ids)
+        category_ids.discard(None)
+        if not category_ids:
+            return {}
+
+        closure = category_closure
+        query = db.session.query(closure.c.descendant_id, cls.id, cls.name).\
+            join(closure, closure.c.ancestor_id == cls.id).\
+            filter(closure.c.descendant_id.in_(category_ids)).\
+            order_by(closure.c.depth.desc())
+        lineages = {}
+        for descendant_id, id_, name in query:
+            lineages.setdefault(descendant_id, []).append((id_, name))
+        return lineages
+
+    @classmethod
+    def get_subtrees(cls, category_ids):
+        """Get categories in subtrees of categories(included) in one query."""
+        category_ids = set(category_ids)
+        if not category_ids:
+            return []
+
+        closure = category_closure
+        descendants = db.select([closure.c.descendant_id]).\
+            where(closure.c.ancestor_id.in_(category_ids))
+        return cls.query.filter(cls.id.in_(descendants)).all()
+
+    @classmethod
+    def get_subtree_ids(cls, category_id):
+        """Get ids of categories in subtree of a category(included)."""
+        closure = category_closure
+        query = db.session.query(closure.c.descendant_id).\
+            filter(closure.c.ancestor_id == category_id)
+        return {descendant_id for descendant_id, in query}
+
     @staticmethod
     def insert_default_values():
         category = Category(name="database",
@@ -378,6 +520,57 @@ class Category(UUIDMixin, TimestampMixin, ModelBase):
         db.session.commit()
 
 
+@event.listens_for(Category, "after_insert")
+def _insert_category_paths(mapper, connection, target):
+    """Add paths from ancestors of a new category to itself."""
+    closure = category_closure
+    connection.execute(closure.insert(), ancestor_id=target.id,
+                       descendant_id=target.id, depth=0)
+    if target.parent_id is not None:
+        connection.execute(closure.insert().from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            db.select([closure.c.ancestor_id,
+                       db.literal(target.id),
+                       closure.c.depth + 1]).
+            where(closure.c.descendant_id == target.parent_id)))
+
+
+@event.listens_for(Category, "after_update")
+def _move_category_paths(mapper, connection, target):
+    """Move subtree of a category while its parent changes."""
+    if not db.inspect(target).attrs.parent_id.history.has_changes():
+        return
+
+    closure = category_closure
+    # NOTE: MySQL can't select from the table to delete in a subquery.
+    subtree_ids = [row[0] for row in connection.execute(
+        db.select([closure.c.descendant_id]).
+        where(closure.c.ancestor_id == target.id))]
+    connection.execute(closure.delete().where(db.and_(
+        closure.c.descendant_id.in_(subtree_ids),
+        db.not_(closure.c.ancestor_id.in_(subtree_ids)))))
+
+    if target.parent_id is not None:
+        supertree = closure.alias("supertree")
+        subtree = closure.alias("subtree")
+        connection.execute(closure.insert().from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            db.select([supertree.c.ancestor_id,
+                       subtree.c.descendant_id,
+                       supertree.c.depth + subtree.c.depth + 1]).
+            where(db.and_(supertree.c.descendant_id == target.parent_id,
+                          subtree.c.ancestor_id == target.id))))
+
+
+@event.listens_for(Category, "after_delete")
+def _delete_category_paths(mapper, connection, target):
+    """Remove paths from or to a deleted category."""
+    closure = category_closure
+    connection.execute(closure.delete().where(db.or_(
+        closure.c.ancestor_id == target.id,
+        closure.c.descendant_id == target.id)))
+
+
 # Multiple-Multiple-Mapping Table: associate articles with tags
 article_tag_mapping = db.Table(
     "article_tag_mapping",
@@ -392,9 +585,32 @@ article_tag_mapping = db.Table(
 )
 
 
+# Stars of articles by users, every user stars an article once
+article_stars = db.Table(
+    "article_stars",
+    ModelBase.metadata,
+    db.Column("article_id", db.String(64),
+              db.ForeignKey("articles.id", ondelete="CASCADE"),
+              primary_key=True),
+    db.Column("user_id", db.String(64),
+              db.ForeignKey("users.id", ondelete="CASCADE"),
+              primary_key=True),
+    db.Column("created_at", db.TIMESTAMP, default=datetime.datetime.utcnow),
+)
+
+
+TagRow = collections.namedtuple("TagRow", "id name")
+
+
 class Tag(UUIDMixin, TimestampMixin, ModelBase):
     """Article Tag Model"""
     __tablename__ = "tags"
+    # keyset pagination of sortable columns, see `TagResource`
+    __table_args__ = (
+        db.Index("ix_tags_name_id", "name", "id"),
+        db.Index("ix_tags_created_at_id", "created_at", "id"),
+        db.Index("ix_tags_updated_at_id", "updated_at", "id"),
+    )
 
     name = db.Column(db.String(64), unique=True, nullable=False)
 
@@ -402,6 +618,93 @@ class Tag(UUIDMixin, TimestampMixin, ModelBase):
                                backref=db.backref("tags", lazy="dynamic"),
                                lazy="dynamic")
 
+    @staticmethod
+    def get_by_articles(article_ids):
+        """Get tags of articles in batches.
+
+        Returns a dict maps article id to a list of tags, which are ordered
+        by associate time asc. Tags are read-only rows of `id` and `name`
+        rather than entities.
+        """
+        article_ids = set(article_ids)
+        if not article_ids:
+            return {}
+
+        query = db.session.query(article_tag_mapping.c.article_id,
+                                 Tag.id, Tag.name).\
+            join(article_tag_mapping, article_tag_mapping.c.tag_id == Tag.id).\
+            filter(article_tag_mapping.c.article_id.in_(article_ids)).\
+            order_by(article_tag_mapping.c.created_at.asc(), Tag.name.asc())
+        tags = {}
+        for article_id, tag_id, name in query:
+            tags.setdefault(article_id, []).append(TagRow(tag_id, name))
+        return tags
+
+    @staticmethod
+    def resolve(specs):
+        """Resolve tags of an article in the current transaction.
+
+        :param specs: a list of dicts with "id" of an existing tag, or
+            "name" of a tag which is created if missing
+        :return: a list of tag ids in the order of `specs`, unknown ids
+            are ignored
+        """
+        ids = {spec["id"] for spec in specs if spec.get("id")}
+        names = {spec["name"] for spec in specs
+                 if not spec.get("id") and spec.get("name")}
+        if not ids and not names:
+            return []
+
+        criteria = []
+        if ids:
+            criteria.append(Tag.id.in_(ids))
+        if names:
+            criteria.append(Tag.name.in_(names))
+        rows = db.session.query(Tag.id, Tag.name).filter(db.or_(*criteria))
+        known_ids = set()
+        name_ids = {}
+        for tag_id, name in rows:
+            known_ids.add(tag_id)
+            name_ids[name] = tag_id
+
+        missing = names.difference(name_ids)
+        if missing:
+            Tag.insert_missing(missing)
+            name_ids.update(db.session.query(Tag.name, Tag.id).
+                            filter(Tag.name.in_(missing)))
+
+        tag_ids = []
+        for spec in specs:
+            tag_id = (spec["id"] if spec.get("id") in known_ids
+                      else name_ids.get(spec.get("name")))
+            if tag_id and tag_id not in tag_ids:
+                tag_ids.append(tag_id)
+        return tag_ids
+
+    @classmethod
+    def insert_missing(cls, names):
+        """Insert tags of names in the current transaction, names which
+        exist, e.g. created concurrently, are ignored.
+        """
+        now = datetime.datetime.utcnow()
+        values = [{"id": _get_uuid(), "name": name,
+                   "created_at": now, "updated_at": now}
+                  for name in sorted(names)]
+        dialect = db.session.get_bind(cls.__mapper__).dialect.name
+        if dialect in ("sqlite", "mysql"):
+            statement = cls.__table__.insert().\
+                prefix_with("OR IGNORE", dialect="sqlite").\
+                prefix_with("IGNORE", dialect="mysql")
+            db.session.execute(statement, values)
+        else:
+            for value in values:
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(cls.__table__.insert(), value)
+                except IntegrityError:
+                    pass
+        mark_changed(db.session(), cls.__tablename__)
+
 
 class Source(UUIDMixin, ModelBase):
     """Article Source Model"""
@@ -413,6 +716,17 @@ class Source(UUIDMixin, ModelBase):
                                backref=db.backref("source", uselist=False),
                                lazy="dynamic")
 
+    @staticmethod
+    def get_names(source_ids):
+        """Get names of sources in batches, returns a dict maps id to name."""
+        source_ids = set(source_ids)
+        source_ids.discard(None)
+        if not source_ids:
+            return {}
+
+        return dict(db.session.query(Source.id, Source.name).
+                    filter(Source.id.in_(source_ids)))
+
     @staticmethod
     def insert_default_values():
         names = ("原创", "转载", "翻译")
@@ -425,6 +739,13 @@ class Source(UUIDMixin, ModelBase):
 class Article(UUIDMixin, TimestampMixin, ModelBase):
     """Article Model"""
     __tablename__ = "articles"
+    # keyset pagination of sortable columns, see `ArticleResource`
+    __table_args__ = (
+        db.Index("ix_articles_published_at_id", "published_at", "id"),
+        db.Index("ix_articles_created_at_id", "created_at", "id"),
+        db.Index("ix_articles_updated_at_id", "updated_at", "id"),
+        db.Index("ix_articles_title_id", "title", "id"),
+    )
     excludes = ["content", "user_id", "category_id", "source_id"]
 
     title = db.Column(db.String(255), nullable=False)
@@ -449,7 +770,54 @@ class Article(UUIDMixin, TimestampMixin, ModelBase):
 
     def get_tags(self):
         """Get article tags order by associate time asc"""
-        return self.tags.order_by(article_tag_mapping.c.created_at.asc()).all()
+        # NOTE: tags associated in one flush may share the time
+        return self.tags.order_by(article_tag_mapping.c.created_at.asc(),
+                                  Tag.name.asc()).all()
+
+    @staticmethod
+    def add_star(article_id, user_id):
+        """Record a star of a user in the current transaction.
+
+        :return: whether the user didn't star the article before
+        """
+        try:
+            with db.session.begin_nested():
+                db.session.execute(article_stars.insert(), {
+                    "article_id": article_id, "user_id": user_id,
+                    "created_at": datetime.datetime.utcnow()})
+        except IntegrityError:
+            return False
+        return True
+
+    def set_tags(self, tag_ids):
+        """Replace tags of the article in the current transaction, only
+        the difference is deleted or inserted. The article must have
+        been flushed.
+
+        :param tag_ids: a list of tag ids, in the order of association
+        :return: whether tags are changed
+        """
+        mapping = article_tag_mapping
+        current = {tag_id for tag_id, in db.session.query(mapping.c.tag_id).
+                   filter(mapping.c.article_id == self.id)}
+        removed = current.difference(tag_ids)
+        added = [tag_id for tag_id in tag_ids if tag_id not in current]
+
+        if removed:
+            db.session.execute(mapping.delete().where(db.and_(
+                mapping.c.article_id == self.id,
+                mapping.c.tag_id.in_(removed))))
+        if added:
+            # keep the order by associate time
+            now = datetime.datetime.utcnow()
+            db.session.execute(mapping.insert(), [
+                {"id": _get_uuid(), "article_id": self.id, "tag_id": tag_id,
+                 "created_at": now + datetime.timedelta(microseconds=i)}
+                for i, tag_id in enumerate(added)])
+        if removed or added:
+            mark_changed(db.session(), mapping.name)
+            return True
+        return False
 
 
 class Comment(UUIDMixin, TimestampMixin, ModelBase):
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Principals of authenticated requests.
+
+Verifying a token needs a HMAC check and loading the user with its local
+user, federated users and role. Each worker caches tokens mapped to a
+lightweight `Principal` instead, until the token expires. Commits which
+change users, local users or roles bump a shared version stamp, then
+every worker discards its cached principals.
+"""
+import time
+import logging
+import collections
+
+from flask import current_app, has_app_context
+from silly_blog.app import db, auth, jws
+from silly_blog.app.metrics import record_cache
+from silly_blog.app.models import User, LocalUser, Role
+from silly_blog.contrib.cache import MemoryCache, TagVersions
+from silly_blog.contrib.changes import on_commit
+
+
+LOG = logging.getLogger(__name__)
+
+_TAGS = ("principals",)
+# tables of principals
+PRINCIPAL_TABLES = frozenset(("users", "local_users", "roles"))
+
+
+Principal = collections.namedtuple("Principal", "id name role enabled")
+
+
+def get_principal(user_id):
+    """Load the principal of a user in one query, or None."""
+    row = db.session.query(User.id, LocalUser.name, Role.name, User.enabled).\
+        outerjoin(LocalUser, LocalUser.user_id == User.id).\
+        outerjoin(Role, Role.id == User.role_id).\
+        filter(User.id == user_id).first()
+    if row is None:
+        return None
+
+    principal = Principal(*row)
+    if principal.name is None:
+        # federated users only
+        principal = principal._replace(
+            name=User.get_names([user_id]).get(user_id))
+    return principal
+
+
+class PrincipalCache(object):
+    """Per worker cache maps tokens to principals."""
+
+    def __init__(self, app=None):
+        self.cache = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        tags = TagVersions(app.config["VERSION_STAMP_DIR"])
+        self.cache = MemoryCache(max_bytes=app.config["PRINCIPAL_CACHE_SIZE"],
+                                 tags=tags, sizeof=lambda principal: 1)
+        app.extensions["principals"] = self
+
+    def load(self, token):
+        principal = self.cache.get(token)
+        record_cache("principals", principal is not None)
+        if principal is not None:
+            return principal
+
+        versions = self.cache.versions(_TAGS)
+        try:
+            payload, header = jws.decode(token, return_header=True)
+        except Exception:
+            LOG.exception("Verify auth token {!r} failed".format(token))
+            return None
+        if not payload or payload.get("id") is None:
+            return None
+        principal = get_principal(payload["id"])
+        if principal is None:
+            return None
+
+        # expires with the token
+        ttl = header.get("exp", 0) - time.time()
+        if ttl > 0:
+            self.cache.set(token, principal, ttl=ttl, tags=_TAGS,
+                           versions=versions)
+        return principal
+
+    def invalidate(self):
+        try:
+            self.cache.tags.bump(_TAGS)
+        except OSError:
+            LOG.exception("Invalidate principals failed")
+
+
+@auth.user_loader
+def _load_user(token):
+    """Register loader user callback for `HTTPTokenAuth`"""
+    if not token:
+        return None
+
+    principal = current_app.extensions["principals"].load(token)
+    return principal if principal and principal.enabled else None
+
+
+@on_commit
+def _invalidate_on_commit(tables):
+    if not PRINCIPAL_TABLES.isdisjoint(tables) and has_app_context():
+        cache = current_app.extensions.get("principals")
+        if cache is not None:
+            cache.invalidate()
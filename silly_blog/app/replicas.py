@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Routing of read-only requests to replica databases.
+
+Replicas are binds named by `SQLALCHEMY_REPLICAS`, e.g.
+    SQLALCHEMY_BINDS = {'replica1': 'mysql://...', 'replica2': ...}
+    SQLALCHEMY_REPLICAS = ['replica1', 'replica2']
+
+GET and HEAD requests of API resources read from a replica, chosen round
+robin per request, and everything else goes to the primary. Replicas may
+lag behind, so after a successful write every request of the same token
+reads from the primary for `REPLICA_STICKY_SECONDS`, the window is shared
+by all workers on the host. A replica which fails to connect or execute
+is ejected for `REPLICA_EJECT_SECONDS` in the worker, the failed read is
+retried on the primary, and if all of them are ejected, reads go to the
+primary.
+
+Locally, replicas are SQLite files kept in sync by `flask replicas sync`.
+"""
+import time
+import logging
+import itertools
+import threading
+
+from flask import g, request, has_request_context
+from sqlalchemy import event, exc
+
+from silly_blog.app import db, auth
+from silly_blog.contrib.cache import FileSystemCache
+
+
+LOG = logging.getLogger(__name__)
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+_READ_METHODS = ("GET", "HEAD")
+
+
+class ReplicaRouter(object):
+    """Choose replica engines for read-only API requests."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.keys = ()
+        self.sticky = None
+        self.eject_seconds = None
+        self._ejected = {}
+        self._counter = itertools.count()
+        self._watched = set()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        binds = app.config.get("SQLALCHEMY_BINDS") or {}
+        self.keys = tuple(app.config["SQLALCHEMY_REPLICAS"])
+        unknown = [key for key in self.keys if key not in binds]
+        if unknown:
+            raise ValueError("Unknown replica binds: %s" % ", ".join(unknown))
+        self.app = app
+        self.eject_seconds = app.config["REPLICA_EJECT_SECONDS"]
+        self.sticky = FileSystemCache(
+            app.config["REPLICA_STICKY_DIR"],
+            default_ttl=app.config["REPLICA_STICKY_SECONDS"])
+
+        app.extensions["replicas"] = self
+        app.before_request(self._route)
+        app.after_request(self._stick)
+
+    def healthy(self):
+        """Returns keys of replicas which aren't ejected."""
+        now = time.time()
+        return [key for key in self.keys
+                if self._ejected.get(key, 0) <= now]
+
+    def choose(self):
+        """Returns key of the next healthy replica, or None."""
+        keys = self.healthy()
+        if not keys:
+            return None
+        return keys[next(self._counter) % len(keys)]
+
+    def eject(self, key):
+        LOG.warning("Eject replica %s for %ss", key, self.eject_seconds)
+        self._ejected[key] = time.time() + self.eject_seconds
+
+    def engine(self, key):
+        """Returns the engine of a replica, which ejects the replica on
+        connection or operational errors.
+        """
+        engine = db.get_engine(self.app, bind=key)
+        if key not in self._watched:
+            with self._lock:
+                if key not in self._watched:
+                    self._watch(key, engine)
+                    self._watched.add(key)
+        return engine
+
+    def _watch(self, key, engine):
+        @event.listens_for(engine, "handle_error")
+        def _on_error(context):
+            if context.is_disconnect or isinstance(
+                    context.sqlalchemy_exception, exc.OperationalError):
+                self.eject(key)
+
+    def get_bind(self):
+        """Returns the replica engine of current request, or None to use
+        the primary.
+        """
+        if not has_request_context():
+            return None
+        key = g.get("replica")
+        if key is None or self._ejected.get(key, 0) > time.time():
+            return None
+        return self.engine(key)
+
+    def fall_back(self):
+        """Read from the primary for the rest of current request."""
+        g.replica = None
+
+    def is_sticky(self, token):
+        """Whether requests of `token` should read from the primary."""
+        return self.sticky.get(token) is not None
+
+    def _route(self):
+        g.replica = None
+        if request.method not in _READ_METHODS or request.blueprint != "api":
+            return
+        token = auth.get_token()
+        if token is not None and self.is_sticky(token):
+            return
+        g.replica = self.choose()
+
+    def _stick(self, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            token = auth.get_token()
+            if token is not None:
+                self.sticky.set(token, b"1")
+        return response
+
+
+def copy_sqlite(source, target):
+    """Copy a SQLite database into another with the online backup API.
+
+    :param source: engine of the source database
+    :param target: engine of the target database
+    :raise ValueError: either isn't a SQLite database file
+    """
+    for engine in (source, target):
+        if engine.dialect.name != "sqlite" or \
+                engine.url.database in (None, "", ":memory:"):
+            raise ValueError("%s isn't a SQLite database file" % engine.url)
+    # NOTE: pooled connections of the target must not see a half copy
+    target.dispose()
+    source_connection = source.raw_connection()
+    target_connection = target.raw_connection()
+    try:
+        source_connection.connection.backup(target_connection.connection)
+    finally:
+        target_connection.close()
+        source_connection.close()
+    target.dispose()
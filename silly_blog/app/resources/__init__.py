@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
-from flask import Blueprint
+from flask import Blueprint, Response
 from flask_restful import Api
 
+from silly_blog.contrib.fastjson import dumps
+
 
 api_bp = Blueprint('api', __name__)
 api = Api(api_bp)
 
 
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    """Serialize responses with the app's JSON encoder."""
+    return Response(dumps(data), status=code, headers=headers,
+                    mimetype='application/json')
+
+
 from silly_blog.app.resources import (
     token, category, tag, source, user, role, article)  # noqa
@@ -3,19 +3,25 @@
 import datetime
 import logging
 
-from flask import g, request
+from flask import g, request, current_app
 import flask_restful as restful
-from sqlalchemy.exc import DatabaseError, IntegrityError
-from sqlalchemy.sql.elements import UnaryExpression
-from sqlalchemy.orm.attributes import InstrumentedAttribute
+from sqlalchemy.exc import DatabaseError
 from marshmallow import Schema, fields
 from marshmallow.validate import Length
 
 from silly_blog.app import db, auth
 from silly_blog.app.resources import api
-from silly_blog.app.models import Article, Tag, LocalUser
+from silly_blog.app.models import Article, Tag, LocalUser, User, Source
+from silly_blog.app.category_tree import get_category_tree
+from silly_blog.app.search import search
+from silly_blog.app.counters import get_counters
+from silly_blog.app.table_versions import get_table_versions, ARTICLE_TABLES
 from silly_blog.contrib.utils import (envelope_json_required, str2bool,
-                                      make_error_response, parse_isotime)
+                                      make_error_response)
+from silly_blog.contrib.listing import QueryPlan, Filter
+from silly_blog.contrib.conditional import (make_etag, not_modified,
+                                            with_validators, validator_headers)
+from silly_blog.contrib.streaming import stream_format, stream_collection
 
 
 LOG = logging.getLogger(__name__)
@@ -57,130 +63,139 @@ class ArticleResource(restful.Resource):
 
     post_schema = CreateArticleSchema()
     put_schema = UpdateArticleSchema()
+    # NOTE: listings are read-only, select columns which responses need
+    # rather than hydrate entities
+    list_columns = Article.serializer().columns + (
+        Article.user_id, Article.category_id, Article.source_id)
+    list_plan = QueryPlan(
+        lambda session: session.query(
+            *ArticleResource.list_columns).outerjoin(
+            LocalUser, LocalUser.user_id == Article.user_id),
+        sortable=(Article.published_at, Article.created_at,
+                  Article.updated_at, Article.title),
+        default_sort="published_at",
+        since=Article.created_at,
+        filters=[
+            Filter("published", Article.published, convert=str2bool),
+            Filter("title", Article.title, op="like",
+                   convert=str.strip, skip_empty=True),
+            Filter("user", LocalUser.name, op="like",
+                   convert=str.strip, skip_empty=True),
+            Filter("user_id", Article.user_id),
+            Filter("category_id", Article.category_id),
+            Filter("source_id", Article.source_id),
+        ])
+
+    @classmethod
+    def _article_to_dict(cls, article, content=False):
+        """Get a dict of article's details"""
+        return cls._articles_to_dicts([article], content=content)[0]
 
     @staticmethod
-    def _article_to_dict(article, content=False):
-        """Get a dict of article's details"""
-        info = article.to_dict(content=content)
-        info["user"] = {
-            "id": article.user_id,
-            "name": article.user.name
-        }
-        # article's categories is a list with hierarchies
-        info["category"] = []
-        category = article.category
-        while category:
-            info["category"].insert(0, {
-                "id": category.id,
-                "name": category.name
-            })
-            category = category.parent
-
-        info["source"] = {
-            "id": article.source.id,
-            "name": article.source.name,
-        }
-        info["tags"] = [{"id": tag.id, "name": tag.name}
-                        for tag in article.get_tags()]
-
-        return info
+    def _articles_to_dicts(articles, content=False):
+        """Get a list of articles' details.
+
+        `articles` are entities or rows of `list_columns`. Users,
+        categories, sources and tags of all articles are loaded in
+        batches, so the number of queries doesn't grow with the number
+        of articles.
+        """
+        serialize = Article.serializer(content=content)
+        user_names = User.get_names(a.user_id for a in articles)
+        lineages = get_category_tree().lineages(
+            a.category_id for a in articles)
+        source_names = Source.get_names(a.source_id for a in articles)
+        tags = Tag.get_by_articles(a.id for a in articles)
+        counters = get_counters()
+
+        results = []
+        for article in articles:
+            info = counters.merge(serialize(article))
+            info["user"] = {
+                "id": article.user_id,
+                "name": user_names.get(article.user_id),
+            }
+            # article's categories is a list with hierarchies
+            info["category"] = [
+                {"id": id_, "name": name}
+                for id_, name in lineages.get(article.category_id, [])
+            ]
+            info["source"] = {
+                "id": article.source_id,
+                "name": source_names.get(article.source_id),
+            }
+            info["tags"] = [{"id": tag.id, "name": tag.name}
+                            for tag in tags.get(article.id, [])]
+            results.append(info)
+
+        return results
+
+    @classmethod
+    def _stream_dicts(cls, batches, content=False):
+        """Get lists of articles' details batch by batch."""
+        for rows in batches:
+            yield cls._articles_to_dicts(rows, content=content)
 
     def _get_by_id(self, article_id):
         article = Article.query.get(article_id)
         if not article:
             return make_error_response(404, "article %r not found" % article_id)
 
-        return {"article": self._article_to_dict(article, content=True)}
+        # NOTE: details contain pending counters, which don't change
+        # `updated_at`, so only the etag validates them. A client's copy
+        # is current if counters didn't change since, except for its
+        # own view which is counted now.
+        counters = get_counters()
+        counts = counters.merge({"id": article.id, "views": article.views,
+                                 "stars": article.stars})
+        etag = make_etag(article.id, article.updated_at,
+                         counts["views"], counts["stars"])
+        response = not_modified(etag, article.updated_at,
+                                modified_since=False)
+        counters.incr(article.id, "views")
+        if response is not None:
+            return response
+        etag = make_etag(article.id, article.updated_at,
+                         counts["views"] + 1, counts["stars"])
+        return with_validators(
+            {"article": self._article_to_dict(article, content=True)},
+            etag, article.updated_at)
 
     def get(self, article_id=None):
         if article_id:
             return self._get_by_id(article_id)
 
-        query = db.session.query(Article, LocalUser).outerjoin(LocalUser, LocalUser.user_id==Article.user_id)
-        # filter by 'published' field, 'None' means nothing to do.
-        published = request.args.get("published")
-        if published is not None:
-            published = str2bool(published)
-            query = query.filter(Article.published==published)
-        # filter by 'title' field
-        title = request.args.get("title", "").strip()
-        if title:
-            exp = Article.title.like(''.join(['%', title, '%']))
-            query = query.filter(exp)
-        # filter by `user` field
-        user = request.args.get("user", "").strip()
-        if user:
-            exp = LocalUser.name.like(''.join(['%', user, '%']))
-            query = query.filter(exp)
-        # filter by `user_id`
-        user_id = request.args.get("user_id")
-        if user_id is not None:
-            query = query.filter_by(user_id=user_id)
-        # filter by `category_id`
-        category_id = request.args.get("category_id")
-        if category_id is not None:
-            query = query.filter(Article.category_id==category_id)
-        # filter by `source_id`
-        source_id = request.args.get("source_id")
-        if source_id is not None:
-            query = query.filter(Article.source_id==source_id)
-
-        # since
-        since = request.args.get("since")
-        if since is not None:
-            try:
-                since = parse_isotime(since)
-            except ValueError as ex:
-                return make_error_response(400, str(ex))
-            else:
-                query = query.filter(Article.created_at >= since)
-
-        # order by related
-        sort = request.args.get("sort", "published_at")
-        sort_attribute = getattr(Article, sort, None)
-        if not isinstance(sort_attribute, InstrumentedAttribute):
-            return make_error_response(400, "Unknown sort %r" % sort)
-        direction = request.args.get("direction", "desc")
         try:
-            sort_method = getattr(sort_attribute, direction)
-            sort_exp = sort_method()
-            if not isinstance(sort_exp, UnaryExpression):
-                raise TypeError("Not a unary expression!")
-        except (AttributeError, TypeError, NotImplementedError):
-            return make_error_response(400, "Unknown direction %r" % direction)
-        else:
-            query = query.order_by(sort_exp)
-
-        # before offset and limit, we get the entry total number
-        total = query.count()
-
-        # offset limit related
-        page = request.args.get("page", None)
-        pagesize = request.args.get("pagesize", None)
-        if page and pagesize:
-            try:
-                page = int(page)
-            except ValueError:
-                return make_error_response(400, "Unknown page %r" % page)
-            try:
-                pagesize = int(pagesize)
-            except ValueError:
-                return make_error_response(400, "Unknown pagesize %r" % pagesize)
-
-            offset = (page - 1) * pagesize  # page starts from 1
-            if offset < 0:
-                offset = 0
-            query = query.offset(offset).limit(pagesize)
-
-        articles = query.all()
-        print(articles)
+            listing = self.list_plan.parse(request.args)
+            # full-text search, order by relevance unless sort is given
+            q = request.args.get("q", "").strip()
+            if q:
+                search(listing, q, ranked="sort" not in request.args)
+            fmt = stream_format()
+        except ValueError as ex:
+            return make_error_response(400, str(ex))
+        etag = make_etag(get_table_versions().current(ARTICLE_TABLES), fmt)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
         # with content or not
         content = request.args.get("content", False)
-        return {
-            "articles": [self._article_to_dict(article, content=content)
-                         for article, _ in articles],
-            "total": total,
-        }
+        if content:
+            listing.add_criteria(
+                lambda q: q.add_columns(Article.content), "content")
+
+        if fmt is not None:
+            batches, meta = listing.batches(
+                db.session(), current_app.config["STREAM_BATCH_SIZE"])
+            return stream_collection(
+                "articles", meta,
+                self._stream_dicts(batches, content=content), fmt,
+                headers=validator_headers(etag))
+
+        rows, meta = listing.all(db.session())
+        meta["articles"] = self._articles_to_dicts(rows, content=content)
+        return with_validators(meta, etag)
 
     @auth.login_required
     @envelope_json_required("article")
@@ -209,31 +224,19 @@ class ArticleResource(restful.Resource):
         user_id = result.data.pop("user_id", None)
         published = result.data.get("published")
         article = Article.from_dict(result.data)
-        article.user = auth.current_user
+        principal = auth.current_user
+        article.user_id = principal.id if principal else None
         if published:
             article.published_at = datetime.datetime.utcnow()
 
-        for _tag in tags:
-            tag_id = _tag.get("id")
-            tag_name = _tag.get("name")
-            tag = None
-            if tag_id:
-                tag = Tag.query.get(tag_id)
-            elif tag_name:
-                tag = Tag(name=tag_name)
-                try:
-                    db.session.add(tag)
-                    db.session.commit()
-                except IntegrityError:
-                    db.session.rollback()
-                    tag = Tag.query.filter_by(name=tag_name).first()
-            if tag:
-                article.tags.append(tag)
-
         try:
             db.session.add(article)
+            # NOTE: article id is generated on flush
+            db.session.flush()
+            article.set_tags(Tag.resolve(tags))
             db.session.commit()
         except DatabaseError as ex:
+            db.session.rollback()
             LOG.exception("An unknown db error occurred")
             return make_error_response(500, "DB Error", ex.code)
         else:
@@ -262,39 +265,15 @@ class ArticleResource(restful.Resource):
             article.published_at = datetime.datetime.utcnow()
 
         tags = result.data.pop("tags", [])
-        article.update(**result.data)
-
-        # clear tags first and add
-        # if tags:
-        #    article.tags = []
-        #    db.session.add(article)
-        include_tags = set()
-        for _tag in tags:
-            tag_id = _tag.get("id")
-            tag_name = _tag.get("name")
-            tag = None
-            if tag_id:
-                tag = Tag.query.get(tag_id)
-            elif tag_name:
-                tag = Tag(name=tag_name)
-                try:
-                    db.session.add(tag)
-                    db.session.commit()
-                except IntegrityError:
-                    db.session.rollback()
-                    tag = Tag.query.filter_by(name=tag_name).first()
-            if tag:
-                include_tags.add(tag)
-                if tag not in article.tags:
-                    article.tags.append(tag)
-        for _tag in article.tags[:]:
-            if _tag not in include_tags:
-                article.tags.remove(_tag)
-
         try:
-            db.session.add(article)
+            # NOTE: fields and tags are updated in one transaction
+            article.update(commit=False, **result.data)
+            if article.set_tags(Tag.resolve(tags)):
+                # NOTE: tags are part of article details, so change validators
+                article.updated_at = datetime.datetime.utcnow()
             db.session.commit()
         except DatabaseError as ex:
+            db.session.rollback()
             LOG.exception("An unknown db error occurred")
             return make_error_response(500, "DB Error", ex.code)
         else:
@@ -317,3 +296,36 @@ class ArticleResource(restful.Resource):
             return make_error_response(500, "DB Error", ex.code)
         else:
             return None, 204
+
+
+@api.resource("/articles/<string:article_id>/stars",
+              methods=["POST"],
+              endpoint="article_stars")
+class ArticleStarResource(restful.Resource):
+    """Controller for stars of an article"""
+
+    @auth.login_required
+    def post(self, article_id):
+        """Star an article, once per user."""
+        article = db.session.query(Article.id, Article.stars).\
+            filter(Article.id == article_id).first()
+        if not article:
+            return make_error_response(404, "Article %r not found" % article_id)
+
+        # NOTE: stars are counted per user, even if auth isn't forced
+        principal = auth.current_user
+        if principal is None:
+            return make_error_response(401, "Unauthorized Access")
+        try:
+            starred = Article.add_star(article_id, principal.id)
+            db.session.commit()
+        except DatabaseError as ex:
+            db.session.rollback()
+            LOG.exception("An unknown db error occurred")
+            return make_error_response(500, "DB Error", ex.code)
+
+        counters = get_counters()
+        if starred:
+            counters.incr(article_id, "stars")
+        return {"article": counters.merge({"id": article.id,
+                                           "stars": article.stars})}
@@ -5,17 +5,18 @@ import logging
 from flask import g, request
 import flask_restful as restful
 from sqlalchemy.exc import DatabaseError, IntegrityError
-from sqlalchemy.sql.elements import UnaryExpression
-from sqlalchemy.orm.attributes import InstrumentedAttribute
 from marshmallow import Schema, fields, post_load
 from marshmallow.validate import Length
 
 from silly_blog.app import db, auth
 from silly_blog.app.resources import api
 from silly_blog.app.models import Category
+from silly_blog.app.category_tree import get_category_tree
 from silly_blog.contrib.utils import (envelope_json_required,
-                                      make_error_response,
-                                      parse_isotime)
+                                      make_error_response)
+from silly_blog.contrib.listing import QueryPlan, Filter
+from silly_blog.contrib.conditional import (make_etag, not_modified,
+                                            with_validators)
 
 
 LOG = logging.getLogger(__name__)
@@ -61,94 +62,60 @@ class CategoryResource(restful.Resource):
 
     post_schema = CreateCategorySchema()
     put_schema = UpdateCategorySchema()
-
-    def _to_dict(self, category):
-        """Get a dict of category's details"""
-        info = category.to_dict()
-        subs = category.children.filter_by(protected=False).order_by(Category.display_order.asc()).all()
-        info["subs"] = [self._to_dict(sub) for sub in subs]
-        return info
+    list_plan = QueryPlan(
+        lambda session: session.query(Category),
+        sortable=(Category.display_order, Category.name),
+        default_sort="display_order",
+        since=Category.updated_at,
+        filters=[
+            # NOTE: if parent_id is empty string, it is equivalent to None
+            Filter("parent_id", Category.parent_id,
+                   convert=lambda value: value or None),
+            Filter("name", Category.name, op="like"),
+            Filter("description", Category.description, op="like"),
+        ])
+
+    @staticmethod
+    def _validators():
+        """Details of categories contain their subs, so validators of
+        both a category and a list are of the whole tree, which answer
+        `If-None-Match` only.
+        """
+        tree = get_category_tree()
+        count, last_modified = tree.validators()
+        etag = make_etag(count, last_modified)
+        return tree, etag, last_modified
 
     def _get_by_id(self, category_id):
-        category = Category.query.get(category_id)
-        if not category:
+        tree, etag, last_modified = self._validators()
+        response = not_modified(etag, last_modified, modified_since=False)
+        if response is not None:
+            return response
+
+        info = tree.get(category_id)
+        if not info:
             return make_error_response(404, "Category %r not found" % category_id)
 
-        return {"category": self._to_dict(category)}
+        return with_validators({"category": info}, etag, last_modified)
 
     def get(self, category_id=None):
         """List categories or show details of a specified one."""
         if category_id:
             return self._get_by_id(category_id)
 
-        query = Category.query
-
-        # filter by parent_id
-        if "parent_id" in request.args:
-            # NOTE: if parent_id is empty string, it is equivalent to None
-            parent_id = request.args["parent_id"] or None
-            query = query.filter_by(parent_id=parent_id)
-
-        # filter by name or description
-        search_attrs = ("name", "description")
-        for attr in search_attrs:
-            search_val = request.args.get(attr)
-            if search_val is not None:
-                exp = getattr(Category, attr).like(''.join(['%', search_val, '%']))
-                query = query.filter(exp)
-
-        # since
-        since = request.args.get("since")
-        if since is not None:
-            try:
-                since = parse_isotime(since)
-            except ValueError as ex:
-                return make_error_response(400, str(ex))
-            else:
-                query = query.filter(Category.updated_at >= since)
-
-        # order by related
-        sort = request.args.get("sort", "display_order")
-        sort_attribute = getattr(Category, sort, None)
-        if not isinstance(sort_attribute, InstrumentedAttribute):
-            return make_error_response(400, "Unknown sort %r" % sort)
-        direction = request.args.get("direction", "desc")
         try:
-            sort_method = getattr(sort_attribute, direction)
-            sort_exp = sort_method()
-            if not isinstance(sort_exp, UnaryExpression):
-                raise TypeError("Not a unary expression!")
-        except (AttributeError, TypeError):
-            return make_error_response(400, "Unknown direction %r" % direction)
-        else:
-            query = query.order_by(sort_exp)
-
-        # before offset and limit, we get the entry total number
-        total = query.count()
-
-        # offset limit related
-        page = request.args.get("page", None)
-        pagesize = request.args.get("pagesize", None)
-        if page and pagesize:
-            try:
-                page = int(page)
-            except ValueError:
-                return make_error_response(400, "Unknown page %r" % page)
-            try:
-                pagesize = int(pagesize)
-            except ValueError:
-                return make_error_response(400, "Unknown pagesize %r" % pagesize)
-
-            offset = (page - 1) * pagesize  # page starts from 1
-            if offset < 0:
-                offset = 0
-            query = query.offset(offset).limit(pagesize)
-
-        categories = query.all()
-        return {
-            "categories": [self._to_dict(category) for category in categories],
-            "total": total,
-        }
+            listing = self.list_plan.parse(request.args)
+        except ValueError as ex:
+            return make_error_response(400, str(ex))
+
+        tree, etag, last_modified = self._validators()
+        response = not_modified(etag, last_modified, modified_since=False)
+        if response is not None:
+            return response
+
+        categories, meta = listing.all(db.session())
+        meta["categories"] = tree.to_dicts(categories)
+        return with_validators(meta, etag, last_modified)
 
     @auth.login_required
     @envelope_json_required("category")
@@ -200,6 +167,11 @@ class CategoryResource(restful.Resource):
         category = Category.query.get(category_id)
         if not category:
             return make_error_response(404, "Category %r not found" % category_id)
+        parent_id = result.data.get("parent_id")
+        if parent_id and parent_id in Category.get_subtree_ids(category.id):
+            return make_error_response(
+                400, "Category %r can't be moved under itself or its "
+                     "descendants" % category_id)
         try:
             category.update(**result.data)
         except IntegrityError as ex:
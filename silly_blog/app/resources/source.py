@@ -4,9 +4,12 @@ import logging
 
 import flask_restful as restful
 
+from silly_blog.app import db
 from silly_blog.app.resources import api
 from silly_blog.app.models import Source
 from silly_blog.contrib.utils import make_error_response
+from silly_blog.contrib.conditional import (make_etag, not_modified,
+                                            with_validators)
 
 
 LOG = logging.getLogger(__name__)
@@ -23,14 +26,20 @@ class SourceResource(restful.Resource):
         if not source:
             return make_error_response(404, "Source %r not found" % source_id)
 
-        return {"source": source.to_dict()}
+        data = {"source": source.to_dict()}
+        etag = make_etag(data)
+        return not_modified(etag) or with_validators(data, etag)
 
     def get(self, source_id=None):
         """List sources or show details of a specified one."""
         if source_id:
             return self._get_by_id(source_id)
 
-        sources = Source.query.all()
-        return {
-            "sources": [source.to_dict() for source in sources]
+        serialize = Source.serializer().from_row
+        rows = db.session.query(*Source.serializer().columns)
+        # NOTE: sources have no timestamps, validate the body instead
+        data = {
+            "sources": [serialize(row) for row in rows]
         }
+        etag = make_etag(data)
+        return not_modified(etag) or with_validators(data, etag)
@@ -2,20 +2,22 @@
 # -*- coding: utf-8 -*-
 import logging
 
-from flask import g, request
+from flask import g, request, current_app
 import flask_restful as restful
 from sqlalchemy.exc import DatabaseError, IntegrityError
-from sqlalchemy.sql.elements import UnaryExpression
-from sqlalchemy.orm.attributes import InstrumentedAttribute
 from marshmallow import Schema, fields, post_load
 from marshmallow.validate import Length
 
 from silly_blog.app import db, auth
 from silly_blog.app.resources import api
 from silly_blog.app.models import Tag
+from silly_blog.app.table_versions import get_table_versions, TAG_TABLES
 from silly_blog.contrib.utils import (envelope_json_required,
-                                      make_error_response,
-                                      parse_isotime)
+                                      make_error_response)
+from silly_blog.contrib.listing import QueryPlan, Filter
+from silly_blog.contrib.conditional import (make_etag, not_modified,
+                                            with_validators, validator_headers)
+from silly_blog.contrib.streaming import stream_format, stream_collection
 
 
 LOG = logging.getLogger(__name__)
@@ -46,6 +48,14 @@ class TagResource(restful.Resource):
 
     post_schema = CreateTagSchema()
     put_schema = UpdateTagSchema()
+    # NOTE: rows are plain tuples of columns rather than ORM objects
+    list_plan = QueryPlan(
+        lambda session: session.query(*Tag.serializer().columns),
+        sortable=(Tag.name, Tag.created_at, Tag.updated_at),
+        default_sort="updated_at",
+        since=Tag.updated_at,
+        # regexp maybe not supported, use like instead
+        filters=[Filter("name", Tag.name, op="like")])
 
     @staticmethod
     def _get_by_id(tag_id):
@@ -53,75 +63,40 @@ class TagResource(restful.Resource):
         if not tag:
             return make_error_response(404, "Tag %r not found" % tag_id)
         
-        return {"tag": tag.to_dict()}
+        etag = make_etag(tag.id, tag.updated_at)
+        response = not_modified(etag, tag.updated_at)
+        if response is not None:
+            return response
+        return with_validators({"tag": tag.to_dict()}, etag, tag.updated_at)
 
     def get(self, tag_id=None):
         """List tags or show details of a specified one."""
         if tag_id:
             return self._get_by_id(tag_id)
 
-        # refactor
-        query = Tag.query
-
-        # filter by name
-        name = request.args.get("name")
-        if name is not None:
-            # regexp maybe not supported, use like instead
-            exp = Tag.name.like(''.join(['%', name, '%']))
-            query = query.filter(exp)
-
-        # since
-        since = request.args.get("since")
-        if since is not None:
-            try:
-                since = parse_isotime(since)
-            except ValueError as ex:
-                return make_error_response(400, str(ex))
-            else:
-                query = query.filter(Tag.updated_at >= since)
-
-        # order by related
-        sort = request.args.get("sort", "updated_at")
-        sort_attribute = getattr(Tag, sort, None)
-        if not isinstance(sort_attribute, InstrumentedAttribute):
-            return make_error_response(400, "Unknown sort %r" % sort)
-        direction = request.args.get("direction", "desc")
         try:
-            sort_method = getattr(sort_attribute, direction)
-            sort_exp = sort_method()
-            if not isinstance(sort_exp, UnaryExpression):
-                raise TypeError("Not a unary expression!")
-        except (AttributeError, TypeError):
-            return make_error_response(400, "Unknown direction %r" % direction)
-        else:
-            query = query.order_by(sort_exp)
-
-        # before offset and limit, we get the entry total number
-        total = query.count()
-
-        # offset limit related
-        page = request.args.get("page", None)
-        pagesize = request.args.get("pagesize", None)
-        if page and pagesize:
-            try:
-                page = int(page)
-            except ValueError:
-                return make_error_response(400, "Unknown page %r" % page)
-            try:
-                pagesize = int(pagesize)
-            except ValueError:
-                return make_error_response(400, "Unknown pagesize %r" % pagesize)
-
-            offset = (page - 1) * pagesize # page starts from 1
-            if offset < 0:
-                offset = 0
-            query = query.offset(offset).limit(pagesize)
-
-        tags = query.all()
-        return {
-            "tags": [tag.to_dict() for tag in tags],
-            "total": total,
-        }
+            listing = self.list_plan.parse(request.args)
+            fmt = stream_format()
+        except ValueError as ex:
+            return make_error_response(400, str(ex))
+
+        etag = make_etag(get_table_versions().current(TAG_TABLES), fmt)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        if fmt is not None:
+            batches, meta = listing.batches(
+                db.session(), current_app.config["STREAM_BATCH_SIZE"])
+            serialize = Tag.serializer().from_row
+            items = ([serialize(row) for row in rows] for rows in batches)
+            return stream_collection("tags", meta, items, fmt,
+                                     headers=validator_headers(etag))
+
+        rows, meta = listing.all(db.session())
+        serialize = Tag.serializer().from_row
+        meta["tags"] = [serialize(row) for row in rows]
+        return with_validators(meta, etag)
 
     @auth.login_required
     @envelope_json_required("tag")
@@ -5,10 +5,11 @@ import logging
 
 from flask import g
 import flask_restful as restful
+from sqlalchemy.exc import DatabaseError
 from marshmallow import Schema, fields
 from marshmallow.validate import Length
 
-from silly_blog.app import auth, jws
+from silly_blog.app import db, auth, jws
 from silly_blog.app.resources import api
 from silly_blog.app.models import User
 from silly_blog.contrib.utils import envelope_json_required, make_error_response
@@ -40,7 +41,7 @@ class AuthResource(restful.Resource):
                 "user": {
                     "id": user.id,
                     "name": user.name,
-                    "role": user.role.name,
+                    "role": user.role,
                 },
             }
         }
@@ -67,9 +68,17 @@ class AuthResource(restful.Resource):
         elif not user.check_password(result.data["password"]):
             return make_error_response(401, "Invalid password")
         else:
+            # upgrade the hash to configured method and cost transparently
+            try:
+                if user.rehash_password(result.data["password"]):
+                    db.session.commit()
+            except DatabaseError:
+                db.session.rollback()
+                LOG.exception("Upgrade password hash of %r failed", user.id)
+
             now = datetime.datetime.utcnow()
             expired_at = now + datetime.timedelta(
-                seconds=jws.get_expires_in())
+                seconds=jws.expires_in)
             return {
                 "token": {
                     "id": user.generate_auth_token(),
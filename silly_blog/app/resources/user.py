@@ -2,20 +2,22 @@
 # -*- coding: utf-8 -*-
 import logging
 
-from flask import g, request
+from flask import g, request, current_app
 import flask_restful as restful
 from sqlalchemy.exc import DatabaseError, IntegrityError
-from sqlalchemy.sql.elements import UnaryExpression
-from sqlalchemy.orm.attributes import InstrumentedAttribute
 from marshmallow import Schema, fields, post_load
 from marshmallow.validate import Length, Email
 
 from silly_blog.app import db, auth
 from silly_blog.app.resources import api
 from silly_blog.app.models import User, LocalUser
+from silly_blog.app.table_versions import get_table_versions, USER_TABLES
 from silly_blog.contrib.utils import (envelope_json_required,
-                                      make_error_response,
-                                      parse_isotime)
+                                      make_error_response)
+from silly_blog.contrib.listing import QueryPlan, Filter
+from silly_blog.contrib.conditional import (make_etag, not_modified,
+                                            with_validators, validator_headers)
+from silly_blog.contrib.streaming import stream_format, stream_collection
 
 
 LOG = logging.getLogger(__name__)
@@ -56,6 +58,21 @@ class UserResource(restful.Resource):
 
     post_schema = CreateUserSchema()
     put_schema = UpdateUserSchema()
+    list_plan = QueryPlan(
+        lambda session: session.query(User).join(User.local_user).options(
+            db.joinedload(User.local_user), db.joinedload(User.role)),
+        # NOTE: never secrets, e.g. password, cursors carry sort values
+        sortable=(LocalUser.name, LocalUser.created_at, LocalUser.updated_at),
+        default_sort="updated_at",
+        # NOTE: equals `User.id`, and indexes of sortable columns end with it
+        id_column=LocalUser.user_id,
+        since=LocalUser.created_at,
+        # regexp maybe not supported, use like instead
+        filters=[
+            Filter("name", LocalUser.name, op="like"),
+            Filter("email", LocalUser.email, op="like"),
+        ],
+        key=lambda user, sort: (getattr(user.local_user, sort), user.id))
 
     @staticmethod
     def _user_to_dict(user):
@@ -71,79 +88,40 @@ class UserResource(restful.Resource):
         if not user:
             return make_error_response(404, "User %r not found" % user_id)
 
-        return {"user": self._user_to_dict(user)}
+        updated_at = user.local_user.updated_at if user.local_user else None
+        etag = make_etag(user.id, updated_at, user.role_id)
+        response = not_modified(etag, updated_at)
+        if response is not None:
+            return response
+        return with_validators({"user": self._user_to_dict(user)},
+                               etag, updated_at)
 
     def get(self, user_id=None):
         if user_id:
             return self._get_by_id(user_id)
 
-        # TODO: DB QUERY OPTIMIZE
-        query = User.query.join(User.local_user)
-
-        # filter by name or email
-        name = request.args.get("name")
-        if name is not None:
-            # regexp maybe not supported, use like instead
-            exp = LocalUser.name.like(''.join(['%', name, '%']))
-            query = query.filter(exp)
-        email = request.args.get("email")
-        if email is not None:
-            exp = LocalUser.email.like(''.join(['%', email, '%']))
-            query = query.filter(exp)
-
-        # since
-        since = request.args.get("since")
-        if since is not None:
-            try:
-                since = parse_isotime(since)
-            except ValueError as ex:
-                return make_error_response(400, str(ex))
-            else:
-                query = query.filter(LocalUser.created_at >= since)
-
-        # order by related
-        sort = request.args.get("sort", "updated_at")
-        sort_attribute = getattr(LocalUser, sort, None)
-        if not isinstance(sort_attribute, InstrumentedAttribute):
-            return make_error_response(400, "Unknown sort %r" % sort)
-        direction = request.args.get("direction", "desc")
         try:
-            sort_method = getattr(sort_attribute, direction)
-            sort_exp = sort_method()
-            if not isinstance(sort_exp, UnaryExpression):
-                raise TypeError("Not a unary expression!")
-        except (AttributeError, TypeError):
-            return make_error_response(400, "Unknown direction %r" % direction)
-        else:
-            query = query.order_by(sort_exp)
-
-        # before offset and limit, we get the entry total number
-        total = query.count()
-
-        # offset limit related
-        page = request.args.get("page", None)
-        pagesize = request.args.get("pagesize", None)
-        if page and pagesize:
-            try:
-                page = int(page)
-            except ValueError:
-                return make_error_response(400, "Unknown page %r" % page)
-            try:
-                pagesize = int(pagesize)
-            except ValueError:
-                return make_error_response(400, "Unknown pagesize %r" % pagesize)
-
-            offset = (page - 1) * pagesize  # page starts from 1
-            if offset < 0:
-                offset = 0
-            query = query.offset(offset).limit(pagesize)
-
-        users = query.options(db.joinedload(User.local_user)).options(
-            db.joinedload(User.role)).all()
-        return {
-            "users": [self._user_to_dict(user) for user in users],
-            "total": total,
-        }
+            listing = self.list_plan.parse(request.args)
+            fmt = stream_format()
+        except ValueError as ex:
+            return make_error_response(400, str(ex))
+
+        etag = make_etag(get_table_versions().current(USER_TABLES), fmt)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        if fmt is not None:
+            batches, meta = listing.batches(
+                db.session(), current_app.config["STREAM_BATCH_SIZE"])
+            items = ([self._user_to_dict(user) for user in rows]
+                     for rows in batches)
+            return stream_collection("users", meta, items, fmt,
+                                     headers=validator_headers(etag))
+
+        users, meta = listing.all(db.session())
+        meta["users"] = [self._user_to_dict(user) for user in users]
+        return with_validators(meta, etag)
 
     @auth.login_required
     @envelope_json_required("user")
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Response cache of anonymous GET requests.
+
+Responses of public read endpoints are cached by path and normalized
+query arguments. Each endpoint depends on some tables, entries are
+tagged with them, and commits which write those tables invalidate the
+entries in all worker processes, see `silly_blog.app.table_versions`.
+
+Backend is chosen by `RESPONSE_CACHE_BACKEND`:
+- "memory": an LRU cache in each worker;
+- "filesystem": a directory shared by all workers;
+- None: disabled.
+"""
+import json
+import logging
+
+from flask import g, request, Response
+from werkzeug.urls import url_encode
+
+from silly_blog.app import auth
+from silly_blog.app.metrics import record_cache
+from silly_blog.app.table_versions import ARTICLE_TABLES, TAG_TABLES
+from silly_blog.contrib.cache import MemoryCache, FileSystemCache
+from silly_blog.contrib.streaming import accepts_ndjson
+
+
+LOG = logging.getLogger(__name__)
+
+
+def _count_view():
+    from silly_blog.app.counters import get_counters
+    get_counters().incr(request.view_args["article_id"], "views")
+
+
+# maps endpoint to `(tables, callback on hits)`
+RULES = {
+    "api.articles": (ARTICLE_TABLES, None),
+    # NOTE: a cache hit is still a view
+    "api.article": (ARTICLE_TABLES, _count_view),
+    "api.categories": (("categories",), None),
+    "api.category": (("categories",), None),
+    "api.tags": (TAG_TABLES, None),
+    "api.tag": (TAG_TABLES, None),
+    "api.sources": (("sources",), None),
+    "api.source": (("sources",), None),
+}
+
+
+def _dump_response(status, headers, body):
+    # NOTE: not pickle, files of a shared cache must not run code
+    return json.dumps([status, headers]).encode("utf-8") + b"\n" + body
+
+
+def _load_response(value):
+    meta, _, body = value.partition(b"\n")
+    status, headers = json.loads(meta.decode("utf-8"))
+    return Response(body, status=status, headers=headers)
+
+
+class ResponseCache(object):
+    """Cache responses of anonymous GET requests."""
+
+    def __init__(self, app=None):
+        self.cache = None
+        self.tags = None
+        self.ttl = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config["RESPONSE_CACHE_BACKEND"]
+        self.ttl = app.config["RESPONSE_CACHE_TTL"]
+        self.tags = app.extensions["table_versions"].tags
+        options = dict(default_ttl=self.ttl,
+                       max_bytes=app.config["RESPONSE_CACHE_MAX_BYTES"],
+                       tags=self.tags)
+        if backend == "memory":
+            self.cache = MemoryCache(**options)
+        elif backend == "filesystem":
+            self.cache = FileSystemCache(app.config["RESPONSE_CACHE_DIR"],
+                                         **options)
+        else:
+            raise ValueError("Unknown response cache backend %r" % backend)
+
+        app.extensions["response_cache"] = self
+        app.before_request(self._load)
+        app.after_request(self._save)
+
+    @staticmethod
+    def _make_key():
+        # normalize arguments: sorted and encoded in the same way
+        args = url_encode(request.args, sort=True)
+        # NOTE: lists negotiate their format by `Accept`
+        fmt = " ndjson" if accepts_ndjson() else ""
+        return "%s?%s%s" % (request.path, args, fmt)
+
+    @staticmethod
+    def _cacheable():
+        return (request.method == "GET" and request.endpoint in RULES and
+                auth.get_token() is None)
+
+    def _load(self):
+        if not self._cacheable():
+            return None
+
+        key = self._make_key()
+        cached = self.cache.get(key)
+        record_cache("responses", cached is not None)
+        tables, on_hit = RULES[request.endpoint]
+        if cached is None:
+            # NOTE: the view handles misses, e.g. counts the view itself
+            g.response_cache = (key, tables, self.cache.versions(tables))
+            return None
+        if on_hit is not None:
+            on_hit()
+
+        response = _load_response(cached)
+        response.headers["X-Cache"] = "HIT"
+        return response.make_conditional(request)
+
+    def _save(self, response):
+        pending = g.pop("response_cache", None)
+        if (pending is None or response.status_code != 200 or
+                response.is_streamed):
+            return response
+
+        key, tables, versions = pending
+        response.headers["X-Cache"] = "MISS"
+        headers = [(k, v) for k, v in response.headers if k != "X-Cache"]
+        try:
+            value = _dump_response(response.status_code, headers,
+                                   response.get_data())
+            self.cache.set(key, value, tags=tables, versions=versions)
+        except OSError:
+            LOG.exception("Cache response of %r failed", key)
+        return response
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Full-text search of articles' title, summary and content.
+
+- SQLite: an external content FTS5 table `articles_fts` indexes rows of
+  `articles` by rowid, triggers keep it in sync on insert/update/delete.
+  Results are ranked by bm25.
+- MySQL: a FULLTEXT index with ngram parser, which is maintained by
+  InnoDB itself. Results are ranked by MATCH ... AGAINST relevance.
+- Others: fall back to LIKE without ranking.
+
+NOTE: SQLite's VACUUM may change rowids of `articles`, run
+`flask search rebuild` after that.
+"""
+import logging
+import contextlib
+
+from sqlalchemy import (DDL, event, bindparam, literal_column, func, text,
+                        table, column)
+
+from silly_blog.app import db
+from silly_blog.app.models import Article
+
+
+LOG = logging.getLogger(__name__)
+
+# title matters most, then summary, then content
+WEIGHTS = (10.0, 5.0, 1.0)
+
+
+class SearchBackend(object):
+    """Base class of search backends."""
+
+    name = None
+    ddl = ()
+    drop_ddl = ()
+
+    @staticmethod
+    def normalize(q):
+        """Returns value of the `q` bound parameter."""
+        return q
+
+    def apply(self, query):
+        """Filter matched articles."""
+        raise NotImplementedError()
+
+    def rank(self):
+        """Returns a order by clause, the most relevant first."""
+        return None
+
+    def rebuild(self, connection):
+        """Rebuild the index from `articles`."""
+        pass
+
+    def suspend(self, connection):
+        """Stop indexing inserted articles, for bulk inserts."""
+        pass
+
+    def resume(self, connection):
+        """Index inserted articles again, and the suspended ones."""
+        pass
+
+
+class SQLiteSearch(SearchBackend):
+    name = "sqlite"
+
+    ddl = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5("
+        "title, summary, content, "
+        "content='articles', content_rowid='rowid', tokenize='unicode61')",
+        "CREATE TRIGGER IF NOT EXISTS articles_fts_ai "
+        "AFTER INSERT ON articles BEGIN "
+        "INSERT INTO articles_fts(rowid, title, summary, content) "
+        "VALUES (new.rowid, new.title, new.summary, new.content); END",
+        "CREATE TRIGGER IF NOT EXISTS articles_fts_ad "
+        "AFTER DELETE ON articles BEGIN "
+        "INSERT INTO articles_fts(articles_fts, rowid, title, summary, content) "
+        "VALUES ('delete', old.rowid, old.title, old.summary, old.content); END",
+        # NOTE: only reindex when indexed columns change, not counters.
+        "CREATE TRIGGER IF NOT EXISTS articles_fts_au "
+        "AFTER UPDATE OF title, summary, content ON articles BEGIN "
+        "INSERT INTO articles_fts(articles_fts, rowid, title, summary, content) "
+        "VALUES ('delete', old.rowid, old.title, old.summary, old.content); "
+        "INSERT INTO articles_fts(rowid, title, summary, content) "
+        "VALUES (new.rowid, new.title, new.summary, new.content); END",
+    )
+    drop_ddl = (
+        "DROP TRIGGER IF EXISTS articles_fts_au",
+        "DROP TRIGGER IF EXISTS articles_fts_ad",
+        "DROP TRIGGER IF EXISTS articles_fts_ai",
+        "DROP TABLE IF EXISTS articles_fts",
+    )
+
+    def __init__(self):
+        self.fts = table("articles_fts", column("rowid"))
+        self.onclause = self.fts.c.rowid == literal_column("articles.rowid")
+        fts = literal_column("articles_fts")
+        self.criterion = fts.op("MATCH")(bindparam("q"))
+        self.order = func.bm25(fts, *WEIGHTS)
+
+    @staticmethod
+    def normalize(q):
+        """Quote every word, so they are matched as strings rather than
+        FTS5 query syntax, and all of them are required.
+        """
+        return " ".join('"%s"' % word.replace('"', '""') for word in q.split())
+
+    def apply(self, query):
+        return query.join(self.fts, self.onclause).filter(self.criterion)
+
+    def rank(self):
+        return self.order
+
+    def rebuild(self, connection):
+        connection.execute(
+            "INSERT INTO articles_fts(articles_fts) VALUES ('rebuild')")
+
+    # NOTE: indexing rows one by one in the trigger takes longer than
+    # inserting them, a rebuild afterwards is much faster
+    def suspend(self, connection):
+        connection.execute("DROP TRIGGER IF EXISTS articles_fts_ai")
+
+    def resume(self, connection):
+        connection.execute(self.ddl[1])
+        self.rebuild(connection)
+
+
+class MySQLSearch(SearchBackend):
+    name = "mysql"
+
+    ddl = ("ALTER TABLE articles ADD FULLTEXT INDEX ft_articles "
+           "(title, summary, content) WITH PARSER ngram",)
+    # NOTE: the index is dropped along with `articles` table
+    drop_ddl = ()
+
+    def __init__(self):
+        self.match = text(
+            "MATCH (articles.title, articles.summary, articles.content) "
+            "AGAINST (:q IN NATURAL LANGUAGE MODE)")
+
+    def apply(self, query):
+        return query.filter(self.match)
+
+    def rank(self):
+        return db.desc(self.match)
+
+    def rebuild(self, connection):
+        connection.execute("ALTER TABLE articles DROP INDEX ft_articles")
+        for statement in self.ddl:
+            connection.execute(statement)
+
+
+class LikeSearch(SearchBackend):
+    name = "default"
+
+    def __init__(self):
+        pattern = bindparam("q")
+        self.criterion = db.or_(Article.title.like(pattern),
+                                Article.summary.like(pattern),
+                                Article.content.like(pattern))
+
+    @staticmethod
+    def normalize(q):
+        return "".join(["%", q, "%"])
+
+    def apply(self, query):
+        return query.filter(self.criterion)
+
+
+_backends = {cls.name: cls() for cls in (SQLiteSearch, MySQLSearch)}
+_default_backend = LikeSearch()
+
+
+def get_backend(dialect_name):
+    """Returns search backend for a database dialect."""
+    return _backends.get(dialect_name, _default_backend)
+
+
+def search(listing, q, ranked=True):
+    """Restrict a listing of articles to those matched `q`.
+
+    :param listing: a `silly_blog.contrib.listing.Listing` of articles
+    :param q: words to search
+    :param ranked: order by relevance rather than the sort column
+    :raise ValueError: relevance order is used with cursor pagination
+    """
+    backend = get_backend(db.session.get_bind(Article.__mapper__).dialect.name)
+    listing.params["q"] = backend.normalize(q)
+    listing.add_criteria(backend.apply, "search", backend.name)
+    order = backend.rank() if ranked else None
+    if order is not None:
+        listing.order_by(order, "search", backend.name)
+
+
+def rebuild(connection):
+    """Rebuild search index from `articles`."""
+    get_backend(connection.dialect.name).rebuild(connection)
+
+
+@contextlib.contextmanager
+def bulk_insert(connection):
+    """Defer indexing of articles inserted in the block."""
+    backend = get_backend(connection.dialect.name)
+    backend.suspend(connection)
+    try:
+        yield
+    finally:
+        with connection.begin():
+            backend.resume(connection)
+
+
+# Create or drop search index along with `articles` table
+for _backend in _backends.values():
+    for _statement in _backend.ddl:
+        event.listen(Article.__table__, "after_create",
+                     DDL(_statement).execute_if(dialect=_backend.name))
+    for _statement in _backend.drop_ddl:
+        event.listen(Article.__table__, "before_drop",
+                     DDL(_statement).execute_if(dialect=_backend.name))
+del _backend, _statement
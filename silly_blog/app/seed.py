@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic data for load testing.
+
+`Seeder` generates users, sources, a category tree, tags, articles with
+their tag mappings and comments, deterministically from a seed, and bulk
+inserts them with Core executemany statements:
+    seeder = Seeder(articles=1000000, depth=4, fanout=5, workers=4)
+    for _ in seeder.run():
+        print(seeder.inserted)
+
+Articles are generated in batches, each from its own random generator
+derived from the seed and the batch number, so the data doesn't depend on
+the number of workers. Worker processes generate batches in parallel,
+then insert them too, except for SQLite, whose single writer is the main
+process. The search index is rebuilt once after the inserts.
+
+Content sizes follow `distribution` around `content_size` characters,
+popular tags are picked more often, and all timestamps fall in the three
+years before `EPOCH`.
+"""
+import random
+import datetime
+import multiprocessing
+
+from flask import current_app
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+from silly_blog.app import db, search
+from silly_blog.app.models import (Article, Category, Comment, LocalUser,
+                                   Role, Source, Tag, User,
+                                   article_tag_mapping, category_closure)
+from silly_blog.contrib.changes import mark_changed
+
+
+DISTRIBUTIONS = ("lognormal", "uniform", "fixed")
+PASSWORD = "silly123"
+EPOCH = datetime.datetime(2019, 1, 1)
+SPAN = 3 * 365 * 24 * 3600  # seconds
+
+_WORDS = ("flask sqlalchemy python database index query cache replica "
+          "token session article category tag source benchmark latency "
+          "throughput profile engine pool stream json worker request "
+          "response closure tree search mysql sqlite uwsgi nginx the a of "
+          "to and in is for with on").split()
+_TEXT_WORDS = 200000
+
+
+def _make_text(seed):
+    rand = random.Random("%s-text" % seed)
+    return " ".join(rand.choice(_WORDS) for _ in range(_TEXT_WORDS))
+
+
+class _Batch(object):
+    """Generate rows of a batch of articles."""
+
+    def __init__(self, plan, text, index):
+        self.plan = plan
+        self.text = text
+        self.rand = random.Random("%s-%d" % (plan["seed"], index))
+        self.index = index
+
+    def uuid(self):
+        return "%032x" % self.rand.getrandbits(128)
+
+    def words(self, size):
+        start = self.rand.randrange(len(self.text) - size)
+        start = self.text.find(" ", start) + 1  # at the start of a word
+        return self.text[start:start + size]
+
+    def size(self, mean):
+        distribution = self.plan["distribution"]
+        if distribution == "fixed":
+            size = mean
+        elif distribution == "uniform":
+            size = self.rand.randint(1, 2 * mean)
+        else:
+            # the mean of lognormvariate(mu, sigma) is exp(mu + sigma^2 / 2)
+            size = int(mean * self.rand.lognormvariate(-0.32, 0.8))
+        return max(1, min(size, mean * 20, len(self.text) // 2))
+
+    def generate(self):
+        plan, rand = self.plan, self.rand
+        articles, mappings, comments = [], [], []
+        start = self.index * plan["batch_size"]
+        stop = min(start + plan["batch_size"], plan["articles"])
+        for i in range(start, stop):
+            article_id = self.uuid()
+            created_at = EPOCH - datetime.timedelta(
+                seconds=rand.randrange(SPAN))
+            published = rand.random() < 0.9
+            articles.append({
+                "id": article_id,
+                "title": "%s %d" % (self.words(40).strip(), i),
+                "summary": self.words(120),
+                "content": self.words(self.size(plan["content_size"])),
+                "stars": rand.randrange(100),
+                "views": rand.randrange(10000),
+                "published": published,
+                "published_at": created_at if published else None,
+                "protected": False,
+                "user_id": rand.choice(plan["user_ids"]),
+                "category_id": rand.choice(plan["category_ids"]),
+                "source_id": rand.choice(plan["source_ids"]),
+                "created_at": created_at,
+                "updated_at": created_at,
+            })
+
+            count = rand.randint(0, plan["max_tags"])
+            tag_ids = rand.choices(plan["tag_ids"],
+                                   cum_weights=plan["tag_weights"], k=count)
+            for j, tag_id in enumerate(sorted(set(tag_ids))):
+                mappings.append({
+                    "id": self.uuid(), "article_id": article_id,
+                    "tag_id": tag_id,
+                    "created_at": created_at + datetime.timedelta(
+                        microseconds=j)})
+
+            for _ in range(rand.randint(0, plan["max_comments"])):
+                commented_at = created_at + datetime.timedelta(
+                    seconds=rand.randrange(30 * 24 * 3600))
+                comments.append({
+                    "id": self.uuid(), "article_id": article_id,
+                    "content": self.words(self.size(200)),
+                    "user_id": rand.choice(plan["user_ids"]),
+                    "created_at": commented_at,
+                    "updated_at": commented_at})
+        return articles, mappings, comments
+
+
+def insert_batch(connection, articles, mappings, comments):
+    with connection.begin():
+        if articles:
+            connection.execute(Article.__table__.insert(), articles)
+        if mappings:
+            connection.execute(article_tag_mapping.insert(), mappings)
+        if comments:
+            connection.execute(Comment.__table__.insert(), comments)
+    return len(articles)
+
+
+# state of worker processes
+_worker = {}
+
+
+def _init_worker(plan, database_uri):
+    _worker["plan"] = plan
+    _worker["text"] = _make_text(plan["seed"])
+    _worker["engine"] = None
+    if database_uri is not None:
+        _worker["engine"] = create_engine(database_uri, poolclass=NullPool)
+
+
+def _run_batch(index):
+    rows = _Batch(_worker["plan"], _worker["text"], index).generate()
+    engine = _worker["engine"]
+    if engine is None:
+        return rows
+    with engine.connect() as connection:
+        return insert_batch(connection, *rows)
+
+
+class Seeder(object):
+    """Generate and insert synthetic data in the database of current app.
+
+    :param depth: levels of the category tree
+    :param fanout: children of every category
+    :param distribution: distribution of content sizes, see
+        `DISTRIBUTIONS`
+    :param workers: number of processes generating articles, the number
+        of CPUs by default
+    :raise ValueError: invalid arguments
+    """
+
+    def __init__(self, articles=10000, users=100, sources=3, tags=2000,
+                 depth=4, fanout=4, max_tags=5, max_comments=3,
+                 content_size=2000, distribution="lognormal",
+                 batch_size=5000, workers=None, seed=0):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError("Unknown distribution %r" % distribution)
+        for name, value in (("users", users), ("sources", sources),
+                            ("tags", tags), ("depth", depth),
+                            ("fanout", fanout), ("content_size", content_size),
+                            ("batch_size", batch_size)):
+            if value < 1:
+                raise ValueError("%s must be positive" % name)
+        self.articles = articles
+        self.users = users
+        self.sources = sources
+        self.tags = tags
+        self.depth = depth
+        self.fanout = fanout
+        self.max_tags = max_tags
+        self.max_comments = max_comments
+        self.content_size = content_size
+        self.distribution = distribution
+        self.batch_size = batch_size
+        self.workers = workers or multiprocessing.cpu_count()
+        self.seed = seed
+        self.rand = random.Random(seed)
+        self.inserted = 0
+
+    def _uuid(self):
+        return "%032x" % self.rand.getrandbits(128)
+
+    def _names(self, kind, count):
+        return ["seed%s-%s%d" % (self.seed, kind, i) for i in range(count)]
+
+    def _timestamp(self):
+        return EPOCH - datetime.timedelta(seconds=self.rand.randrange(SPAN))
+
+    def run(self):
+        """Insert all data, yields after every batch of articles.
+
+        :raise ValueError: data of the seed exists
+        """
+        names = self._names("user", self.users)
+        if LocalUser.query.filter_by(name=names[0]).first() is not None:
+            raise ValueError("Data of seed %s exists" % self.seed)
+
+        plan = {
+            "seed": self.seed,
+            "articles": self.articles,
+            "batch_size": self.batch_size,
+            "max_tags": self.max_tags,
+            "max_comments": self.max_comments,
+            "content_size": self.content_size,
+            "distribution": self.distribution,
+            "user_ids": self.insert_users(names),
+            "source_ids": self.insert_sources(),
+            "category_ids": self.insert_categories(),
+            "tag_ids": self.insert_tags(),
+        }
+        # popular tags are picked more often
+        weights, total = [], 0.0
+        for i in range(len(plan["tag_ids"])):
+            total += 1.0 / (i + 1)
+            weights.append(total)
+        plan["tag_weights"] = weights
+        db.session.remove()
+
+        batches = range(-(-self.articles // self.batch_size))
+        engine = db.engine
+        # SQLite has a single writer, workers only generate rows
+        database_uri = None if engine.dialect.name == "sqlite" else \
+            current_app.config["SQLALCHEMY_DATABASE_URI"]
+        if self.workers <= 1 or len(batches) <= 1:
+            _init_worker(plan, None)
+            results = (_run_batch(index) for index in batches)
+            database_uri = None
+            pool = None
+        else:
+            if database_uri is not None:
+                # NOTE: forked workers must not share pooled connections
+                engine.dispose()
+            pool = multiprocessing.Pool(
+                self.workers, _init_worker, (plan, database_uri))
+            results = pool.imap(_run_batch, batches)
+
+        try:
+            with engine.connect() as connection, \
+                    search.bulk_insert(connection):
+                for result in results:
+                    if database_uri is None:
+                        result = insert_batch(connection, *result)
+                    self.inserted += result
+                    yield self.inserted
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            # NOTE: also if the caller stops early, batches are committed
+            self._invalidate()
+
+    def insert_users(self, names):
+        role_id = db.session.query(Role.id).filter_by(name=Role.USER).scalar()
+        if role_id is None:
+            raise ValueError("Roles are missing, run `flask deploy` first")
+        # NOTE: hashing every password is pointless, share one hash
+        password = current_app.extensions["password_hasher"].hash(PASSWORD)
+        users, local_users = [], []
+        for name in names:
+            user_id = self._uuid()
+            users.append({"id": user_id, "role_id": role_id, "enabled": True})
+            local_users.append({"user_id": user_id, "name": name,
+                                "email": name + "@example.com",
+                                "password": password,
+                                "created_at": EPOCH, "updated_at": EPOCH})
+        with db.engine.begin() as connection:
+            connection.execute(User.__table__.insert(), users)
+            connection.execute(LocalUser.__table__.insert(), local_users)
+        return [user["id"] for user in users]
+
+    def insert_sources(self):
+        sources = [{"id": self._uuid(), "name": name}
+                   for name in self._names("source", self.sources)]
+        with db.engine.begin() as connection:
+            connection.execute(Source.__table__.insert(), sources)
+        return [source["id"] for source in sources]
+
+    def insert_categories(self):
+        """Insert the category tree and its closure, returns ids of all
+        categories.
+        """
+        categories, paths = [], []
+        # (id, ids from the root to itself) of the previous level
+        level = [(None, [])]
+        for _ in range(self.depth):
+            next_level = []
+            for parent_id, lineage in level:
+                for order in range(self.fanout):
+                    category_id = self._uuid()
+                    created_at = self._timestamp()
+                    categories.append({
+                        "id": category_id,
+                        "name": "seed%s-category%d" % (self.seed,
+                                                       len(categories)),
+                        "display_order": order, "protected": False,
+                        "parent_id": parent_id,
+                        "created_at": created_at, "updated_at": created_at})
+                    path = lineage + [category_id]
+                    paths.extend({"ancestor_id": ancestor_id,
+                                  "descendant_id": category_id,
+                                  "depth": len(path) - 1 - i}
+                                 for i, ancestor_id in enumerate(path))
+                    next_level.append((category_id, path))
+            level = next_level
+        with db.engine.begin() as connection:
+            connection.execute(Category.__table__.insert(), categories)
+            connection.execute(category_closure.insert(), paths)
+        return [category["id"] for category in categories]
+
+    def insert_tags(self):
+        tags = []
+        for name in self._names("tag", self.tags):
+            created_at = self._timestamp()
+            tags.append({"id": self._uuid(), "name": name,
+                         "created_at": created_at, "updated_at": created_at})
+        with db.engine.begin() as connection:
+            connection.execute(Tag.__table__.insert(), tags)
+        return [tag["id"] for tag in tags]
+
+    @staticmethod
+    def _invalidate():
+        """Invalidate caches of running workers, Core inserts bypass the
+        session events.
+        """
+        session = db.session()
+        mark_changed(session, "users", "local_users", "sources",
+                     "categories", "category_closure", "tags", "articles",
+                     "article_tag_mapping", "comments")
+        session.commit()
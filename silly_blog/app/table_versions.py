@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Versions of tables, bumped by commits which change them.
+
+Every table has a `VersionStamp` shared by worker processes on the same
+host. Validators of lists are computed from versions of the tables their
+responses contain, e.g. articles with names of their users, categories,
+sources and tags, which costs a `stat` per table rather than aggregates
+over all matched rows:
+    versions = get_table_versions().current(ARTICLE_TABLES)
+    etag = make_etag(versions, fmt)
+
+The response cache tags its entries with the same versions.
+"""
+import os
+import logging
+
+from flask import current_app, has_app_context
+
+from silly_blog.contrib.cache import TagVersions
+from silly_blog.contrib.changes import on_commit
+
+
+LOG = logging.getLogger(__name__)
+
+# tables of article details and lists
+ARTICLE_TABLES = ("articles", "article_tag_mapping", "tags", "categories",
+                  "category_closure", "sources", "users", "local_users",
+                  "federated_users")
+# tables of user details and lists
+USER_TABLES = ("users", "local_users", "roles")
+TAG_TABLES = ("tags",)
+
+
+class TableVersions(object):
+    """Versions of tables shared by worker processes on the host."""
+
+    def __init__(self, app=None):
+        self.tags = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.tags = TagVersions(os.path.join(
+            app.config["VERSION_STAMP_DIR"], "tables"))
+        app.extensions["table_versions"] = self
+
+    def current(self, tables):
+        """Returns a tuple of current versions of `tables`."""
+        return self.tags.current(tables)
+
+    def bump(self, tables):
+        try:
+            self.tags.bump(tables)
+        except OSError:
+            LOG.exception("Bump versions of %r failed", tables)
+
+
+def get_table_versions():
+    """Returns table versions of current app."""
+    return current_app.extensions["table_versions"]
+
+
+@on_commit
+def _bump_on_commit(tables):
+    if has_app_context():
+        versions = current_app.extensions.get("table_versions")
+        if versions is not None:
+            versions.bump(sorted(tables))
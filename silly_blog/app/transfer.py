@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk import and export of articles as JSON Lines.
+
+Each line is an article, which refers its user, category, source and tags
+by names, so an archive can be moved between databases:
+    {"id": "...", "title": "...", "content": "...", "summary": "...",
+     "published": true, "published_at": "2018-08-01T12:00:00Z", ...,
+     "user": "admin", "category": "mysql", "source": "原创",
+     "category_path": ["database", "mysql"], "tags": ["innodb", "mvcc"]}
+
+Import reads a batch of lines, resolves names with in-memory lookup maps
+which only query names seen for the first time, then inserts articles
+and tag mappings with executemany statements and commits the batch.
+Missing categories, sources and tags are created, missing users are left
+empty. A missing category is created under its parent in `category_path`,
+which goes from the root to the category itself, and existing categories
+are kept where they are. Articles whose ids already exist are skipped, so
+an interrupted import can simply be run again.
+
+Export streams rows in the order of the primary key, which needs no sort,
+with a server-side cursor where the driver supports it, and resolves names
+of every batch in a few queries, memory stays flat whatever the number of
+articles.
+"""
+import io
+import sys
+import gzip
+import json
+import datetime
+import itertools
+
+from sqlalchemy import select
+
+from silly_blog.app import db
+from silly_blog.app.models import (Article, Category, LocalUser, Source, Tag,
+                                   User, article_tag_mapping, _get_uuid)
+from silly_blog.contrib.changes import mark_changed
+from silly_blog.contrib.utils import isotime, parse_isotime
+
+
+# columns of `articles` copied as they are
+FIELDS = ("id", "title", "summary", "content", "stars", "views", "published",
+          "published_at", "protected", "created_at", "updated_at")
+TIME_FIELDS = ("published_at", "created_at", "updated_at")
+
+
+def open_jsonl(path, mode, compress=None):
+    """Open a JSON Lines file in text mode, "-" means stdin or stdout.
+
+    :param compress: whether the file is gzipped, None to guess by the
+        ".gz" suffix
+    """
+    if compress is None:
+        compress = path.endswith(".gz")
+    if path == "-":
+        stream = sys.stdin.buffer if mode == "r" else sys.stdout.buffer
+        if compress:
+            stream = gzip.GzipFile(fileobj=stream, mode=mode + "b")
+        return _TextStream(stream)
+    if compress:
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class _TextStream(object):
+    """Wrap a binary stream without closing stdin or stdout."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.text = io.TextIOWrapper(stream, encoding="utf-8")
+
+    def __enter__(self):
+        return self.text
+
+    def __exit__(self, *exc_info):
+        self.text.flush()
+        self.text.detach()
+        if isinstance(self.stream, gzip.GzipFile):
+            self.stream.close()
+
+
+class NameMap(object):
+    """Maps names to ids, names seen for the first time are loaded in one
+    query per batch.
+
+    :param name_column: column of names
+    :param id_column: column of ids
+    :param create: a callable creates missing names in the session,
+        None to leave them unresolved
+    """
+
+    def __init__(self, name_column, id_column, create=None):
+        self.name_column = name_column
+        self.id_column = id_column
+        self.create = create
+        self.ids = {}
+        self.missing = set()
+
+    def load(self, names):
+        names = {name for name in names if name}
+        names.difference_update(self.ids, self.missing)
+        if not names:
+            return
+        self._select(names)
+        names.difference_update(self.ids)
+        if names and self.create is not None:
+            self.create(names)
+            self._select(names)
+            names.difference_update(self.ids)
+        self.missing.update(names)
+
+    def _select(self, names):
+        query = db.session.query(self.name_column, self.id_column).\
+            filter(self.name_column.in_(names))
+        for name, id_ in query:
+            self.ids.setdefault(name, id_)
+
+    def get(self, name):
+        return self.ids.get(name)
+
+
+def _create_sources(names):
+    for name in sorted(names):
+        db.session.add(Source(name=name))
+    db.session.flush()
+
+
+def _is_category_path(name, path):
+    """Whether `path` is a list of names from the root to `name`."""
+    return (bool(name) and isinstance(path, list) and bool(path) and
+            path[-1] == name and
+            all(isinstance(part, str) and part for part in path))
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    at = parse_isotime(value)
+    if at.tzinfo is not None:
+        at = at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return at
+
+
+def _parse_line(lineno, line):
+    try:
+        record = json.loads(line)
+    except ValueError as ex:
+        raise ValueError("Line %d: invalid JSON, %s" % (lineno, ex))
+    if not isinstance(record, dict):
+        raise ValueError("Line %d: expected an object" % lineno)
+    for field in ("title", "content"):
+        if not isinstance(record.get(field), str):
+            raise ValueError("Line %d: %r is required" % (lineno, field))
+    tags = record.get("tags") or []
+    if not isinstance(tags, list):
+        raise ValueError("Line %d: 'tags' should be a list" % lineno)
+    try:
+        for field in TIME_FIELDS:
+            record[field] = _parse_time(record.get(field))
+    except ValueError as ex:
+        raise ValueError("Line %d: %s" % (lineno, ex))
+    return record
+
+
+class Importer(object):
+    """Import articles from JSON Lines in batches."""
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.users = NameMap(LocalUser.name, LocalUser.user_id)
+        self.categories = NameMap(Category.name, Category.id,
+                                  self._create_categories)
+        # maps names of categories to their paths in the archive
+        self.category_paths = {}
+        self.sources = NameMap(Source.name, Source.id, _create_sources)
+        self.tags = NameMap(Tag.name, Tag.id, Tag.insert_missing)
+        self.imported = 0
+        self.skipped = 0
+
+    def run(self, fp):
+        """Import all lines of `fp`, yields after every batch.
+
+        :raise ValueError: an invalid line, the former batches have been
+            committed
+        """
+        lines = ((lineno, line) for lineno, line in enumerate(fp, 1)
+                 if line.strip())
+        while True:
+            batch = [_parse_line(lineno, line) for lineno, line in
+                     itertools.islice(lines, self.batch_size)]
+            if not batch:
+                break
+            try:
+                self._import(batch)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            yield self
+
+    def _create_categories(self, names):
+        """Create categories under their parents, which are created first,
+        as ancestors of a path are loaded with it.
+        """
+        # NOTE: through the ORM to maintain the closure table and the cache
+        created = {}
+        for name in sorted(names, key=lambda name: (
+                len(self.category_paths.get(name, ())), name)):
+            path = self.category_paths.get(name) or [name]
+            parent = None
+            if len(path) > 1:
+                parent = created.get(path[-2])
+                parent_id = self.categories.get(path[-2])
+                if parent is None and parent_id is not None:
+                    parent = Category.query.get(parent_id)
+            created[name] = Category(name=name, parent=parent)
+            db.session.add(created[name])
+        db.session.flush()
+
+    def _load_categories(self, records):
+        names = []
+        for record in records:
+            name = record.get("category")
+            path = record.get("category_path")
+            if _is_category_path(name, path):
+                for i, part in enumerate(path):
+                    self.category_paths.setdefault(part, path[:i + 1])
+                names.extend(path)
+            names.append(name)
+        self.categories.load(names)
+
+    def _import(self, records):
+        self.users.load(r.get("user") for r in records)
+        self._load_categories(records)
+        self.sources.load(r.get("source") for r in records)
+        self.tags.load(name for r in records for name in r.get("tags") or ())
+
+        # skip existing articles and duplicates in the batch
+        ids = {r["id"] for r in records if r.get("id")}
+        existing = set()
+        if ids:
+            existing.update(id_ for id_, in db.session.query(Article.id).
+                            filter(Article.id.in_(ids)))
+
+        now = datetime.datetime.utcnow()
+        articles, mappings = [], []
+        for record in records:
+            article_id = record.get("id") or _get_uuid()
+            if article_id in existing:
+                self.skipped += 1
+                continue
+            existing.add(article_id)
+
+            article = {field: record.get(field) for field in FIELDS}
+            article.update({
+                "id": article_id,
+                "summary": record.get("summary"),
+                "stars": record.get("stars") or 0,
+                "views": record.get("views") or 0,
+                "published": bool(record.get("published")),
+                "protected": bool(record.get("protected")),
+                "created_at": record["created_at"] or now,
+                "updated_at": record["updated_at"] or now,
+                "user_id": self.users.get(record.get("user")),
+                "category_id": self.categories.get(record.get("category")),
+                "source_id": self.sources.get(record.get("source")),
+            })
+            articles.append(article)
+
+            tag_ids = []
+            for name in record.get("tags") or ():
+                tag_id = self.tags.get(name)
+                if tag_id and tag_id not in tag_ids:
+                    tag_ids.append(tag_id)
+            # keep the order by associate time
+            for i, tag_id in enumerate(tag_ids):
+                mappings.append({
+                    "id": _get_uuid(), "article_id": article_id,
+                    "tag_id": tag_id,
+                    "created_at": now + datetime.timedelta(microseconds=i)})
+
+        if articles:
+            db.session.execute(Article.__table__.insert(), articles)
+            mark_changed(db.session(), Article.__tablename__)
+        if mappings:
+            db.session.execute(article_tag_mapping.insert(), mappings)
+            mark_changed(db.session(), article_tag_mapping.name)
+        self.imported += len(articles)
+
+
+def _dump_time(value):
+    return isotime(value) if value else None
+
+
+class Exporter(object):
+    """Export articles to JSON Lines in batches."""
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.exported = 0
+        self._categories = None
+        self._lineages = None
+        self._sources = None
+
+    def run(self, fp):
+        """Write all articles to `fp`, yields after every batch."""
+        # NOTE: categories and sources are few, load them at once
+        self._categories = dict(db.session.query(Category.id, Category.name))
+        self._lineages = Category.get_lineages(self._categories)
+        self._sources = dict(db.session.query(Source.id, Source.name))
+
+        table = Article.__table__
+        # NOTE: the primary key orders rows without sorting them
+        statement = select([table]).order_by(table.c.id)
+        # NOTE: a connection of its own, MySQL can't execute other queries
+        # on a connection with an unbuffered result
+        with db.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True).\
+                execute(statement)
+            try:
+                while True:
+                    rows = result.fetchmany(self.batch_size)
+                    if not rows:
+                        break
+                    self._export(fp, rows)
+                    yield self
+            finally:
+                result.close()
+
+    def _export(self, fp, rows):
+        article_ids = [row.id for row in rows]
+        users = User.get_names(row.user_id for row in rows)
+        tags = Tag.get_by_articles(article_ids)
+
+        for row in rows:
+            record = {field: row[field] for field in FIELDS}
+            for field in TIME_FIELDS:
+                record[field] = _dump_time(record[field])
+            record.update({
+                "user": users.get(row.user_id),
+                "category": self._categories.get(row.category_id),
+                "category_path": [name for _, name in self._lineages.get(
+                    row.category_id, ())],
+                "source": self._sources.get(row.source_id),
+                "tags": [tag.name for tag in tags.get(row.id, ())],
+            })
+            fp.write(json.dumps(record, ensure_ascii=False))
+            fp.write("\n")
+        self.exported += len(rows)
+        db.session.expunge_all()
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
-from flask import Blueprint, jsonify
+from flask import Blueprint, Response, abort, current_app, jsonify
 
 from silly_blog import __version__
+from silly_blog.app import db, auth
+from silly_blog.contrib.metrics import CONTENT_TYPE
 
 
 other_bp = Blueprint('other', __name__)
@@ -13,3 +15,19 @@ def index():
         'name': __name__.split('.', 1)[0],
         'version': __version__
     })
+
+
+@other_bp.route('/status/db')
+@auth.login_required
+def db_status():
+    """Metrics of the database connection pool of this worker."""
+    return jsonify({'pool': db.pool_metrics()})
+
+
+@other_bp.route('/metrics')
+def metrics():
+    """Metrics of all worker processes for Prometheus."""
+    request_metrics = current_app.extensions.get('metrics')
+    if request_metrics is None:
+        abort(404)
+    return Response(request_metrics.render(), content_type=CONTENT_TYPE)
@@ -7,6 +7,7 @@
 """
 
 import os
+import tempfile
 
 
 DIR_NAME = os.path.abspath(os.path.dirname(__file__))
@@ -23,11 +24,89 @@ class Config(object):
     PREFERRED_URL_SCHEME = 'http'  # used for URL generation
     MAX_CONTENT_LENGTH = 10 * 1024 * 1024  # limit size of incoming request to 10MB
     JSON_AS_ASCII = False  # serialize objects to unicode-encoded JSON
-    JSON_SORT_KEYS = True
+    JSON_SORT_KEYS = True  # also applies to API responses
+    # encoder of API responses, 'orjson', 'json' or 'auto' to use orjson
+    # if it's installed
+    JSON_BACKEND = 'auto'
 
     # sqlalchemy related
     SQLALCHEMY_ECHO = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False  # default is None, will issue a warning
+    # pool options have tuned defaults by dialect, see
+    # `silly_blog.contrib.engine.DEFAULT_OPTIONS`, override them here,
+    # e.g. {'pool_size': 10, 'pool_recycle': 3600}
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    # applied to every new SQLite connection, the defaults are in
+    # `silly_blog.contrib.engine.DEFAULT_SQLITE_PRAGMAS`, WAL lets readers
+    # and a writer of different processes run concurrently, override
+    # them here, e.g. {'synchronous': 'FULL'}
+    SQLITE_PRAGMAS = {}
+
+    # a request running more queries is logged, or fails with
+    # 'raise' action, None to disable
+    SQL_QUERY_BUDGET = None
+    SQL_QUERY_BUDGET_ACTION = 'log'  # 'log' or 'raise'
+
+    # directory of files shared by worker processes of the instance,
+    # None for one in the temp dir named by the user and the database
+    # URI, so instances of other databases don't share it. Directories
+    # below default to its subdirectories when they are None.
+    RUNTIME_DIR = None
+
+    # metrics of all worker processes exposed by `/metrics`, values are
+    # shared through files in the directory, clear it before deployment
+    METRICS_ENABLED = True
+    METRICS_DIR = None
+    # upper bounds in seconds of buckets of latency histograms
+    METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                       2.5, 5.0, 10.0)
+
+    # profile sampled or slow requests, see `silly_blog.contrib.profiling`
+    PROFILE_ENABLED = False
+    PROFILE_DIR = None
+    PROFILE_SAMPLE_RATE = 0.0  # fraction of requests run under cProfile
+    PROFILE_SLOW_SECONDS = 1.0  # sample stacks of slower ones, None to disable
+    PROFILE_INTERVAL = 0.005  # seconds between stack samples
+    PROFILE_MAX_FILES = 100  # keep the latest profiles only
+
+    # bind keys of read replicas in `SQLALCHEMY_BINDS`, GET requests of
+    # API resources read from them, see `silly_blog.app.replicas`
+    SQLALCHEMY_REPLICAS = []
+    # read from the primary for such seconds after a write of a token,
+    # longer than the replication lag
+    REPLICA_STICKY_SECONDS = 5
+    REPLICA_STICKY_DIR = None
+    REPLICA_EJECT_SECONDS = 30  # skip a failed replica for such seconds
+
+    # number of rows fetched at a time by streamed list responses
+    STREAM_BATCH_SIZE = 200
+
+    # cache related
+    # directory of version stamps, which are shared by all worker processes
+    VERSION_STAMP_DIR = None
+    CATEGORY_CACHE_ENABLED = True  # cache category tree in every worker
+    # cache responses of anonymous GET requests,
+    # 'memory', 'filesystem' or None to disable
+    RESPONSE_CACHE_BACKEND = 'memory'
+    RESPONSE_CACHE_DIR = None
+    RESPONSE_CACHE_TTL = 60  # seconds
+    RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    PRINCIPAL_CACHE_SIZE = 10000  # max number of cached auth tokens
+
+    # password hashing related
+    # method and cost of `werkzeug.security`, old hashes are upgraded on login
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:260000'
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = 2  # threads of every worker process
+    PASSWORD_HASH_MAX_PENDING = 4  # fail fast if more hashes are pending
+    # at most such number of hashes run at the same time on the host,
+    # so a login storm can't occupy all uWSGI workers
+    PASSWORD_HASH_SLOTS = 2  # 0 to disable
+    PASSWORD_HASH_SLOTS_DIR = None
+
+    # counters related
+    COUNTER_FLUSH_INTERVAL = 5  # seconds between flushes of article counters
+    COUNTER_FLUSH_THREAD = True  # flush in a background thread
 
 
 class TestingConfig(Config):
@@ -38,6 +117,26 @@ class TestingConfig(Config):
     # sqlalchemy related
     SQLALCHEMY_DATABASE_URI = 'sqlite://'
 
+    # a directory per test run, so a running server isn't affected
+    RUNTIME_DIR = os.path.join(tempfile.gettempdir(),
+                               'silly-blog-tests-%d' % os.getpid())
+
+    # metrics related
+    METRICS_ENABLED = False  # tests of metrics enable them
+
+    # counters related
+    COUNTER_FLUSH_THREAD = False  # in-memory database is per connection
+
+    # cache related
+    RESPONSE_CACHE_BACKEND = None  # tests check fresh responses
+
+    # password hashing related
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'  # fast tests
+
+    # requests of N+1 queries fail
+    SQL_QUERY_BUDGET = 20
+    SQL_QUERY_BUDGET_ACTION = 'raise'
+
 
 class DevelopmentConfig(Config):
     """Configurations For Dev Environment."""
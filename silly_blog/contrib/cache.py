@@ -0,0 +1,297 @@
+"""
+Cache backends with TTLs, size-based eviction and tag-based invalidation.
+
+- `MemoryCache`: an LRU cache in the process.
+- `FileSystemCache`: a cache directory shared by all processes on the
+  same host, which must be private to the user.
+
+Values are bytes, `MemoryCache` also accepts any object with `sizeof`
+to measure them. Each entry is stored with versions of its tags, which
+are `VersionStamp`s shared by all processes, so bumping a tag invalidates
+entries of every process and backend at once:
+    tags = TagVersions('/tmp/silly-blog/tags')
+    cache = MemoryCache(max_bytes=64 * 1024 * 1024, tags=tags)
+    cache.set(key, body, ttl=60, tags=["articles"])
+    cache.get(key)  # body
+    tags.bump(["articles"])
+    cache.get(key)  # None
+"""
+import os
+import json
+import stat
+import time
+import hashlib
+import tempfile
+import threading
+import collections
+
+from silly_blog.contrib.stamp import VersionStamp
+
+
+def private_directory(path):
+    """Create a directory only the user can access, or check an existing
+    one is owned by the user, so other users can't plant files in it.
+
+    :raise ValueError: the directory is owned by another user
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise ValueError("%s isn't a directory" % path)
+    if hasattr(os, "getuid"):
+        if st.st_uid != os.getuid():
+            raise ValueError("%s is owned by another user" % path)
+        if st.st_mode & 0o077:
+            os.chmod(path, 0o700)
+    return path
+
+
+class TagVersions(object):
+    """Versions of cache tags shared by processes on the same host."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._stamps = {}
+
+    def _stamp(self, tag):
+        stamp = self._stamps.get(tag)
+        if stamp is None:
+            stamp = VersionStamp(os.path.join(self.directory, tag + ".stamp"))
+            self._stamps[tag] = stamp
+        return stamp
+
+    def current(self, tags):
+        """Returns a tuple of current versions of `tags`."""
+        return tuple(self._stamp(tag).current() for tag in tags)
+
+    def bump(self, tags):
+        for tag in tags:
+            self._stamp(tag).bump()
+
+
+class BaseCache(object):
+    """Base class of cache backends.
+
+    :param default_ttl: seconds before entries expire
+    :param max_bytes: the maximum total size of values
+    :param tags: a `TagVersions` to invalidate entries by tags
+    :param sizeof: a callable returns size of a value
+    """
+
+    def __init__(self, default_ttl=300, max_bytes=64 * 1024 * 1024,
+                 tags=None, sizeof=len):
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.tags = tags
+        self.sizeof = sizeof
+
+    def versions(self, tags):
+        """Returns current versions of tags, read them before computing a
+        value, so a concurrent invalidation won't be missed.
+        """
+        return self.tags.current(sorted(tags))
+
+    def _entry(self, value, ttl, tags, versions):
+        ttl = self.default_ttl if ttl is None else ttl
+        tags = tuple(sorted(tags or ()))
+        if versions is None:
+            versions = self.tags.current(tags) if tags else ()
+        return time.time() + ttl, tags, versions, value
+
+    def _is_valid(self, entry):
+        expires, tags, versions, _ = entry
+        if expires < time.time():
+            return False
+        return not tags or self.tags.current(tags) == versions
+
+    def get(self, key):
+        """Returns the value of `key`, or None if it's missing, expired
+        or invalidated.
+        """
+        raise NotImplementedError()
+
+    def set(self, key, value, ttl=None, tags=None, versions=None):
+        """Set the value of `key`.
+
+        :param versions: versions of `tags` returned by `versions` before
+            the value is computed, default are current versions
+        """
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+
+class MemoryCache(BaseCache):
+    """A thread-safe LRU cache in the process."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._size = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not self._is_valid(entry):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[-1]
+
+    def set(self, key, value, ttl=None, tags=None, versions=None):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        entry = self._entry(value, ttl, tags, versions)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._size += size
+            # evict the least recently used entries
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= self.sizeof(entry[-1])
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class FileSystemCache(BaseCache):
+    """A cache directory shared by processes, an entry per file.
+
+    Files are replaced atomically, hits touch their mtime, so pruning
+    removes expired entries and then the least recently used ones. A file
+    is a line of JSON `[expires, tags, versions]` followed by the value,
+    values must be bytes.
+
+    :param prune_interval: prune the directory after every such number
+        of sets
+    """
+
+    suffix = ".cache"
+
+    def __init__(self, directory, *args, prune_interval=100, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.directory = directory
+        self.prune_interval = prune_interval
+        self._sets = 0
+        private_directory(directory)
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + self.suffix)
+
+    @staticmethod
+    def _read(fp, header_only=False):
+        expires, tags, versions = json.loads(fp.readline().decode("utf-8"))
+        versions = tuple(None if version is None else tuple(version)
+                         for version in versions)
+        value = None if header_only else fp.read()
+        return expires, tuple(tags), versions, value
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fp:
+                entry = self._read(fp)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError):
+            self.delete(key)
+            return None
+        if not self._is_valid(entry):
+            self.delete(key)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry[-1]
+
+    def set(self, key, value, ttl=None, tags=None, versions=None):
+        if len(value) > self.max_bytes:
+            return
+        entry = self._entry(value, ttl, tags, versions)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(json.dumps(entry[:-1]).encode("utf-8") + b"\n")
+                fp.write(value)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._sets += 1
+        if self._sets % self.prune_interval == 0:
+            self.prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _files(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.suffix):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+        return files
+
+    def prune(self):
+        """Remove expired entries, then the least recently used ones
+        until the total size fits `max_bytes`.
+        """
+        now = time.time()
+        files = []
+        for mtime, size, path in self._files():
+            try:
+                with open(path, "rb") as fp:
+                    expires = self._read(fp, header_only=True)[0]
+            except (OSError, ValueError, TypeError):
+                expires = 0
+            if expires < now:
+                _remove_file(path)
+            else:
+                files.append((mtime, size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            _remove_file(path)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self._files():
+            _remove_file(path)
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,93 @@
+"""
+Tables changed by committed transactions.
+
+Writes of the unit of work are collected from sessions, writes out of
+it, e.g. Core statements, are marked with `mark_changed`. After a commit,
+receivers are called with names of the changed tables, so caches are
+invalidated without writers knowing about them:
+    track_changes(session_factory)
+
+    @on_commit
+    def invalidate(tables):
+        ...
+
+    db.session.execute(tags.insert(), rows)
+    mark_changed(db.session(), "tags")
+    db.session.commit()  # invalidate({"tags"})
+
+Commits out of sessions, e.g. of a connection of the engine, are
+published by `publish`:
+    with engine.begin() as connection:
+        connection.execute(articles.update(), rows)
+    publish("articles")
+"""
+import logging
+
+from sqlalchemy import event
+
+
+LOG = logging.getLogger(__name__)
+
+_SESSION_KEY = "changed_tables"
+_receivers = []
+
+
+def mark_changed(session, *tables):
+    """Mark tables changed, for writes out of the unit of work, e.g.
+    core statements. Receivers are called after commit.
+    """
+    session.info.setdefault(_SESSION_KEY, set()).update(tables)
+
+
+def on_commit(receiver):
+    """Register `receiver(tables)`, which is called with a set of tables
+    changed by every committed transaction.
+    """
+    _receivers.append(receiver)
+    return receiver
+
+
+def publish(*tables):
+    """Call receivers with tables changed by a transaction committed out
+    of sessions.
+    """
+    if not tables:
+        return
+    tables = set(tables)
+    for receiver in _receivers:
+        try:
+            receiver(tables)
+        except Exception:
+            LOG.exception("Receiver of changes of %r failed", sorted(tables))
+
+
+def _collect_changes(session, flush_context, instances):
+    objects = list(session.new) + list(session.dirty) + list(session.deleted)
+    tables = {obj.__table__.name for obj in objects
+              if hasattr(obj, "__table__")}
+    if tables:
+        mark_changed(session, *tables)
+
+
+def _collect_bulk_changes(context):
+    mark_changed(context.session, context.primary_table.name)
+
+
+def _publish(session):
+    publish(*session.info.pop(_SESSION_KEY, ()))
+
+
+def _discard(session, previous_transaction):
+    # NOTE: changes of the outer transaction are still committed after a
+    # savepoint or a subtransaction is rolled back
+    if previous_transaction.parent is None:
+        session.info.pop(_SESSION_KEY, None)
+
+
+def track_changes(session):
+    """Track changed tables of a session, a session class or factory."""
+    event.listen(session, "before_flush", _collect_changes)
+    event.listen(session, "after_bulk_update", _collect_bulk_changes)
+    event.listen(session, "after_bulk_delete", _collect_bulk_changes)
+    event.listen(session, "after_commit", _publish)
+    event.listen(session, "after_soft_rollback", _discard)
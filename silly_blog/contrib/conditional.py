@@ -0,0 +1,84 @@
+"""
+Conditional GET.
+
+Validators are computed from cheap values, e.g. `updated_at` of a row or
+versions of the tables of a collection, so a request with `If-None-Match`
+or `If-Modified-Since` is short-circuited with 304 before the response
+body is queried or serialized:
+    etag = make_etag(article.id, article.updated_at)
+    response = not_modified(etag, article.updated_at)
+    if response is not None:
+        return response
+    return with_validators(details(article), etag, article.updated_at)
+
+Lists have no `Last-Modified` but an etag of versions of all tables
+their bodies contain, including names of related rows, so an update of
+a joined row or a delete changes it:
+    etag = make_etag(get_table_versions().current(tables), fmt)
+    response = not_modified(etag)
+
+`Last-Modified` of the category tree is the latest `updated_at` of its
+rows, which a delete doesn't change, so it only answers `If-None-Match`:
+    response = not_modified(etag, last_modified, modified_since=False)
+"""
+import hashlib
+import datetime
+
+from flask import request, Response
+from werkzeug.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    """Returns an opaque etag of `parts`."""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+def _to_http_time(dt):
+    """Convert a naive UTC or aware datetime into a naive UTC one, with
+    the precision of HTTP dates.
+    """
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt.replace(microsecond=0)
+
+
+def validator_headers(etag, last_modified=None):
+    """Returns a dict of `ETag` and `Last-Modified` headers."""
+    headers = {"ETag": quote_etag(etag, weak=True)}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(
+            _to_http_time(last_modified).replace(
+                tzinfo=datetime.timezone.utc))
+    return headers
+
+
+def is_not_modified(etag, last_modified=None, modified_since=True):
+    """Check validators against the conditional request headers.
+
+    `If-None-Match` takes precedence over `If-Modified-Since` as required
+    by RFC 7232.
+
+    :param modified_since: whether `last_modified` alone validates the
+        response, so `If-Modified-Since` is answered
+    """
+    if request.method not in ("GET", "HEAD"):
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if modified_since and request.if_modified_since and \
+            last_modified is not None:
+        return (_to_http_time(last_modified) <=
+                _to_http_time(request.if_modified_since))
+    return False
+
+
+def not_modified(etag, last_modified=None, modified_since=True):
+    """Returns a 304 response if the request is not modified, or None."""
+    if is_not_modified(etag, last_modified, modified_since):
+        return Response(status=304, headers=validator_headers(etag, last_modified))
+    return None
+
+
+def with_validators(data, etag, last_modified=None):
+    """Returns a response tuple of `data` with validator headers."""
+    return data, 200, validator_headers(etag, last_modified)
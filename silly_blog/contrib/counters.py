@@ -0,0 +1,116 @@
+"""
+Write-behind counters.
+
+Incrementing a counter column for every request needs an UPDATE and a
+commit on the hot read path, which serializes writers on SQLite. A
+`CounterBuffer` accumulates increments in memory instead, and applies
+them to the database in batched UPDATEs later:
+    buffer = CounterBuffer(Article.__table__, ["views", "stars"])
+    buffer.incr(article_id, "views")
+    ...
+    buffer.flush(engine)  # periodically and before exit
+
+Increments are pending in the process until flushed, reads merge them
+into values loaded from database with `merge`.
+"""
+import time
+import threading
+import collections
+
+from sqlalchemy import bindparam, func
+
+
+class CounterBuffer(object):
+    """Buffer increments of counter columns of a table.
+
+    :param table: the table to update
+    :param columns: names of counter columns
+    :param id_column: name of the primary key column
+    :param interval: seconds between flushes
+    :param untouched: names of columns which flushes should leave as is,
+        e.g. a timestamp column with `onupdate` default.
+    """
+
+    def __init__(self, table, columns, id_column="id", interval=5.0,
+                 untouched=()):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # maps `(column, id)` to delta
+        self._pending = collections.defaultdict(int)
+        # increments being flushed are still visible to reads
+        self._flushing = {}
+        self._last_flush = time.monotonic()
+
+        self._statements = {}
+        criterion = table.c[id_column] == bindparam("_id")
+        for name in columns:
+            column = table.c[name]
+            values = {name: func.coalesce(column, 0) + bindparam("_delta")}
+            values.update((key, table.c[key]) for key in untouched)
+            self._statements[name] = \
+                table.update().where(criterion).values(values)
+
+    @property
+    def columns(self):
+        return tuple(self._statements)
+
+    def incr(self, id_, column, delta=1):
+        """Increase a counter of row `id_` by `delta`."""
+        if column not in self._statements:
+            raise ValueError("Unknown counter %r" % column)
+        with self._lock:
+            self._pending[(column, id_)] += delta
+
+    def pending(self, id_):
+        """Returns a dict maps counter name to pending delta of a row."""
+        with self._lock:
+            return {column: (self._pending.get((column, id_), 0) +
+                             self._flushing.get((column, id_), 0))
+                    for column in self._statements}
+
+    def merge(self, info, id_):
+        """Add pending deltas of row `id_` to counters of a dict."""
+        for column, delta in self.pending(id_).items():
+            if column in info:
+                info[column] = (info[column] or 0) + delta
+        return info
+
+    def due(self):
+        """Whether there are pending increments and the interval passed."""
+        return (bool(self._pending) and
+                time.monotonic() - self._last_flush >= self.interval)
+
+    def flush(self, engine):
+        """Apply pending increments in one transaction, they are kept
+        for the next flush on errors.
+
+        :return: the number of updated counters
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._flushing = self._pending
+                self._pending = collections.defaultdict(int)
+                self._last_flush = time.monotonic()
+
+            batches = collections.defaultdict(list)
+            # NOTE: update rows in the same order to avoid deadlocks
+            for (column, id_), delta in sorted(self._flushing.items()):
+                if delta:
+                    batches[column].append({"_id": id_, "_delta": delta})
+            try:
+                if batches:
+                    with engine.begin() as connection:
+                        for column, params in batches.items():
+                            connection.execute(self._statements[column],
+                                               params)
+            except Exception:
+                with self._lock:
+                    for key, delta in self._flushing.items():
+                        self._pending[key] += delta
+                    self._flushing = {}
+                raise
+
+            with self._lock:
+                self._flushing = {}
+            return sum(len(params) for params in batches.values())
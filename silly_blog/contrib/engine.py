@@ -0,0 +1,270 @@
+"""
+Tuning of SQLAlchemy engines.
+
+`SQLAlchemy` extends Flask-SQLAlchemy's extension:
+- pool options have per-dialect defaults, which are overridden by
+  `SQLALCHEMY_POOL_*` configs and `SQLALCHEMY_ENGINE_OPTIONS`;
+- SQLite connections apply `DEFAULT_SQLITE_PRAGMAS` updated by
+  `SQLITE_PRAGMAS` on connect, by default WAL journal, NORMAL
+  synchronous, a busy timeout, a larger page cache and mmap, so several
+  worker processes can share a database file without "database is
+  locked" errors;
+- pooled connections are never shared by forked processes, a connection
+  checked out in a child of the process which opened it is replaced;
+- every engine has `PoolMetrics`, and records queries into stats of the
+  current request, see `silly_blog.contrib.instrument`;
+- sessions are `RoutingSession`s, which read from a replica when the
+  router in `app.extensions["replicas"]` chooses one, and read again
+  from the primary once if the replica fails to connect or execute.
+"""
+import os
+import re
+import threading
+import weakref
+
+from flask_sqlalchemy import (SQLAlchemy as _SQLAlchemy, BaseQuery,
+                              SignallingSession)
+from sqlalchemy import event, exc, orm
+from sqlalchemy.pool import QueuePool
+
+from silly_blog.contrib.changes import track_changes
+from silly_blog.contrib.instrument import instrument_engine
+
+# defaults of `create_engine` options by dialect
+DEFAULT_OPTIONS = {
+    "mysql": {
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout": 10,
+        # less than `wait_timeout` of the server
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+    },
+    "sqlite": {
+        # NOTE: SQLAlchemy uses a NullPool for database files by default,
+        # which opens a connection and applies pragmas for every checkout
+        "poolclass": QueuePool,
+        "pool_size": 5,
+        "max_overflow": 5,
+        "pool_timeout": 10,
+        "connect_args": {"check_same_thread": False},
+    },
+}
+
+# the busy timeout goes first, so switching journal mode waits for locks
+DEFAULT_SQLITE_PRAGMAS = {
+    "busy_timeout": 5000,
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # 16MB
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
+_PRAGMA_NAME = re.compile(r"^[a-z_]+$")
+_PRAGMA_VALUE = re.compile(r"^(-?\d+|[A-Za-z_]+)$")
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == "sqlite" and \
+        url.database in (None, "", ":memory:")
+
+
+def engine_options(url):
+    """Returns tuned `create_engine` options of a database URL.
+
+    :param url: a `sqlalchemy.engine.url.URL`
+    """
+    # NOTE: an in-memory SQLite database lives in a single connection
+    if _is_memory_sqlite(url):
+        return {}
+    defaults = DEFAULT_OPTIONS.get(url.get_backend_name(), {})
+    return {key: value.copy() if isinstance(value, dict) else value
+            for key, value in defaults.items()}
+
+
+def set_sqlite_pragmas(engine, pragmas):
+    """Apply pragmas to every new connection of a SQLite engine.
+
+    :raise ValueError: invalid pragma names or values
+    """
+    statements = []
+    for name, value in pragmas.items():
+        if not _PRAGMA_NAME.match(name) or \
+                not _PRAGMA_VALUE.match(str(value)):
+            raise ValueError("Invalid pragma %s = %r" % (name, value))
+        statements.append("PRAGMA %s = %s" % (name, value))
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+
+def guard_fork(engine):
+    """Don't share pooled connections with forked processes, e.g. uWSGI
+    workers forked after the master has connected.
+    """
+    @event.listens_for(engine, "connect")
+    def _remember_pid(dbapi_connection, connection_record):
+        connection_record.info["pid"] = os.getpid()
+
+    @event.listens_for(engine, "checkout")
+    def _check_pid(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info["pid"] != pid:
+            # NOTE: don't close it, the connection belongs to the parent
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError(
+                "Connection record belongs to pid %s, attempting to check "
+                "out in pid %s" % (connection_record.info["pid"], pid))
+
+
+class PoolMetrics(object):
+    """Counters and gauges of a connection pool."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, *args):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, *args):
+        with self._lock:
+            self.checkouts += 1
+
+    def _on_invalidate(self, *args):
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self):
+        """Returns a dict of current metrics, gauges are missing if the
+        pool doesn't support them, e.g. `StaticPool`.
+        """
+        # NOTE: `dispose` replaces the pool of the engine
+        pool = self.engine.pool
+        metrics = {
+            "pool": type(pool).__name__,
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "invalidations": self.invalidations,
+        }
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            method = getattr(pool, name, None)
+            if method is not None:
+                metrics[name] = method()
+        return metrics
+
+
+def _is_replica_failure(error):
+    return error.connection_invalidated or \
+        isinstance(error, exc.OperationalError)
+
+
+class RoutingSession(SignallingSession):
+    """Session which sends reads to a replica engine.
+
+    The router in `app.extensions["replicas"]` has a `get_bind()` method,
+    which returns a replica engine for the current request or None, and a
+    `fall_back()` method, which sends the rest of the request to the
+    primary. Flushes always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        router = self.app.extensions.get("replicas")
+        if router is not None and not self._flushing:
+            engine = router.get_bind()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+    def read(self, method, *args, **kwargs):
+        """Call `method`, which executes a statement, and call it again
+        on the primary if the replica fails to connect or execute.
+
+        NOTE: rows are fetched after the statement returns, so a retry
+        never returns a row twice.
+        """
+        router = self.app.extensions.get("replicas")
+        if router is None or router.get_bind() is None:
+            return method(*args, **kwargs)
+        try:
+            return method(*args, **kwargs)
+        except exc.DBAPIError as error:
+            if not _is_replica_failure(error):
+                raise
+            router.fall_back()
+        return method(*args, **kwargs)
+
+    def execute(self, clause, params=None, mapper=None, bind=None, **kw):
+        if bind is not None:
+            return super().execute(clause, params, mapper, bind, **kw)
+        return self.read(super().execute, clause, params, mapper, **kw)
+
+
+class RoutingQuery(BaseQuery):
+    """Query which reads again from the primary if the replica fails."""
+
+    def _execute_and_instances(self, querycontext):
+        return self.session.read(super()._execute_and_instances,
+                                 querycontext)
+
+
+class SQLAlchemy(_SQLAlchemy):
+    """Flask-SQLAlchemy with tuned engines."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("query_class", RoutingQuery)
+        super().__init__(*args, **kwargs)
+        self._metrics = weakref.WeakKeyDictionary()
+        self._tuning = threading.Lock()
+
+    def create_session(self, options):
+        factory = orm.sessionmaker(class_=RoutingSession, db=self, **options)
+        track_changes(factory)
+        return factory
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        # NOTE: options of `SQLALCHEMY_POOL_*` configs take precedence
+        for key, value in engine_options(sa_url).items():
+            options.setdefault(key, value)
+        # Flask-SQLAlchemy 2.4+ applies it again after driver hacks
+        options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+        return super().apply_driver_hacks(app, sa_url, options)
+
+    def get_engine(self, app=None, bind=None):
+        engine = super().get_engine(app, bind)
+        if engine not in self._metrics:
+            with self._tuning:
+                if engine not in self._metrics:
+                    self._tune(self.get_app(app), engine)
+        return engine
+
+    def _tune(self, app, engine):
+        if engine.dialect.name == "sqlite":
+            pragmas = dict(DEFAULT_SQLITE_PRAGMAS)
+            pragmas.update(app.config.get("SQLITE_PRAGMAS") or {})
+            if _is_memory_sqlite(engine.url):
+                # WAL and mmap don't apply to in-memory databases
+                pragmas = {name: value for name, value in pragmas.items()
+                           if name not in ("journal_mode", "mmap_size")}
+            set_sqlite_pragmas(engine, pragmas)
+        guard_fork(engine)
+        instrument_engine(engine)
+        self._metrics[engine] = PoolMetrics(engine)
+
+    def pool_metrics(self, app=None, bind=None):
+        """Returns metrics of the pool of an engine."""
+        return self._metrics[self.get_engine(app, bind)].snapshot()
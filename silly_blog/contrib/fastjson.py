@@ -0,0 +1,86 @@
+"""
+A pluggable JSON encoder for API responses.
+
+orjson is used if it's installed, it's several times faster than the
+standard library and serializes datetimes natively. Otherwise fall back
+to `json` with a `default` hook. Both backends render naive datetimes as
+UTC in the same format as `isotime`, e.g. "2018-08-01T12:00:00Z":
+    encoder = JSONEncoder(sort_keys=False)
+    encoder.name  # "orjson" or "json"
+    encoder.dumps({"now": datetime.datetime.utcnow()})  # bytes
+
+Register an encoder as `app.extensions["json_encoder"]`, then `dumps`
+uses it in the app context.
+"""
+import json
+import datetime
+
+from flask import current_app, has_app_context
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+from silly_blog.contrib.utils import isotime
+
+
+BACKENDS = ("auto", "orjson", "json")
+
+
+def _default(obj):
+    """Serialize objects which `json` doesn't support."""
+    if isinstance(obj, datetime.datetime):
+        return isotime(obj)
+    if isinstance(obj, datetime.date):
+        return obj.isoformat()
+    raise TypeError("Object of type %s is not JSON serializable"
+                    % type(obj).__name__)
+
+
+class JSONEncoder(object):
+    """Encode objects into UTF-8 JSON bytes.
+
+    :param backend: "orjson", "json" or "auto" to use orjson if available
+    :param sort_keys: whether to sort keys of dicts
+    """
+
+    def __init__(self, backend="auto", sort_keys=True):
+        if backend not in BACKENDS:
+            raise ValueError("Unknown JSON backend %r" % backend)
+        if backend == "orjson" and orjson is None:
+            raise ValueError("orjson is not installed")
+        if backend == "auto":
+            backend = "json" if orjson is None else "orjson"
+        self.name = backend
+        self.sort_keys = sort_keys
+
+        self._encoder = None
+        self._option = None
+        if backend == "orjson":
+            self._option = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+            if sort_keys:
+                self._option |= orjson.OPT_SORT_KEYS
+        else:
+            self._encoder = json.JSONEncoder(
+                ensure_ascii=False, sort_keys=sort_keys,
+                separators=(",", ":"), default=_default)
+
+    def dumps(self, obj):
+        """Returns JSON of `obj` as bytes."""
+        if self._encoder is None:
+            return orjson.dumps(obj, default=_default, option=self._option)
+        return self._encoder.encode(obj).encode("utf-8")
+
+
+_fallback = JSONEncoder("json")
+
+
+def dumps(obj):
+    """Encode `obj` with the encoder of current app, or the standard
+    library outside of an app context.
+    """
+    encoder = None
+    if has_app_context():
+        encoder = current_app.extensions.get("json_encoder")
+    return (encoder or _fallback).dumps(obj)
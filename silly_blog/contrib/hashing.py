@@ -0,0 +1,168 @@
+"""
+Password hashing off the request path.
+
+Hashing a password is deliberately slow, a burst of logins which hash in
+request workers will stall every other endpoint. A `PasswordHasher`
+runs them in a small thread pool instead (`hashlib` releases the GIL
+while hashing) and limits the work:
+- at most `max_pending` hashes are queued or running in a process;
+- optionally at most `slots` hashes run at the same time on the host,
+  across all worker processes, so the rest of workers keep serving.
+
+Requests over the limits fail fast with `HasherBusy`, which is a 503
+HTTP exception, rather than queue:
+    hasher = PasswordHasher("pbkdf2:sha256:260000", workers=2)
+    try:
+        ok = hasher.verify(pwhash, password)
+    except HasherBusy:
+        ...  # 503
+    if ok and hasher.needs_rehash(pwhash):
+        pwhash = hasher.hash(password)
+"""
+import os
+import time
+import threading
+import concurrent.futures
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HasherBusy(ServiceUnavailable):
+    """Too many pending password hashes."""
+
+
+class HostSlots(object):
+    """A fixed number of slots shared by processes on the same host,
+    each slot is a lock file.
+    """
+
+    def __init__(self, directory, count):
+        self.paths = [os.path.join(directory, "slot-%d.lock" % i)
+                      for i in range(count)]
+        os.makedirs(directory, exist_ok=True)
+
+    def acquire(self):
+        """Returns a file object holds a free slot, or None."""
+        for path in self.paths:
+            fp = open(path, "a")
+            try:
+                fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                fp.close()
+                continue
+            return fp
+        return None
+
+    @staticmethod
+    def release(fp):
+        try:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+        finally:
+            fp.close()
+
+
+class PasswordHasher(object):
+    """Hash and verify passwords in a bounded thread pool.
+
+    :param method: hash method of `werkzeug.security`, may contain cost,
+        e.g. "pbkdf2:sha256:260000", otherwise the default cost of
+        werkzeug applies
+    :param salt_length: length of salts
+    :param workers: number of threads
+    :param max_pending: the maximum number of queued and running hashes
+    :param slots_dir: directory of host-wide slots, None to disable
+    :param slots: the maximum number of running hashes on the host, 0 to
+        disable
+    :param slot_wait: seconds to wait for a free slot
+    :param timeout: seconds to wait for a result
+    """
+
+    def __init__(self, method="pbkdf2:sha256:260000", salt_length=16,
+                 workers=2, max_pending=8, slots_dir=None, slots=2,
+                 slot_wait=0.2, timeout=10):
+        # NOTE: the full method of stored hashes, e.g. "pbkdf2:sha256"
+        # is stored as "pbkdf2:sha256:<default iterations>"
+        self.method = generate_password_hash("", method, 1).split("$")[0]
+        self.salt_length = salt_length
+        self.workers = workers
+        self.slot_wait = slot_wait
+        self.timeout = timeout
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._slots = (HostSlots(slots_dir, slots)
+                       if slots_dir and slots and fcntl is not None
+                       else None)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # NOTE: threads don't survive fork, create a pool in every worker
+        pid = os.getpid()
+        if self._executor_pid != pid:
+            with self._lock:
+                if self._executor_pid != pid:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        self.workers, thread_name_prefix="password-hasher")
+                    self._executor_pid = pid
+        return self._executor
+
+    def _run_in_slot(self, func, *args):
+        if self._slots is None:
+            return func(*args)
+        deadline = time.monotonic() + self.slot_wait
+        slot = self._slots.acquire()
+        while slot is None:
+            if time.monotonic() >= deadline:
+                raise HasherBusy("No free password hashing slot")
+            time.sleep(0.01)
+            slot = self._slots.acquire()
+        try:
+            return func(*args)
+        finally:
+            self._slots.release(slot)
+
+    def _submit(self, func, *args):
+        if not self._pending.acquire(blocking=False):
+            raise HasherBusy("Too many pending password hashes")
+        try:
+            future = self._get_executor().submit(
+                self._run_in_slot, func, *args)
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise HasherBusy("Password hashing timed out")
+
+    def hash(self, password):
+        """Returns a salted hash of `password`.
+
+        :raise HasherBusy: over the limits
+        """
+        return self._submit(generate_password_hash, password,
+                            self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        """Check a password against a stored hash.
+
+        :raise HasherBusy: over the limits
+        """
+        return self._submit(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Whether a stored hash uses other method, cost or salt length
+        than configured.
+        """
+        if pwhash.count("$") < 2:
+            return True
+        method, salt, _ = pwhash.split("$", 2)
+        return method != self.method or len(salt) != self.salt_length
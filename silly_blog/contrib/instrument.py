@@ -0,0 +1,143 @@
+"""
+Per-request instrumentation of SQL queries.
+
+Engines are hooked by `instrument_engine`, each statement executed in a
+request is recorded into `QueryStats` of the request:
+    stats = current_stats()
+    stats.count, stats.total, stats.slowest  # seconds
+
+`QueryInstrumentation` exposes them as a `Server-Timing` header, which
+browser dev tools show, and as fields of a log record of the request:
+    Server-Timing: db;desc="12 queries";dur=8.214, db-slowest;dur=2.051
+
+A request which runs more than `SQL_QUERY_BUDGET` queries is an N+1
+suspect, it's logged as a warning, or fails with `QueryBudgetExceeded`
+if `SQL_QUERY_BUDGET_ACTION` is "raise", e.g. in tests. Queries of
+streamed response bodies run after the response is made, so they are
+not counted.
+"""
+import time
+import logging
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+
+LOG = logging.getLogger(__name__)
+
+BUDGET_ACTIONS = ("log", "raise")
+_START_KEY = "query_started"
+
+
+class QueryBudgetExceeded(Exception):
+    """A request runs more queries than the budget."""
+
+
+class QueryStats(object):
+    """Counters of queries of a request."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.total += duration
+        if duration > self.slowest:
+            self.slowest = duration
+            self.slowest_statement = statement
+
+    def server_timing(self):
+        """Returns value of the `Server-Timing` header."""
+        metrics = ['db;desc="%d queries";dur=%.3f'
+                   % (self.count, self.total * 1000)]
+        if self.count:
+            metrics.append("db-slowest;dur=%.3f" % (self.slowest * 1000))
+        return ", ".join(metrics)
+
+    def log_fields(self):
+        """Returns a dict of structured log fields."""
+        return {
+            "sql_queries": self.count,
+            "sql_time_ms": round(self.total * 1000, 3),
+            "sql_slowest_ms": round(self.slowest * 1000, 3),
+            "sql_slowest": self.slowest_statement,
+        }
+
+
+def current_stats():
+    """Returns `QueryStats` of current request, or None."""
+    if not has_request_context():
+        return None
+    return g.get("query_stats")
+
+
+def instrument_engine(engine):
+    """Record statements executed by `engine` into `current_stats()`."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context,
+                        executemany):
+        conn.info.setdefault(_START_KEY, []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context,
+                       executemany):
+        started = conn.info[_START_KEY].pop()
+        stats = current_stats()
+        if stats is not None:
+            stats.record(statement, time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _on_error(context):
+        # the statement failed, `after_cursor_execute` won't be called
+        connection = context.connection
+        if connection is not None and connection.info.get(_START_KEY):
+            connection.info[_START_KEY].pop()
+
+
+class QueryInstrumentation(object):
+    """Collect `QueryStats` of every request and report them."""
+
+    def __init__(self, app=None):
+        self.budget = None
+        self.action = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.budget = app.config["SQL_QUERY_BUDGET"]
+        self.action = app.config["SQL_QUERY_BUDGET_ACTION"]
+        if self.action not in BUDGET_ACTIONS:
+            raise ValueError("Unknown query budget action %r" % self.action)
+
+        app.extensions["query_instrumentation"] = self
+        app.before_request(self._start)
+        app.after_request(self._report)
+
+    @staticmethod
+    def _start():
+        g.query_stats = QueryStats()
+
+    def _report(self, response):
+        stats = current_stats()
+        if stats is None:
+            return response
+        response.headers.add("Server-Timing", stats.server_timing())
+        fields = stats.log_fields()
+        fields.update(method=request.method, path=request.path,
+                      endpoint=request.endpoint,
+                      status=response.status_code)
+
+        if self.budget is not None and stats.count > self.budget:
+            message = "%s %s runs %d queries, over the budget of %d" % (
+                request.method, request.path, stats.count, self.budget)
+            if self.action == "raise":
+                raise QueryBudgetExceeded(message)
+            LOG.warning(message, extra=fields)
+        else:
+            LOG.debug("%s %s runs %d queries in %.3fms", request.method,
+                      request.path, stats.count, fields["sql_time_ms"],
+                      extra=fields)
+        return response
@@ -0,0 +1,321 @@
+"""
+A shared query plan for list APIs.
+
+List APIs share the same arguments: filters, `since`, `sort`/`direction`
+and offset or cursor pagination. Declare them once as a `QueryPlan`:
+    plan = QueryPlan(lambda session: session.query(Tag),
+                     sortable=(Tag.name, Tag.updated_at),
+                     default_sort="updated_at",
+                     since=Tag.updated_at,
+                     filters=[Filter("name", Tag.name, op="like")])
+
+and run it in the view handler:
+    listing = plan.parse(request.args)  # may raise ValueError
+    rows, meta = listing.all(db.session())
+
+Queries are built with SQLAlchemy's baked queries, values are passed as
+bound parameters, so the construction and compilation of a statement is
+cached per plan shape rather than repeated for every request.
+"""
+import itertools
+
+from sqlalchemy import bindparam, inspect
+from sqlalchemy.orm import lazyload
+from sqlalchemy.ext import baked
+
+from silly_blog.contrib.pagination import (encode_cursor, decode_cursor,
+                                           seek_ranges)
+from silly_blog.contrib.utils import str2bool, parse_isotime
+
+
+DEFAULT_PAGESIZE = 20
+MAX_PAGESIZE = 1000
+
+DIRECTIONS = ("asc", "desc")
+
+
+class Filter(object):
+    """A filter which is applied when its argument is present.
+
+    :param name: name of the request argument
+    :param column: the column to compare with
+    :param op: "eq" or "like"
+    :param convert: a callable converts argument into value, it can raise
+        ValueError for invalid arguments.
+    :param skip_empty: don't filter if the value is empty
+    """
+
+    def __init__(self, name, column, op="eq", convert=None, skip_empty=False):
+        if op not in ("eq", "like"):
+            raise ValueError("Unknown filter op %r" % op)
+        self.name = name
+        self.op = op
+        self.convert = convert
+        self.skip_empty = skip_empty
+
+        param = bindparam(name)
+        self.criterion = column.like(param) if op == "like" else column == param
+        self.null_criterion = column.is_(None)
+
+    def apply(self, listing, value):
+        if self.convert is not None:
+            value = self.convert(value)
+        if self.skip_empty and not value:
+            return
+
+        if value is None:
+            criterion = self.null_criterion
+        else:
+            criterion = self.criterion
+            listing.params[self.name] = (''.join(['%', value, '%'])
+                                         if self.op == "like" else value)
+        listing.add_criteria(lambda q: q.filter(criterion),
+                             self.name, value is None)
+
+
+class QueryPlan(object):
+    """Declarative plan of a list API.
+
+    :param base: a callable accepts a session and returns the base query
+    :param sortable: a tuple of columns allowed to sort by, they must be
+        public, as cursors carry their values, and every one needs an
+        index of `(column, id_column)`
+    :param default_sort: name of the default sort column
+    :param default_direction: the default sort direction
+    :param id_column: an unique column to break ties for cursor pagination,
+        default is primary key of the class of `sortable` columns
+    :param since: a timestamp column to filter with `since` argument
+    :param filters: a list of `Filter` instances
+    :param key: a callable accepts a result row and the sort name, returns
+        `(sort value, id)` of the row, used to generate next cursor
+    """
+    bakery = baked.bakery()
+
+    def __init__(self, base, sortable, default_sort,
+                 default_direction="desc", id_column=None, since=None,
+                 filters=(), key=None):
+        self.base = base
+        self.default_sort = default_sort
+        self.default_direction = default_direction
+        if id_column is None:
+            cls = sortable[0].class_
+            id_column = getattr(cls, inspect(cls).primary_key[0].key)
+        self.id_column = id_column
+        self.filters = tuple(filters)
+        self.since_criterion = (None if since is None else
+                                since >= bindparam("_since"))
+        self.key = key or (lambda row, sort: (getattr(row, sort), row.id))
+
+        # precompute the whitelist of sort columns and order expressions
+        self.columns = {column.key: column for column in sortable}
+        if default_sort not in self.columns:
+            raise ValueError("Unknown default sort %r" % default_sort)
+        self.orders = {
+            (sort, direction): (getattr(column, direction)(),
+                                getattr(self.id_column, direction)())
+            for sort, column in self.columns.items()
+            for direction in DIRECTIONS
+        }
+
+    def parse(self, args):
+        """Parse request arguments into a `Listing`.
+
+        :raise ValueError: invalid arguments
+        """
+        listing = Listing(self, self.bakery(self.base))
+
+        for filter_ in self.filters:
+            value = args.get(filter_.name)
+            if value is not None:
+                filter_.apply(listing, value)
+
+        since = args.get("since")
+        if since is not None and self.since_criterion is not None:
+            listing.params["_since"] = parse_isotime(since)
+            criterion = self.since_criterion
+            listing.add_criteria(lambda q: q.filter(criterion), "since")
+
+        listing.sort = args.get("sort", self.default_sort)
+        if listing.sort not in self.columns:
+            raise ValueError("Unknown sort %r" % listing.sort)
+        listing.direction = args.get("direction", self.default_direction)
+        if listing.direction not in DIRECTIONS:
+            raise ValueError("Unknown direction %r" % listing.direction)
+
+        listing.cursor = args.get("cursor")
+        with_total = args.get("with_total")
+        listing.with_total = (listing.cursor is None if with_total is None
+                              else str2bool(with_total))
+        if listing.cursor is None:
+            page = _parse_int(args, "page")
+            pagesize = _parse_int(args, "pagesize")
+            if page is not None and pagesize is not None:
+                # page starts from 1
+                listing.params["_offset"] = max((page - 1) * pagesize, 0)
+                listing.pagesize = pagesize
+        else:
+            pagesize = _parse_int(args, "pagesize", DEFAULT_PAGESIZE)
+            if not 0 < pagesize <= MAX_PAGESIZE:
+                raise ValueError("Unknown pagesize %r" % pagesize)
+            listing.pagesize = pagesize
+            if listing.cursor:
+                column = self.columns[listing.sort]
+                listing.seek = decode_cursor(
+                    listing.cursor, listing.sort, listing.direction, column)
+
+        return listing
+
+
+class Listing(object):
+    """A parsed list request of a `QueryPlan`."""
+
+    def __init__(self, plan, baked_query):
+        self.plan = plan
+        self.baked_query = baked_query
+        self.params = {}
+        self.sort = None
+        self.direction = None
+        self.cursor = None
+        self.seek = None
+        self.pagesize = None
+        self.with_total = True
+        self.order = None
+
+    def add_criteria(self, fn, *args):
+        """Add a criteria function to the query.
+
+        NOTE: `args` are part of the cache key, they must identify the
+        generated SQL if `fn` is a closure.
+        """
+        self.baked_query.add_criteria(fn, *args)
+
+    def order_by(self, clause, *args):
+        """Order by a custom clause rather than the sort column.
+
+        NOTE: `args` are part of the cache key as `add_criteria`, and only
+        offset pagination is supported.
+        """
+        if self.cursor is not None:
+            raise ValueError("Cursor is not supported with this order")
+        id_order = self.plan.orders[(self.sort, self.direction)][1]
+        self.order = (lambda q: q.order_by(clause, id_order),
+                      args + (self.sort, self.direction))
+
+    def _ordered(self):
+        """Returns a baked query of offset pagination with order and
+        limit criteria.
+        """
+        sort, direction = self.sort, self.direction
+        order = self.plan.orders[(sort, direction)][0]
+        bq = self.baked_query
+        if self.order is not None:
+            bq = bq.with_criteria(self.order[0], *self.order[1])
+        else:
+            bq = bq.with_criteria(lambda q: q.order_by(order),
+                                  sort, direction)
+        if self.pagesize is not None:
+            self.params["_limit"] = self.pagesize
+            bq += lambda q: q.offset(bindparam("_offset")).\
+                limit(bindparam("_limit"))
+        return bq
+
+    def _seeks(self):
+        """Returns baked queries of cursor pagination with seek, order and
+        limit criteria, rows of the page are their rows in order, see
+        `seek_ranges`.
+        """
+        sort, direction = self.sort, self.direction
+        order, id_order = self.plan.orders[(sort, direction)]
+        queries = [self.baked_query]
+        if self.seek is not None:
+            value, id_ = self.seek
+            self.params["_seek_id"] = id_
+            if value is not None:
+                self.params["_seek_value"] = value
+            ranges = seek_ranges(
+                self.plan.columns[sort], self.plan.id_column, direction,
+                None if value is None else bindparam("_seek_value"),
+                bindparam("_seek_id"))
+            queries = [self.baked_query.with_criteria(
+                lambda q, criterion=criterion: q.filter(criterion),
+                sort, direction, value is None, index)
+                for index, criterion in enumerate(ranges)]
+        return [bq.with_criteria(
+            lambda q: q.order_by(order, id_order).limit(bindparam("_limit")),
+            sort, direction) for bq in queries]
+
+    def _meta(self, session):
+        meta = {}
+        if self.with_total:
+            meta["total"] = self.baked_query(session).params(
+                **self.params).count()
+        return meta
+
+    def all(self, session):
+        """Execute the query.
+
+        :return: a tuple of `(rows, meta)`, `meta` is a dict which may
+            contain "total" and "next_cursor".
+        """
+        meta = self._meta(session)
+        if self.cursor is None:
+            rows = self._ordered()(session).params(**self.params).all()
+            return rows, meta
+
+        # fetch one more row to know whether there is a next page
+        rows = []
+        for bq in self._seeks():
+            self.params["_limit"] = self.pagesize + 1 - len(rows)
+            rows.extend(bq(session).params(**self.params).all())
+            if len(rows) > self.pagesize:
+                break
+        meta["next_cursor"] = None
+        if len(rows) > self.pagesize:
+            rows = rows[:self.pagesize]
+            meta["next_cursor"] = encode_cursor(
+                self.sort, self.direction,
+                *self.plan.key(rows[-1], self.sort))
+        return rows, meta
+
+    def batches(self, session, size):
+        """Execute the query and fetch rows in batches with `yield_per`.
+
+        A page of cursor pagination is fetched at once, as it's limited
+        by `MAX_PAGESIZE`. Relationships are lazy loaded unless they have
+        explicit loader options, e.g. `joinedload`.
+
+        :return: a tuple of `(batches, meta)`, `batches` is an iterator of
+            lists of at most `size` rows, `meta` is the same as `all`.
+        """
+        if self.cursor is not None:
+            rows, meta = self.all(session)
+            return iter([rows]), meta
+
+        meta = self._meta(session)
+        # NOTE: a part of the baked query, baked results ignore post
+        # criteria when loading rows. Subquery eager loads don't work with
+        # `yield_per`, relationships without explicit options are lazy.
+        bq = self._ordered().with_criteria(
+            lambda q: q.options(lazyload("*")).yield_per(size),
+            "yield_per", size)
+        query = bq(session).params(**self.params)
+
+        def generate():
+            rows = iter(query)
+            while True:
+                batch = list(itertools.islice(rows, size))
+                if not batch:
+                    break
+                yield batch
+
+        return generate(), meta
+
+
+def _parse_int(args, name, default=None):
+    value = args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError("Unknown %s %r" % (name, value))
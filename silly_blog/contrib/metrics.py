@@ -0,0 +1,344 @@
+"""
+Prometheus metrics aggregated across worker processes.
+
+uWSGI runs several worker processes, a scrape reaches one of them, but
+must report the sum of all. Every process writes its values into its own
+files in a directory shared by the workers, which are mapped into memory,
+so an update is a `struct.pack_into` without any syscall. A scrape reads
+the files of all processes and sums them up:
+    store = MetricsStore('/tmp/silly-blog/metrics')
+    requests = Counter(store, 'http_requests_total', 'Requests.',
+                       ['endpoint', 'status'])
+    requests.inc(endpoint='tags', status='200')
+    ...
+    text = expose([requests], store.collect())
+
+Counters and histograms keep values of exited processes, gauges only sum
+up processes which are alive. Clear the directory before the workers
+start, e.g. on deployment.
+"""
+import os
+import json
+import mmap
+import math
+import struct
+import threading
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+                   1.0, 2.5, 5.0, 7.5, 10.0)
+
+_HEADER = struct.Struct("i")
+_LENGTH = struct.Struct("i")
+_VALUE = struct.Struct("d")
+_INITIAL_SIZE = 64 * 1024
+
+
+def _entries(data, used):
+    """Yields `(key, value, offset of value)` of entries in `data`."""
+    pos = _HEADER.size
+    while pos < used:
+        length, = _LENGTH.unpack_from(data, pos)
+        pos += _LENGTH.size
+        key = bytes(data[pos:pos + length]).decode("utf-8")
+        pos += length
+        pos += -pos % _VALUE.size  # values are aligned
+        value, = _VALUE.unpack_from(data, pos)
+        yield key, value, pos
+        pos += _VALUE.size
+
+
+def read_values(path):
+    """Returns a dict of values in a file written by `ValueFile`."""
+    with open(path, "rb") as fp:
+        data = fp.read()
+    if len(data) < _HEADER.size:
+        return {}
+    used, = _HEADER.unpack_from(data, 0)
+    return {key: value for key, value, _ in _entries(data, used)}
+
+
+class ValueFile(object):
+    """Float values by keys in a file mapped into memory.
+
+    Only one process writes a file. New entries are written before the
+    used size in the header, so readers never see a partial entry.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fp = open(path, "a+b")
+        size = os.fstat(self._fp.fileno()).st_size
+        if size < _INITIAL_SIZE:
+            self._fp.truncate(_INITIAL_SIZE)
+            size = _INITIAL_SIZE
+        self._mmap = mmap.mmap(self._fp.fileno(), size)
+        self._used, = _HEADER.unpack_from(self._mmap, 0)
+        if not self._used:
+            self._used = _HEADER.size
+            _HEADER.pack_into(self._mmap, 0, self._used)
+        self._positions = {key: pos for key, _, pos
+                           in _entries(self._mmap, self._used)}
+
+    def _add(self, key):
+        encoded = key.encode("utf-8")
+        pos = self._used + _LENGTH.size + len(encoded)
+        pos += -pos % _VALUE.size
+        end = pos + _VALUE.size
+        if end > len(self._mmap):
+            size = len(self._mmap)
+            while end > size:
+                size *= 2
+            self._mmap.close()
+            self._fp.truncate(size)
+            self._mmap = mmap.mmap(self._fp.fileno(), size)
+
+        _LENGTH.pack_into(self._mmap, self._used, len(encoded))
+        start = self._used + _LENGTH.size
+        self._mmap[start:start + len(encoded)] = encoded
+        _VALUE.pack_into(self._mmap, pos, 0.0)
+        self._used = end
+        _HEADER.pack_into(self._mmap, 0, self._used)
+        self._positions[key] = pos
+        return pos
+
+    def get(self, key):
+        pos = self._positions.get(key)
+        return 0.0 if pos is None else _VALUE.unpack_from(self._mmap, pos)[0]
+
+    def set(self, key, value):
+        pos = self._positions.get(key)
+        if pos is None:
+            pos = self._add(key)
+        _VALUE.pack_into(self._mmap, pos, value)
+
+    def close(self):
+        self._mmap.close()
+        self._fp.close()
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsStore(object):
+    """Values of metrics shared by processes through a directory.
+
+    Each process writes `counter_<pid>.db` and `gauge_<pid>.db`, files are
+    opened lazily, so a forked worker writes its own ones.
+    """
+
+    KINDS = ("counter", "gauge")
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}
+        self._pid = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _file(self, kind):
+        pid = os.getpid()
+        if pid != self._pid:
+            # NOTE: don't close files inherited from the parent
+            self._files = {}
+            self._pid = pid
+        values = self._files.get(kind)
+        if values is None:
+            values = ValueFile(os.path.join(
+                self.directory, "%s_%d.db" % (kind, pid)))
+            self._files[kind] = values
+        return values
+
+    def inc(self, kind, key, amount=1.0):
+        with self._lock:
+            values = self._file(kind)
+            values.set(key, values.get(key) + amount)
+
+    def set(self, kind, key, value):
+        with self._lock:
+            self._file(kind).set(key, value)
+
+    def collect(self):
+        """Returns a dict maps keys to values summed up by processes."""
+        totals = {}
+        for name in os.listdir(self.directory):
+            kind, _, pid = name[:-len(".db")].partition("_")
+            if not name.endswith(".db") or kind not in self.KINDS or \
+                    not pid.isdigit():
+                continue
+            path = os.path.join(self.directory, name)
+            if kind == "gauge" and not _is_alive(int(pid)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            try:
+                values = read_values(path)
+            except FileNotFoundError:
+                continue
+            for key, value in values.items():
+                totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())])
+
+
+class _Keys(dict):
+    """Cache of keys of samples, label sets of a metric are few."""
+
+    def get_key(self, name, labels):
+        cache_key = (name, tuple(sorted(labels.items())))
+        key = self.get(cache_key)
+        if key is None:
+            key = self[cache_key] = _key(name, labels)
+        return key
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value):
+        return "%d" % value
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").\
+        replace('"', r"\"")
+
+
+def _format_sample(name, labels, value):
+    if labels:
+        name += "{%s}" % ",".join('%s="%s"' % (key, _escape(label))
+                                  for key, label in labels)
+    return "%s %s" % (name, _format_value(value))
+
+
+class Metric(object):
+    """Base class of metrics."""
+
+    kind = None
+    type = None
+
+    def __init__(self, store, name, documentation, labelnames=()):
+        self.store = store
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._keys = _Keys()
+
+    def _check(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("Labels of %s are %s" % (
+                self.name, ", ".join(self.labelnames)))
+
+    def samples(self, values):
+        """Yields `(name, sorted label pairs, value)` of the metric in
+        values collected by the store.
+        """
+        for key, value in sorted(values.items()):
+            name, labels = json.loads(key)
+            if name == self.name:
+                yield name, labels, value
+
+
+class Counter(Metric):
+    kind = "counter"
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        self._check(labels)
+        self.store.inc(self.kind, self._keys.get_key(self.name, labels),
+                       amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        self._check(labels)
+        self.store.inc(self.kind, self._keys.get_key(self.name, labels),
+                       amount)
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        self._check(labels)
+        self.store.set(self.kind, self._keys.get_key(self.name, labels),
+                       value)
+
+
+class Histogram(Metric):
+    """A histogram stores a count per bucket, they are accumulated when
+    exposed, so an observation is two writes.
+    """
+
+    kind = "counter"
+    type = "histogram"
+
+    def __init__(self, store, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(store, name, documentation, labelnames)
+        if "le" in self.labelnames:
+            raise ValueError("Histograms can't have a label named le")
+        self.buckets = tuple(sorted(float(b) for b in buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        self._check(labels)
+        for bound in self.buckets:
+            if value <= bound:
+                break
+        bucket = dict(labels, le=_format_value(bound))
+        self.store.inc(self.kind,
+                       self._keys.get_key(self.name + "_bucket", bucket))
+        self.store.inc(self.kind,
+                       self._keys.get_key(self.name + "_sum", labels), value)
+
+    def samples(self, values):
+        counts, sums = {}, {}
+        for key, value in values.items():
+            name, labels = json.loads(key)
+            if name == self.name + "_sum":
+                sums[tuple(map(tuple, labels))] = value
+            elif name == self.name + "_bucket":
+                labels = dict(labels)
+                bound = labels.pop("le")
+                counts.setdefault(tuple(sorted(labels.items())), {})[
+                    bound] = value
+
+        for labels in sorted(counts):
+            total = 0
+            for bound in self.buckets:
+                total += counts[labels].get(_format_value(bound), 0)
+                le = list(labels) + [("le", _format_value(bound))]
+                yield self.name + "_bucket", le, total
+            yield self.name + "_count", list(labels), total
+            yield self.name + "_sum", list(labels), sums.get(labels, 0.0)
+
+
+def expose(metrics, values):
+    """Returns metrics in the text format of Prometheus.
+
+    :param metrics: a list of `Metric`s
+    :param values: values collected by `MetricsStore.collect`
+    """
+    lines = []
+    for metric in metrics:
+        lines.append("# HELP %s %s" % (metric.name, metric.documentation))
+        lines.append("# TYPE %s %s" % (metric.name, metric.type))
+        for name, labels, value in metric.samples(values):
+            lines.append(_format_sample(name, labels, value))
+    return "\n".join(lines) + "\n"
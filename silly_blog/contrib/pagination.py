@@ -0,0 +1,80 @@
+"""
+Keyset(also known as cursor or seek) pagination helpers for list APIs.
+
+Offset pagination is kept for compatibility, but it gets slower linearly
+with the page number. Keyset pagination seeks on the sort column plus an
+unique id column, so every page costs the same:
+    GET /articles/?cursor=&pagesize=20  ->  {..., "next_cursor": "xxx"}
+    GET /articles/?cursor=xxx&pagesize=20
+
+It needs an index of `(sort column, id column)` for every sort column.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from sqlalchemy import and_, or_
+from sqlalchemy import types as sqltypes
+import iso8601
+
+
+def encode_cursor(sort, direction, value, id_):
+    """Encode position of the last row into an opaque string."""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        value = value.isoformat()
+    payload = json.dumps([sort, direction, value, id_],
+                         separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort, direction, column):
+    """Decode a cursor into `(value, id)` of the last row.
+
+    :param column: the sort column, used to restore value's type
+    :raise ValueError: cursor is malformed or doesn't match sort/direction
+    """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        payload = base64.urlsafe_b64decode((cursor + padding).encode('ascii'))
+        _sort, _direction, value, id_ = json.loads(payload.decode('utf-8'))
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError('Invalid cursor %r' % cursor)
+    if (_sort, _direction) != (sort, direction):
+        raise ValueError('Cursor %r does not match sort and direction'
+                         % cursor)
+
+    if value is not None and isinstance(column.type, sqltypes.Date):
+        value = iso8601.parse_date(value, default_timezone=None).date()
+    elif value is not None and isinstance(column.type, sqltypes.DateTime):
+        value = iso8601.parse_date(value, default_timezone=None)
+    return value, id_
+
+
+def seek_ranges(column, id_column, direction, value, id_):
+    """Build where clauses to seek rows after `(value, id)`.
+
+    Rows after the position are the rows of every clause in order. Each
+    clause bounds the sort column, so it's a range of the index rather
+    than a scan from the first row, which an OR of NULLs and non-NULLs
+    would be.
+
+    NOTE: NULLs are considered smaller than any other values, as SQLite
+    and MySQL do.
+    """
+    if direction == 'asc':
+        if value is None:
+            return [and_(column.is_(None), id_column > id_),
+                    column.isnot(None)]
+        return [and_(column >= value,
+                     or_(column > value,
+                         and_(column == value, id_column > id_)))]
+    else:
+        if value is None:
+            return [and_(column.is_(None), id_column < id_)]
+        ranges = [and_(column <= value,
+                       or_(column < value,
+                           and_(column == value, id_column < id_)))]
+        if getattr(column, 'nullable', True):
+            ranges.append(column.is_(None))
+        return ranges
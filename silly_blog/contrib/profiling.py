@@ -0,0 +1,228 @@
+"""
+Profiling of sampled and slow requests.
+
+`ProfilingMiddleware` wraps a WSGI app like `SizeLimitMiddleware`, and
+writes profiles into a directory which keeps the latest files only:
+- a fraction of requests, `PROFILE_SAMPLE_RATE`, run under cProfile and
+  are saved as ".prof" files, which `pstats`, snakeviz or gprof2dot load;
+- requests taking longer than `PROFILE_SLOW_SECONDS` have their stacks
+  sampled by a thread every `PROFILE_INTERVAL` seconds until they finish,
+  and are saved as ".folded" files of collapsed stacks, which
+  flamegraph.pl and speedscope load.
+
+The sampler thread sleeps until the earliest request in progress becomes
+slow, so a fast request only costs registering its thread.
+"""
+import os
+import re
+import sys
+import time
+import random
+import cProfile
+import logging
+import threading
+import collections
+
+from werkzeug.wsgi import ClosingIterator
+
+
+LOG = logging.getLogger(__name__)
+
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def fold_stack(frame):
+    """Returns a frame and its callers in the collapsed stack format,
+    callers first and separated by semicolons.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append("%s (%s:%d)" % (code.co_name, code.co_filename,
+                                     code.co_firstlineno))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _Tracked(object):
+
+    __slots__ = ("started", "stacks")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stacks = collections.Counter()
+
+
+class StackSampler(object):
+    """Sample stacks of tracked threads once they run longer than
+    `threshold` seconds.
+    """
+
+    def __init__(self, threshold, interval):
+        self.threshold = threshold
+        self.interval = interval
+        self._tracked = {}
+        self._cond = threading.Condition()
+        self._pid = None
+
+    def _ensure_thread(self):
+        # NOTE: threads don't survive fork, start one in each worker
+        pid = os.getpid()
+        if self._pid != pid:
+            self._pid = pid
+            thread = threading.Thread(target=self._run,
+                                      name="stack-sampler", daemon=True)
+            thread.start()
+
+    def track(self, ident):
+        with self._cond:
+            self._ensure_thread()
+            tracked = self._tracked[ident] = _Tracked()
+            if len(self._tracked) == 1:
+                self._cond.notify()
+        return tracked
+
+    def untrack(self, ident):
+        with self._cond:
+            return self._tracked.pop(ident, None)
+
+    def _run(self):
+        with self._cond:
+            while True:
+                if not self._tracked:
+                    self._cond.wait()
+                    continue
+                now = time.perf_counter()
+                slow = [(ident, tracked)
+                        for ident, tracked in self._tracked.items()
+                        if now - tracked.started >= self.threshold]
+                if not slow:
+                    earliest = min(tracked.started
+                                   for tracked in self._tracked.values())
+                    self._cond.wait(earliest + self.threshold - now)
+                    continue
+                frames = sys._current_frames()
+                for ident, tracked in slow:
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        tracked.stacks[fold_stack(frame)] += 1
+                del frames
+                self._cond.wait(self.interval)
+
+
+class ProfilingMiddleware(object):
+    """Profile sampled or slow requests into a rotating directory."""
+
+    def __init__(self, app):
+        self.app = app.wsgi_app
+        self.directory = app.config["PROFILE_DIR"]
+        self.sample_rate = app.config["PROFILE_SAMPLE_RATE"]
+        self.max_files = app.config["PROFILE_MAX_FILES"]
+        slow_seconds = app.config["PROFILE_SLOW_SECONDS"]
+        self.sampler = None
+        # NOTE: a single cProfile at a time, since Python 3.12 profilers
+        # of different threads conflict
+        self._profiling = threading.Lock()
+        if slow_seconds is not None:
+            self.sampler = StackSampler(slow_seconds,
+                                        app.config["PROFILE_INTERVAL"])
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __call__(self, environ, start_response):
+        if self.sample_rate and random.random() < self.sample_rate and \
+                self._profiling.acquire(blocking=False):
+            try:
+                return self._profile(environ, start_response)
+            except Exception:
+                self._profiling.release()
+                raise
+        if self.sampler is None:
+            return self.app(environ, start_response)
+
+        ident = threading.get_ident()
+        self.sampler.track(ident)
+
+        def finish():
+            tracked = self.sampler.untrack(ident)
+            if tracked is not None and tracked.stacks:
+                elapsed = time.perf_counter() - tracked.started
+                self._write(environ, elapsed, "folded",
+                            lambda path: self._write_folded(
+                                path, tracked.stacks))
+
+        try:
+            iterable = self.app(environ, start_response)
+        except Exception:
+            finish()
+            raise
+        # NOTE: streamed bodies are generated while iterating
+        return ClosingIterator(iterable, finish)
+
+    def _profile(self, environ, start_response):
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+
+        def finish():
+            profile.disable()
+            self._profiling.release()
+            self._write(environ, time.perf_counter() - started, "prof",
+                        profile.dump_stats)
+
+        profile.enable()
+        try:
+            iterable = self.app(environ, start_response)
+        finally:
+            profile.disable()
+
+        callbacks = [finish]
+        close = getattr(iterable, "close", None)
+        if close is not None:
+            callbacks.insert(0, close)
+        return ClosingIterator(self._profiled(profile, iterable), callbacks)
+
+    @staticmethod
+    def _profiled(profile, iterable):
+        # profile generating every chunk of streamed bodies
+        iterator = iter(iterable)
+        while True:
+            profile.enable()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                profile.disable()
+            yield chunk
+
+    @staticmethod
+    def _write_folded(path, stacks):
+        with open(path, "w") as fp:
+            for stack, count in stacks.most_common():
+                fp.write("%s %d\n" % (stack, count))
+
+    def _write(self, environ, elapsed, suffix, dump):
+        name = "%s-%d-%s-%s-%dms.%s" % (
+            time.strftime("%Y%m%dT%H%M%S"), os.getpid(),
+            environ.get("REQUEST_METHOD"),
+            _UNSAFE_CHARS.sub("_", environ.get("PATH_INFO", "")).strip("_")
+            or "root", elapsed * 1000, suffix)
+        try:
+            dump(os.path.join(self.directory, name))
+            self._rotate()
+        except OSError:
+            LOG.exception("Write profile %r failed", name)
+
+    def _rotate(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith((".prof", ".folded")):
+                try:
+                    files.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    continue
+        files.sort()
+        for _, path in files[:max(len(files) - self.max_files, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
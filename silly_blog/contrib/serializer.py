@@ -0,0 +1,77 @@
+"""
+Serializers of mapped classes which are generated once per class.
+
+A `Serializer` resolves the columns, excludes and converters of a model
+up front, so serializing a row is a loop over a fixed tuple:
+    serialize = Serializer(Article, excludes={"content"})
+    serialize(article)  # a dict of an ORM object
+
+It also serializes rows of Core or column queries without hydrating ORM
+objects, the row must contain `serialize.columns`:
+    rows = session.query(*serialize.columns).all()
+    [serialize.from_row(row) for row in rows]
+"""
+import datetime
+
+from sqlalchemy import inspect
+
+from silly_blog.contrib.utils import isotime
+
+
+def _isotime_or_none(value):
+    return isotime(value) if value is not None else None
+
+
+def converter_of(column):
+    """Returns a callable converts values of `column` into JSON-able ones,
+    or None if the values are JSON-able.
+    """
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return None
+    if issubclass(python_type, datetime.datetime):
+        return _isotime_or_none
+    return None
+
+
+class Serializer(object):
+    """Serialize instances or rows of a mapped class into dicts.
+
+    :param model: a mapped class
+    :param excludes: names of columns to leave out
+    """
+
+    def __init__(self, model, excludes=()):
+        excludes = frozenset(excludes)
+        mapper = inspect(model)
+        fields, columns = [], []
+        for column in model.__table__.columns:
+            if column.name in excludes:
+                continue
+            key = mapper.get_property_by_column(column).key
+            fields.append((column.name, key, converter_of(column)))
+            columns.append(getattr(model, key))
+
+        self.model = model
+        self.excludes = excludes
+        self.columns = tuple(columns)
+        # (name, attribute key) of values which are JSON-able as they are
+        self._plain = tuple((name, key) for name, key, conv in fields
+                            if conv is None)
+        self._converted = tuple(field for field in fields
+                                if field[2] is not None)
+
+    def __call__(self, obj):
+        """Serialize an instance of the model."""
+        result = {name: getattr(obj, key) for name, key in self._plain}
+        for name, key, convert in self._converted:
+            result[name] = convert(getattr(obj, key))
+        return result
+
+    def from_row(self, row):
+        """Serialize a row which contains `columns`, e.g. a result row of
+        `session.query(*serializer.columns)`.
+        """
+        # NOTE: labels of column queries are attribute keys
+        return self(row)
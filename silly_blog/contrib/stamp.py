@@ -0,0 +1,45 @@
+"""
+Cheap version stamps shared by processes on the same host.
+
+A stamp is a small file, bumping it replaces the file atomically, so its
+`(inode, mtime, size)` changes. Processes check the stamp with a single
+`stat` call, which is much cheaper than a database query, and discard
+their in-process caches when it changes:
+    stamp = VersionStamp('/tmp/silly-blog/categories.stamp')
+    if snapshot.version != stamp.current():
+        snapshot = reload()
+    ...
+    stamp.bump()  # after writes committed
+"""
+import os
+import uuid
+import tempfile
+
+
+class VersionStamp(object):
+    """A version stamp backed by a file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def current(self):
+        """Returns current version, `None` if it never be bumped."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def bump(self):
+        """Change the version, visible to all processes."""
+        dirname = os.path.dirname(self.path)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname)
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                fp.write(uuid.uuid4().hex)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
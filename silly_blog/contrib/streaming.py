@@ -0,0 +1,102 @@
+"""
+Streaming responses of large collections.
+
+A list API builds the full list of dicts and one big JSON string of them
+in memory, which is fine for pages but not for a whole collection. With
+`stream=json` (or `stream=true`) the response body is emitted batch by
+batch instead, and with `stream=ndjson` or `Accept: application/x-ndjson`
+as newline delimited JSON, one item per line:
+    fmt = stream_format()  # may raise ValueError
+    if fmt is not None:
+        batches, meta = listing.batches(db.session(), batch_size)
+        items = ([item.to_dict() for item in rows] for rows in batches)
+        return stream_collection("tags", meta, items, fmt)
+
+Peak memory is bounded by the batch size rather than the result set.
+Meta of NDJSON responses is sent as headers: `X-Total-Count` and
+`X-Next-Cursor`. Responses whose format is negotiated by `Accept` have
+`Vary: Accept`.
+"""
+from flask import request, stream_with_context, Response, after_this_request
+
+from silly_blog.contrib.utils import str2bool
+from silly_blog.contrib.fastjson import dumps
+
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+FORMATS = ("json", "ndjson")
+
+
+def accepts_ndjson():
+    """Whether `Accept` of the request prefers NDJSON to JSON."""
+    accept = request.accept_mimetypes
+    return accept.best_match(["application/json", NDJSON_MIMETYPE]) == \
+        NDJSON_MIMETYPE
+
+
+def _vary_accept(response):
+    response.vary.add("Accept")
+    return response
+
+
+def stream_format():
+    """Returns the requested stream format, "json", "ndjson" or None if
+    the response shouldn't be streamed.
+
+    :raise ValueError: unknown `stream` argument
+    """
+    value = request.args.get("stream")
+    if value is None:
+        after_this_request(_vary_accept)
+        return "ndjson" if accepts_ndjson() else None
+    if value in FORMATS:
+        return value
+    try:
+        return "json" if str2bool(value) else None
+    except ValueError:
+        raise ValueError("Unknown stream %r" % value)
+
+
+def _generate_json(name, meta, batches):
+    head = dumps(meta)
+    # open the object with meta, then the list of items
+    yield b"".join([head[:-1], b"," if meta else b"", dumps(name), b":["])
+    first = True
+    for items in batches:
+        if not items:
+            continue
+        chunk = dumps(items)[1:-1]
+        yield chunk if first else b"," + chunk
+        first = False
+    yield b"]}"
+
+
+def _generate_ndjson(batches):
+    for items in batches:
+        if items:
+            yield b"".join(dumps(item) + b"\n" for item in items)
+
+
+def stream_collection(name, meta, batches, fmt="json", headers=None):
+    """Returns a streamed response of a collection.
+
+    :param name: key of the list of items in the JSON object
+    :param meta: a dict of other keys, e.g. "total"
+    :param batches: an iterable of lists of JSON-able items, it's consumed
+        in the request context while the response is sent
+    :param fmt: "json" or "ndjson"
+    :param headers: extra headers, e.g. validators
+    """
+    if fmt == "ndjson":
+        response = Response(stream_with_context(_generate_ndjson(batches)),
+                            mimetype=NDJSON_MIMETYPE, headers=headers)
+        if meta.get("total") is not None:
+            response.headers["X-Total-Count"] = str(meta["total"])
+        if meta.get("next_cursor"):
+            response.headers["X-Next-Cursor"] = meta["next_cursor"]
+    else:
+        response = Response(
+            stream_with_context(_generate_json(name, meta, batches)),
+            mimetype="application/json", headers=headers)
+    response.vary.add("Accept")
+    return response
@@ -4,7 +4,7 @@ Some Utils For Self-Used Without Generality.
 import datetime
 import functools
 
-from flask import g, request, jsonify
+from flask import g, request, current_app
 from flask.wrappers import BadRequest
 from marshmallow import Schema
 import iso8601
@@ -21,15 +21,16 @@ def make_error_response(status, message, code=None):
     :type code: none or int
     :return: a flask.wrappers.Response object
     """
-    response = jsonify({
+    from silly_blog.contrib.fastjson import dumps
+    body = dumps({
         "error": {
             "status": status,
             "message": message,
             "code": code,
         }
     })
-    response.status_code = status
-    return response
+    return current_app.response_class(body, status=status,
+                                      mimetype="application/json")
 
 
 def _check_json_body():
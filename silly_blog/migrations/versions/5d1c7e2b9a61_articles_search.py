@@ -0,0 +1,36 @@
+"""'articles search index'
+
+Revision ID: 5d1c7e2b9a61
+Revises: 930fa946da04
+Create Date: 2026-10-18 11:02:47.120391
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5d1c7e2b9a61'
+down_revision = '930fa946da04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    from silly_blog.app.search import get_backend
+    connection = op.get_bind()
+    backend = get_backend(connection.dialect.name)
+    for statement in backend.ddl:
+        op.execute(statement)
+    # index existing articles
+    if backend.name == 'sqlite':
+        backend.rebuild(connection)
+
+
+def downgrade():
+    from silly_blog.app.search import get_backend
+    connection = op.get_bind()
+    backend = get_backend(connection.dialect.name)
+    for statement in backend.drop_ddl:
+        op.execute(statement)
+    if backend.name == 'mysql':
+        op.drop_index('ft_articles', table_name='articles')
@@ -0,0 +1,31 @@
+"""'article_stars'
+
+Revision ID: 7b3e9d41c2f8
+Revises: 5d1c7e2b9a61
+Create Date: 2026-10-18 21:40:12.503184
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3e9d41c2f8'
+down_revision = '5d1c7e2b9a61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('article_stars',
+    sa.Column('article_id', sa.String(length=64), nullable=False),
+    sa.Column('user_id', sa.String(length=64), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+    sa.ForeignKeyConstraint(['article_id'], ['articles.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('article_id', 'user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('article_stars')
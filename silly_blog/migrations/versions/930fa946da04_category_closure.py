@@ -0,0 +1,54 @@
+"""'category_closure'
+
+Revision ID: 930fa946da04
+Revises: 134747277d2e
+Create Date: 2026-10-18 10:12:36.418250
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '930fa946da04'
+down_revision = '134747277d2e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    closure = op.create_table('category_closure',
+    sa.Column('ancestor_id', sa.String(length=64), nullable=False),
+    sa.Column('descendant_id', sa.String(length=64), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ancestor_id'], ['categories.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['descendant_id'], ['categories.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id')
+    )
+    op.create_index('ix_category_closure_descendant', 'category_closure',
+                    ['descendant_id', 'depth'], unique=False)
+
+    # populate paths of existing categories
+    categories = sa.table('categories',
+                          sa.column('id', sa.String),
+                          sa.column('parent_id', sa.String))
+    parents = dict(op.get_bind().execute(
+        sa.select([categories.c.id, categories.c.parent_id])).fetchall())
+    rows = []
+    for descendant_id in parents:
+        ancestor_id, depth = descendant_id, 0
+        # NOTE: without foreign keys enforced, e.g. by SQLite, a parent
+        # may be missing, paths of its orphans end below it
+        while ancestor_id in parents and depth <= len(parents):
+            rows.append({'ancestor_id': ancestor_id,
+                         'descendant_id': descendant_id,
+                         'depth': depth})
+            ancestor_id, depth = parents.get(ancestor_id), depth + 1
+    if rows:
+        op.bulk_insert(closure, rows)
+
+
+def downgrade():
+    op.drop_index('ix_category_closure_descendant',
+                  table_name='category_closure')
+    op.drop_table('category_closure')
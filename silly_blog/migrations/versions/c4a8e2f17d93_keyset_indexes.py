@@ -0,0 +1,43 @@
+"""'keyset_indexes'
+
+Revision ID: c4a8e2f17d93
+Revises: 7b3e9d41c2f8
+Create Date: 2026-10-19 10:12:36.418209
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a8e2f17d93'
+down_revision = '7b3e9d41c2f8'
+branch_labels = None
+depends_on = None
+
+# (index, table, columns) for keyset pagination of sortable columns
+INDEXES = (
+    ('ix_articles_published_at_id', 'articles', ['published_at', 'id']),
+    ('ix_articles_created_at_id', 'articles', ['created_at', 'id']),
+    ('ix_articles_updated_at_id', 'articles', ['updated_at', 'id']),
+    ('ix_articles_title_id', 'articles', ['title', 'id']),
+    ('ix_tags_name_id', 'tags', ['name', 'id']),
+    ('ix_tags_created_at_id', 'tags', ['created_at', 'id']),
+    ('ix_tags_updated_at_id', 'tags', ['updated_at', 'id']),
+    ('ix_local_users_name_user_id', 'local_users', ['name', 'user_id']),
+    ('ix_local_users_created_at_user_id', 'local_users',
+     ['created_at', 'user_id']),
+    ('ix_local_users_updated_at_user_id', 'local_users',
+     ['updated_at', 'user_id']),
+    ('ix_categories_display_order_id', 'categories', ['display_order', 'id']),
+    ('ix_categories_name_id', 'categories', ['name', 'id']),
+)
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the REST API hot paths against a stored baseline.
+
+    python -m silly_blog.tests.benchmarks.bench_api --articles 10000
+    python -m silly_blog.tests.benchmarks.bench_api --articles 100000 \\
+        --driver server --save-baseline
+
+A synthetic dataset is seeded into a SQLite file once, which is reused
+by later runs with the same arguments, and every run works on a copy.
+Then list, detail, login and write endpoints are requested with the Flask
+test client, or over HTTP with a local WSGI server, and throughput,
+latency percentiles and queries per request are reported. Queries are
+counted by the `Server-Timing` header.
+
+The run fails if a scenario runs more queries than `baseline.json`, or
+its median latency or throughput is worse than the timing baseline
+beyond `--tolerance`; tail latencies of short runs are too noisy to
+compare. `--save-baseline` saves queries, which don't depend on the
+machine, into `baseline.json`, and timings into a local file in the
+temp dir, which is compared only on the machine which recorded it.
+"""
+import os
+import re
+import sys
+import json
+import math
+import shutil
+import time
+import random
+import argparse
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+from silly_blog.app import create_app, db, models
+from silly_blog.app.replicas import copy_sqlite
+from silly_blog.app.seed import Seeder, PASSWORD
+from silly_blog.configs import Config
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+TIMINGS = os.path.join(tempfile.gettempdir(),
+                       "silly-blog-bench-timings.json")
+# results which don't depend on the machine
+PORTABLE = ("queries",)
+
+_QUERIES = re.compile(r'db;desc="(\d+) queries"')
+
+
+class BenchmarkConfig(Config):
+    """Production configurations, without caches hiding the application.
+
+    Responses are rendered by the application rather than served by the
+    response cache, and passwords are hashed with the production cost.
+    """
+
+    SQLALCHEMY_DATABASE_URI = None  # the dataset of the run
+    RESPONSE_CACHE_BACKEND = None
+    SQL_QUERY_BUDGET = None
+
+
+def percentile(values, q):
+    """Returns the `q` percentile of sorted values, by nearest rank."""
+    index = int(math.ceil(q / 100.0 * len(values))) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+class ClientDriver(object):
+    """Send requests with the Flask test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, url, body=None, headers=None):
+        response = self.client.open(
+            url, method=method, headers=headers,
+            data=None if body is None else json.dumps(body),
+            content_type="application/json")
+        data = response.data
+        return response.status_code, response.headers, data
+
+    def close(self):
+        pass
+
+
+class ServerDriver(object):
+    """Send requests over HTTP to a local WSGI server in a thread."""
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.base_url = "http://127.0.0.1:%d" % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def request(self, method, url, body=None, headers=None):
+        data = None if body is None else json.dumps(body).encode("utf-8")
+        headers = dict(headers or {}, **{"Content-Type": "application/json"})
+        req = urllib.request.Request(self.base_url + url, data=data,
+                                     headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as ex:
+            return ex.code, ex.headers, ex.read()
+
+    def close(self):
+        self.server.shutdown()
+
+
+DRIVERS = {"client": ClientDriver, "server": ServerDriver}
+
+
+class Scenarios(object):
+    """Requests of benchmark scenarios, picked from the dataset."""
+
+    def __init__(self, driver, seed=0):
+        self.driver = driver
+        self.rand = random.Random(seed)
+        self.article_ids = [article_id for article_id, in
+                            db.session.query(models.Article.id).
+                            order_by(models.Article.id).limit(10000)]
+        self.category_ids = [category_id for category_id, in
+                             db.session.query(models.Category.id).
+                             order_by(models.Category.id)]
+        self.tag_names = [name for name, in db.session.query(
+            models.Tag.name).order_by(models.Tag.name).limit(100)]
+        self.source_id = db.session.query(models.Source.id).\
+            order_by(models.Source.name).first()[0]
+        self.users = [name for name, in db.session.query(
+            models.LocalUser.name).filter(
+            models.LocalUser.name.like("seed%-user%"))]
+        db.session.remove()
+        self.token = None
+        self.written = 0
+
+    def login(self):
+        return ("POST", "/tokens", {"auth": {
+            "username": self.rand.choice(self.users),
+            "password": PASSWORD}}, None)
+
+    def list(self):
+        return ("GET", "/articles/?page=%d&pagesize=20"
+                % self.rand.randint(1, 50), None, None)
+
+    def list_content(self):
+        return ("GET", "/articles/?page=%d&pagesize=20&content=true"
+                % self.rand.randint(1, 50), None, None)
+
+    def list_category(self):
+        return ("GET", "/articles/?category_id=%s&pagesize=20"
+                % self.rand.choice(self.category_ids), None, None)
+
+    def detail(self):
+        return ("GET", "/articles/%s" % self.rand.choice(self.article_ids),
+                None, None)
+
+    def tags(self):
+        return "GET", "/tags/?pagesize=100", None, None
+
+    def categories(self):
+        return "GET", "/categories/", None, None
+
+    def write(self):
+        if self.token is None:
+            status, _, data = self.driver.request(
+                "POST", "/tokens",
+                {"auth": {"username": "admin", "password": "admin123"}})
+            assert status == 200, data
+            token = json.loads(data.decode("utf-8"))["token"]
+            self.token = token["id"]["id"]
+        self.written += 1
+        return ("POST", "/articles/", {"article": {
+            "title": "bench %d" % self.written,
+            "summary": "summary",
+            "content": "content " * 100,
+            "published": True,
+            "category_id": self.rand.choice(self.category_ids),
+            "source_id": self.source_id,
+            "tags": [{"name": name} for name in
+                     self.rand.sample(self.tag_names, 3)]}},
+            {"X-Auth-Token": self.token})
+
+    NAMES = ("list", "list_content", "list_category", "detail", "tags",
+             "categories", "login", "write")
+
+    def run(self, name, requests, warmup=10):
+        make_request = getattr(self, name)
+        for _ in range(warmup):
+            self.driver.request(*make_request())
+
+        latencies, queries = [], 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            args = make_request()
+            begin = time.perf_counter()
+            status, headers, data = self.driver.request(*args)
+            latencies.append(time.perf_counter() - begin)
+            assert status == 200, (name, status, data[:200])
+            match = _QUERIES.search(headers.get("Server-Timing", ""))
+            queries += int(match.group(1)) if match else 0
+        total = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            "rps": requests / total,
+            "p50": percentile(latencies, 50) * 1000,
+            "p95": percentile(latencies, 95) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "queries": queries / requests,
+        }
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regressions of results against the baseline."""
+    regressions = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key, {})
+        if "queries" in base and result["queries"] > base["queries"]:
+            regressions.append("%s: %.2f queries per request, baseline %.2f"
+                               % (key, result["queries"], base["queries"]))
+        if "p50" in base and result["p50"] > base["p50"] * (1 + tolerance):
+            regressions.append("%s: p50 %.3fms, baseline %.3fms"
+                               % (key, result["p50"], base["p50"]))
+        if "rps" in base and result["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append("%s: %.1f requests/s, baseline %.1f"
+                               % (key, result["rps"], base["rps"]))
+    return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--articles", type=int, default=10000)
+    parser.add_argument("--tags", type=int, default=2000)
+    parser.add_argument("--depth", type=int, default=5,
+                        help="levels of the category tree")
+    parser.add_argument("--fanout", type=int, default=3,
+                        help="children of every category")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--scenario", action="append",
+                        choices=Scenarios.NAMES,
+                        help="run the scenario only, may be repeated")
+    parser.add_argument("--driver", choices=sorted(DRIVERS),
+                        default="client")
+    parser.add_argument("--database", help="a SQLite file, the default "
+                        "one is named by the dataset in the temp dir")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="queries per request of scenarios")
+    parser.add_argument("--timings", default=TIMINGS,
+                        help="timings of scenarios on this machine")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="save results into the baselines")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown of timings, 0.25 is 25%%")
+    args = parser.parse_args(argv)
+
+    seeder = Seeder(articles=args.articles, users=50, tags=args.tags,
+                    depth=args.depth, fanout=args.fanout, content_size=800,
+                    seed=args.seed)
+    name = "%da-%dt-%dx%d-s%d" % (args.articles, args.tags, args.depth,
+                                  args.fanout, args.seed)
+    database = args.database or os.path.join(
+        tempfile.gettempdir(), "silly-blog-bench-%s.sqlite" % name)
+
+    config = BenchmarkConfig()
+    config.SQLALCHEMY_DATABASE_URI = "sqlite:///" + database
+    app = create_app(config)
+    work = database + ".run"
+    with app.app_context():
+        db.create_all()
+        if models.Article.query.first() is None:
+            models.Role.insert_default_values()
+            models.User.insert_default_values()
+            started = time.time()
+            for _ in seeder.run():
+                pass
+            print("seeded %d articles in %.1fs"
+                  % (seeder.inserted, time.time() - started))
+        db.session.remove()
+        # writes go to a copy, so every run starts with the same dataset
+        seeded = db.engine
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + work
+        copy_sqlite(seeded, db.engine)
+        seeded.dispose()
+        scenarios = Scenarios(DRIVERS[args.driver](app), args.seed)
+
+        results = {}
+        print("%-14s %10s %10s %10s %10s %8s" % (
+            "scenario", "req/s", "p50(ms)", "p95(ms)", "p99(ms)", "queries"))
+        try:
+            for scenario in args.scenario or Scenarios.NAMES:
+                result = scenarios.run(scenario, args.requests)
+                results["%s/%s/%s" % (args.driver, name, scenario)] = result
+                print("%-14s %10.1f %10.3f %10.3f %10.3f %8.2f" % (
+                    scenario, result["rps"], result["p50"], result["p95"],
+                    result["p99"], result["queries"]))
+        finally:
+            scenarios.driver.close()
+            app.extensions["counters"].flush()
+            db.engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(work + suffix):
+            os.remove(work + suffix)
+    shutil.rmtree(app.config["RUNTIME_DIR"], ignore_errors=True)
+
+    baselines = [(args.baseline, lambda name: name in PORTABLE),
+                 (args.timings, lambda name: name not in PORTABLE)]
+    if args.save_baseline:
+        for path, selected in baselines:
+            baseline = load_baseline(path)
+            baseline.update({
+                key: {k: round(v, 3) for k, v in result.items()
+                      if selected(k)}
+                for key, result in results.items()})
+            with open(path, "w") as fp:
+                json.dump(baseline, fp, indent=2, sort_keys=True)
+                fp.write("\n")
+            print("saved baseline into %s" % path)
+        return 0
+
+    baseline = {}
+    for path, _ in baselines:
+        for key, base in load_baseline(path).items():
+            baseline.setdefault(key, {}).update(base)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print("REGRESSION %s" % regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the JSON encoders of API responses.
+
+    python -m silly_blog.tests.benchmarks.bench_json --articles 1000
+
+Articles are inserted into an in-memory SQLite database, then article
+lists are requested with the test client under every available backend.
+The time spent in the encoder is measured apart, and reported as its share
+of the request time.
+"""
+import os
+import sys
+import time
+import argparse
+
+from silly_blog.app import create_app, db, models
+from silly_blog.contrib import fastjson
+
+
+def seed_articles(count):
+    models.Role.insert_default_values()
+    models.User.insert_default_values()
+    models.Source.insert_default_values()
+    user = models.User.get(name_email="admin")
+    category = models.Category(name="bench")
+    tags = [models.Tag(name="tag%d" % i) for i in range(5)]
+    db.session.add_all([category] + tags)
+    db.session.flush()
+    source_id = models.Source.query.first().id
+    for i in range(count):
+        article = models.Article(
+            title="article %d" % i, summary="summary of article %d" % i,
+            content="content " * 200, published=True, user_id=user.id,
+            category_id=category.id, source_id=source_id)
+        db.session.add(article)
+        db.session.flush()
+        article.set_tags([tag.id for tag in tags[:i % 5]])
+    db.session.commit()
+
+
+class TimedEncoder(object):
+    """Accumulate time spent in `dumps` of an encoder."""
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+        self.elapsed = 0.0
+
+    def dumps(self, obj):
+        started = time.perf_counter()
+        try:
+            return self.encoder.dumps(obj)
+        finally:
+            self.elapsed += time.perf_counter() - started
+
+
+def run(app, client, url, backend, sort_keys, requests):
+    timed = TimedEncoder(fastjson.JSONEncoder(backend, sort_keys=sort_keys))
+    app.extensions["json_encoder"] = timed
+    client.get(url)  # warm up
+    timed.elapsed = 0.0
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(url)
+        assert response.status_code == 200, response.data
+    total = time.perf_counter() - started
+    return {
+        "request": total / requests * 1000,
+        "encode": timed.elapsed / requests * 1000,
+        "share": timed.elapsed / total * 100,
+        "bytes": len(response.data),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--articles", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--pagesize", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    # an in-memory database without the response cache
+    os.environ["FLASK_ENV"] = "testing"
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        seed_articles(args.articles)
+
+    client = app.test_client()
+    backends = ["json"] + ([] if fastjson.orjson is None else ["orjson"])
+    print("%-8s %-6s %12s %12s %8s %10s" % (
+        "backend", "sort", "request(ms)", "encode(ms)", "share", "bytes"))
+    for content in (False, True):
+        url = "/articles/?page=1&pagesize=%d" % args.pagesize
+        if content:
+            url += "&content=true"
+        print(url)
+        for backend in backends:
+            for sort_keys in (True, False):
+                result = run(app, client, url, backend, sort_keys,
+                             args.requests)
+                print("%-8s %-6s %12.3f %12.3f %7.1f%% %10d" % (
+                    backend, sort_keys, result["request"], result["encode"],
+                    result["share"], result["bytes"]))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of login lookups by name or email against many users.
+
+    python -m silly_blog.tests.benchmarks.bench_login --users 1000000
+
+Users are bulk inserted into a SQLite database once, which is reused by
+later runs. Then random names, emails and missing ones are looked up by
+the legacy `name = ? OR email = ?` query and by `User.get_by_name_email`,
+and latencies and queries per lookup are reported.
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import argparse
+import tempfile
+
+from flask import current_app
+from sqlalchemy import event
+
+from silly_blog.app import create_app, db, models
+
+
+CHUNK_SIZE = 10000
+
+
+def seed_users(count):
+    """Bulk insert users named `user<n>` until there are `count` ones."""
+    existing = db.session.query(db.func.count(models.LocalUser.id)).scalar()
+    if existing >= count:
+        return
+    role_id = models.Role.query.filter_by(name=models.Role.USER).first().id
+    # NOTE: hashing is irrelevant to lookups, share one hash
+    password = current_app.extensions["password_hasher"].hash("dummy")
+    started = time.time()
+    for start in range(existing, count, CHUNK_SIZE):
+        users, local_users = [], []
+        for i in range(start, min(start + CHUNK_SIZE, count)):
+            user_id = uuid.uuid4().hex
+            users.append({"id": user_id, "role_id": role_id, "enabled": True})
+            local_users.append({"user_id": user_id,
+                                "name": "user%d" % i,
+                                "email": "user%d@example.com" % i,
+                                "password": password})
+        with db.engine.begin() as connection:
+            connection.execute(models.User.__table__.insert(), users)
+            connection.execute(models.LocalUser.__table__.insert(),
+                               local_users)
+    print("seeded %d users in %.1fs" % (count - existing,
+                                        time.time() - started))
+
+
+def legacy_lookup(name_email):
+    """The lookup before `User.get_by_name_email`."""
+    local_user = models.LocalUser.query.join(models.LocalUser.user).filter(
+        db.or_(models.LocalUser.name == name_email,
+               models.LocalUser.email == name_email)).first()
+    user = local_user.user if local_user else None
+    # the token response needs role name
+    return user, user.role.name if user else None
+
+
+def union_lookup(name_email):
+    user = models.User.get_by_name_email(name_email)
+    return user, user.role.name if user else None
+
+
+def run(lookup, keys):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    latencies = []
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        for key in keys:
+            started = time.perf_counter()
+            lookup(key)
+            latencies.append(time.perf_counter() - started)
+            # a new session per request
+            db.session.remove()
+    finally:
+        event.remove(db.engine, "before_cursor_execute",
+                     before_cursor_execute)
+
+    latencies.sort()
+    return {
+        "mean": sum(latencies) / len(latencies) * 1000,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+        "queries": len(statements) / len(keys),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--database", default="sqlite:///" + os.path.join(
+        tempfile.gettempdir(), "silly-blog-bench-login.sqlite"))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.database
+    app.config["SQLALCHEMY_ECHO"] = False
+    with app.app_context():
+        db.create_all()
+        if not models.Role.query.first():
+            models.Role.insert_default_values()
+        seed_users(args.users)
+
+        rand = random.Random(args.seed)
+        keys = []
+        for _ in range(args.lookups):
+            n = rand.randrange(args.users)
+            keys.append(rand.choice(["user%d" % n,
+                                     "user%d@example.com" % n,
+                                     "missing%d" % n]))
+
+        print("%-8s %10s %10s %10s %10s" % ("lookup", "mean(ms)", "p50(ms)",
+                                              "p99(ms)", "queries"))
+        for name, lookup in (("legacy", legacy_lookup),
+                             ("union", union_lookup)):
+            run(lookup, keys[:100])  # warm up
+            result = run(lookup, keys)
+            print("%-8s %10.3f %10.3f %10.3f %10.2f" % (
+                name, result["mean"], result["p50"], result["p99"],
+                result["queries"]))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
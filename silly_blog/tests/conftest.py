@@ -1,14 +1,23 @@
 # -*- coding: utf-8 -*-
 import os
+import shutil
 
 import pytest
 
 from silly_blog.app import create_app, db, models
+from silly_blog.configs import TestingConfig
 
 
 os.environ['FLASK_ENV'] = 'testing'
 
 
+@pytest.fixture(scope='session', autouse=True)
+def runtime_dir():
+    """Remove files shared by apps of the test run."""
+    yield TestingConfig.RUNTIME_DIR
+    shutil.rmtree(TestingConfig.RUNTIME_DIR, ignore_errors=True)
+
+
 @pytest.fixture
 def app():
     app = create_app()
@@ -19,6 +28,8 @@ def app():
 
     yield app
 
+    # flush pending counters before the database is dropped
+    app.extensions['counters'].flush()
     with app.app_context():
         db.session.remove()
         db.drop_all()
@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import DatabaseError
+
+from silly_blog.app import db, models, counters
+
+
+@pytest.fixture
+def articles(app):
+    """Create a category hierarchy and some articles with tags."""
+    with app.app_context():
+        models.Source.insert_default_values()
+        source = models.Source.query.first()
+        user = models.User.get(name_email='admin')
+        root = models.Category(name='database', display_order=1)
+        child = models.Category(name='mysql', display_order=1, parent=root)
+        leaf = models.Category(name='innodb', display_order=1, parent=child)
+        tags = [models.Tag(name='tag%d' % i) for i in range(3)]
+        db.session.add_all([root, child, leaf] + tags)
+        db.session.commit()
+
+        for i in range(10):
+            article = models.Article(title='article%d' % i,
+                                     content='content%d' % i,
+                                     published=True,
+                                     user=user,
+                                     category=leaf if i % 2 else root,
+                                     source=source)
+            db.session.add(article)
+            db.session.flush()
+            article.set_tags([tag.id for tag in tags[:i % 4]])
+        db.session.commit()
+
+
+@pytest.fixture
+def queries(app):
+    """Record statements executed by the engine."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@pytest.fixture
+def headers(app):
+    with app.app_context():
+        user = models.User.get(name_email='admin')
+        token = user.generate_auth_token()
+    return {'X-Auth-Token': token['id']}
+
+def _snapshot(query):
+    return sorted((article.id, article.title, article.content,
+                   article.user.name, article.category.name,
+                   article.source.name, article.created_at,
+                   [tag.name for tag in article.get_tags()])
+                  for article in query)
+
+
+class TestArticle(object):
+
+    def test_list_details(self, client, articles):
+        response = client.get('/articles/?sort=title&direction=asc')
+        assert response.status_code == 200
+        data = json.loads(response.data.decode())
+        assert data['total'] == 10
+
+        first, last = data['articles'][0], data['articles'][-1]
+        assert first['user']['name'] == 'admin'
+        assert [c['name'] for c in first['category']] == ['database']
+        assert [c['name'] for c in last['category']] == [
+            'database', 'mysql', 'innodb']
+        assert first['source']['name']
+        assert [t['name'] for t in data['articles'][3]['tags']] == [
+            'tag0', 'tag1', 'tag2']
+
+    @pytest.mark.parametrize('content', ('', 'true'))
+    def test_list_query_count(self, client, articles, queries, content):
+        # warm up caches
+        client.get('/articles/')
+        counts = []
+        for pagesize in (1, 10):
+            del queries[:]
+            response = client.get(
+                '/articles/?page=1&pagesize=%d&content=%s' % (pagesize, content))
+            assert response.status_code == 200
+            data = json.loads(response.data.decode())
+            assert len(data['articles']) == pagesize
+            counts.append(len(queries))
+
+        assert counts[0] == counts[1]
+
+    def test_cursor_list_not_counted(self, client, articles, queries):
+        # validators don't aggregate the matched rows either
+        del queries[:]
+        response = client.get('/articles/?cursor=&pagesize=2')
+        assert response.status_code == 200
+        assert 'total' not in json.loads(response.data.decode())
+        assert not any('count(' in statement.lower()
+                       for statement in queries)
+
+    @pytest.mark.parametrize('sort', ('published_at', 'title', 'created_at'))
+    @pytest.mark.parametrize('direction', ('asc', 'desc'))
+    def test_list_cursor(self, client, articles, sort, direction):
+        ids, cursor, pages = [], '', 0
+        while cursor is not None:
+            response = client.get(
+                '/articles/?sort=%s&direction=%s&pagesize=3&cursor=%s'
+                % (sort, direction, cursor))
+            assert response.status_code == 200
+            data = json.loads(response.data.decode())
+            assert 'total' not in data
+            ids.extend(article['id'] for article in data['articles'])
+            cursor = data['next_cursor']
+            pages += 1
+
+        assert pages == 4
+        assert len(set(ids)) == 10
+
+        response = client.get('/articles/?sort=%s&direction=%s'
+                              % (sort, direction))
+        data = json.loads(response.data.decode())
+        values = [article[sort] for article in data['articles']]
+        assert values == sorted(values, key=lambda v: v or '',
+                                reverse=direction == 'desc')
+
+    @pytest.mark.parametrize('direction', ('asc', 'desc'))
+    def test_list_cursor_nulls(self, client, app, articles, direction):
+        with app.app_context():
+            for article in models.Article.query.filter(
+                    models.Article.title.in_(['article1', 'article4'])):
+                article.published_at = None
+            db.session.commit()
+
+        # pages go on across NULLs, which are the smallest values
+        values, cursor = {}, ''
+        while cursor is not None:
+            response = client.get(
+                '/articles/?sort=published_at&direction=%s&pagesize=3'
+                '&cursor=%s' % (direction, cursor))
+            data = json.loads(response.data.decode())
+            for article in data['articles']:
+                values[article['id']] = article['published_at']
+            cursor = data['next_cursor']
+        assert len(values) == 10
+        assert list(values.values()) == sorted(
+            values.values(), key=lambda v: (v is not None, v or ''),
+            reverse=direction == 'desc')
+
+    def test_list_invalid_cursor(self, client, articles):
+        response = client.get('/articles/?cursor=xxx')
+        assert response.status_code == 400
+
+    def test_search(self, client, app, articles):
+        response = client.get('/articles/?q=content3')
+        assert response.status_code == 200
+        data = json.loads(response.data.decode())
+        assert [a['title'] for a in data['articles']] == ['article3']
+
+        with app.app_context():
+            article = models.Article.query.filter_by(title='article5').first()
+            article.title = 'hello content3'
+            db.session.commit()
+        response = client.get('/articles/?q=content3')
+        data = json.loads(response.data.decode())
+        # title match ranks first
+        assert [a['title'] for a in data['articles']] == [
+            'hello content3', 'article3']
+
+        with app.app_context():
+            models.Article.query.filter_by(title='article3').delete()
+            db.session.commit()
+        response = client.get('/articles/?q=content3')
+        data = json.loads(response.data.decode())
+        assert data['total'] == 1
+
+    def test_search_with_cursor(self, client, articles):
+        response = client.get('/articles/?q=content3&cursor=')
+        assert response.status_code == 400
+        response = client.get('/articles/?q=content3&cursor=&sort=title')
+        assert response.status_code == 200
+
+    def test_counters(self, client, app, articles, headers):
+        with app.app_context():
+            article_id = models.Article.query.filter_by(
+                title='article3').first().id
+        url = '/articles/%s' % article_id
+        client.get(url)
+        response = client.get(url)
+        data = json.loads(response.data.decode())
+        # pending increments are merged
+        assert data['article']['views'] == 2
+
+        response = client.post(url + '/stars')
+        assert response.status_code == 401
+        response = client.post(url + '/stars', headers=headers)
+        assert response.status_code == 200
+        data = json.loads(response.data.decode())
+        assert data['article']['stars'] == 1
+        # a user stars an article once
+        response = client.post(url + '/stars', headers=headers)
+        assert response.status_code == 200
+        data = json.loads(response.data.decode())
+        assert data['article']['stars'] == 1
+
+        etag = client.get('/articles/').headers['ETag']
+        counters = app.extensions['counters']
+        counters.flush()
+        with app.app_context():
+            article = models.Article.query.get(article_id)
+            assert (article.views, article.stars) == (2, 1)
+        # lists contain flushed counters
+        response = client.get('/articles/', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        response = client.get(url)
+        data = json.loads(response.data.decode())
+        assert data['article']['views'] == 3
+
+    def test_counters_flushed_at_exit(self, client, app, articles):
+        with app.app_context():
+            article_id = models.Article.query.filter_by(
+                title='article3').first().id
+        client.get('/articles/%s' % article_id)
+        # one exit handler of the process closes counters of all apps
+        counters._close_all()
+        with app.app_context():
+            assert models.Article.query.get(article_id).views == 1
+
+    def test_conditional_list(self, client, app, articles):
+        response = client.get('/articles/')
+        etag = response.headers['ETag']
+        # the latest `updated_at` doesn't change on deletes
+        assert 'Last-Modified' not in response.headers
+
+        response = client.get('/articles/', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        # names of categories are part of the list
+        with app.app_context():
+            category = models.Category.query.filter_by(name='innodb').one()
+            category.name = 'rocksdb'
+            db.session.commit()
+        response = client.get('/articles/', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        etag = response.headers['ETag']
+
+        with app.app_context():
+            models.Article.query.filter_by(title='article3').delete()
+            db.session.commit()
+        response = client.get('/articles/', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_conditional_detail(self, client, app, articles, headers):
+        with app.app_context():
+            article_id = models.Article.query.filter_by(
+                title='article3').first().id
+        url = '/articles/%s' % article_id
+        etag = client.get(url).headers['ETag']
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        # pending counters are part of the details
+        etag = client.get(url).headers['ETag']
+        client.post(url + '/stars', headers=headers)
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        data = json.loads(response.data.decode())
+        assert data['article']['stars'] == 1
+        assert data['article']['views'] == 4
+        response = client.get(url, headers={
+            'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
+        etag = response.headers['ETag']
+
+        with app.app_context():
+            article = models.Article.query.get(article_id)
+            article.title = 'changed'
+            db.session.commit()
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+
+    def test_post_put_tags(self, client, app, articles, headers, queries):
+        with app.app_context():
+            tag0 = models.Tag.query.filter_by(name='tag0').first().id
+            category = models.Category.query.filter_by(name='mysql').first().id
+            source = models.Source.query.first().id
+        names = ['new%d' % i for i in range(20)]
+        tags = ([{'id': tag0}, {'name': 'tag1'}, {'id': 'unknown'}] +
+                [{'name': name} for name in names] + [{'name': 'tag1'}])
+        del queries[:]
+        response = client.post('/articles/', headers=headers, data=json.dumps({
+            'article': {'title': 'tagged', 'content': 'content',
+                        'summary': 'summary', 'category_id': category,
+                        'source_id': source, 'tags': tags}}),
+            content_type='application/json')
+        assert response.status_code == 200
+        article_id = json.loads(response.data.decode())['article']['id']
+        # tags are resolved and associated in constant queries
+        assert len(queries) < 20
+
+        with app.app_context():
+            article = models.Article.query.get(article_id)
+            assert [tag.name for tag in article.get_tags()] == (
+                ['tag0', 'tag1'] + names)
+
+        response = client.put('/articles/%s' % article_id, headers=headers,
+                              data=json.dumps({'article': {'tags': [
+                                  {'name': 'new1'}, {'name': 'tag2'}]}}),
+                              content_type='application/json')
+        assert response.status_code == 200
+        with app.app_context():
+            article = models.Article.query.get(article_id)
+            assert [tag.name for tag in article.get_tags()] == [
+                'new1', 'tag2']
+
+    def test_put_in_one_transaction(self, client, app, articles, headers,
+                                    monkeypatch):
+        with app.app_context():
+            article_id = models.Article.query.filter_by(
+                title='article3').first().id
+
+        def set_tags(self, tag_ids):
+            raise DatabaseError('INSERT', {}, Exception('failed'))
+
+        monkeypatch.setattr(models.Article, 'set_tags', set_tags)
+        response = client.put('/articles/%s' % article_id, headers=headers,
+                              data=json.dumps({'article': {
+                                  'title': 'changed',
+                                  'tags': [{'name': 'new'}]}}),
+                              content_type='application/json')
+        assert response.status_code == 500
+        with app.app_context():
+            assert models.Article.query.get(article_id).title == 'article3'
+            assert models.Tag.query.filter_by(name='new').count() == 0
+
+    def test_import_export(self, app, runner, articles, tmpdir):
+        path = str(tmpdir.join('articles.jsonl.gz'))
+        result = runner.invoke(args=['articles', 'export', path,
+                                     '--batch-size', '3'])
+        assert result.exit_code == 0, result.output
+        with app.app_context():
+            before = _snapshot(models.Article.query)
+            db.session.execute(models.article_tag_mapping.delete())
+            models.Article.query.delete()
+            db.session.execute(models.category_closure.delete())
+            models.Category.query.delete()
+            db.session.commit()
+
+        result = runner.invoke(args=['articles', 'import', path,
+                                     '--batch-size', '4'])
+        assert result.exit_code == 0, result.output
+        assert 'Imported 10 articles' in result.output
+        with app.app_context():
+            assert _snapshot(models.Article.query) == before
+            # categories are created under their parents
+            leaf = models.Category.query.filter_by(name='innodb').one()
+            assert [name for _, name in models.Category.get_lineages(
+                [leaf.id])[leaf.id]] == ['database', 'mysql', 'innodb']
+
+        # existing articles are skipped
+        result = runner.invoke(args=['articles', 'import', path])
+        assert 'Skipped 10 existing articles' in result.output
+
+        path = str(tmpdir.join('invalid.jsonl'))
+        with open(path, 'w') as fp:
+            fp.write('{"title": "new", "content": "x", "tags": ["new"]}\n'
+                     '{"title": "invalid"}\n')
+        result = runner.invoke(args=['articles', 'import', path])
+        assert result.exit_code != 0
+        assert "Line 2: 'content' is required" in result.output
+
+    @pytest.mark.parametrize('pagesize', ('', '&cursor=&pagesize=4'))
+    def test_list_stream(self, client, app, articles, pagesize):
+        app.config['STREAM_BATCH_SIZE'] = 3
+        url = '/articles/?sort=title&direction=asc&content=true' + pagesize
+        expected = json.loads(client.get(url).data.decode())
+
+        response = client.get(url + '&stream=true')
+        assert response.is_streamed
+        assert json.loads(response.data.decode()) == expected
+
+        response = client.get(url, headers={'Accept': 'application/x-ndjson'})
+        assert response.mimetype == 'application/x-ndjson'
+        lines = response.data.decode().splitlines()
+        assert [json.loads(line) for line in lines] == expected['articles']
+        assert response.headers.get('X-Next-Cursor') == expected.get(
+            'next_cursor')
+
+        response = client.get(url + '&stream=xml')
+        assert response.status_code == 400
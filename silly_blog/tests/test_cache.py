@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import stat
+import time
+
+import pytest
+
+from silly_blog.app import db, models
+from silly_blog.app.response_cache import ResponseCache
+from silly_blog.contrib.cache import MemoryCache, FileSystemCache, TagVersions
+
+
+@pytest.fixture(params=['memory', 'filesystem'])
+def cache(request, tmpdir):
+    tags = TagVersions(str(tmpdir.join('tags')))
+    if request.param == 'memory':
+        return MemoryCache(max_bytes=1000, tags=tags)
+    return FileSystemCache(str(tmpdir.join('cache')), max_bytes=1000,
+                           prune_interval=1, tags=tags)
+
+
+@pytest.fixture(params=['memory', 'filesystem'])
+def cached_app(request, app, tmpdir):
+    app.config['RESPONSE_CACHE_BACKEND'] = request.param
+    app.config['RESPONSE_CACHE_DIR'] = str(tmpdir.join('responses'))
+    app.config['VERSION_STAMP_DIR'] = str(tmpdir)
+    ResponseCache(app)
+    return app
+
+
+class TestCache(object):
+
+    def test_ttl(self, cache):
+        cache.set('a', b'1', ttl=-1)
+        assert cache.get('a') is None
+        cache.set('a', b'1')
+        assert cache.get('a') == b'1'
+
+    def test_eviction(self, cache):
+        value = b'x' * 400
+        cache.set('a', value)
+        time.sleep(0.01)
+        cache.set('b', value)
+        time.sleep(0.01)
+        # `a` is used recently
+        assert cache.get('a') == value
+        time.sleep(0.01)
+        cache.set('c', value)
+        assert cache.get('b') is None
+        assert cache.get('a') == value
+
+    def test_tags(self, cache):
+        cache.set('a', b'1', tags=['articles'])
+        cache.set('b', b'2', tags=['tags'])
+        cache.tags.bump(['articles'])
+        assert cache.get('a') is None
+        assert cache.get('b') == b'2'
+
+    def test_private_directory(self, tmpdir):
+        path = str(tmpdir.join('shared'))
+        os.mkdir(path)
+        os.chmod(path, 0o777)
+        FileSystemCache(path)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o700
+
+    def test_response_cache(self, cached_app):
+        client = cached_app.test_client()
+        response = client.get('/tags/?sort=name&direction=asc')
+        assert response.headers['X-Cache'] == 'MISS'
+        # arguments are normalized
+        response = client.get('/tags/?direction=asc&sort=name')
+        assert response.headers['X-Cache'] == 'HIT'
+        response = client.get('/tags/?direction=asc&sort=name', headers={
+            'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
+
+        with cached_app.app_context():
+            db.session.add(models.Tag(name='python'))
+            db.session.commit()
+        response = client.get('/tags/?sort=name&direction=asc')
+        assert response.headers['X-Cache'] == 'MISS'
+        data = json.loads(response.data.decode())
+        assert [tag['name'] for tag in data['tags']] == ['python']
+
+    def test_response_cache_format(self, cached_app):
+        client = cached_app.test_client()
+        response = client.get('/tags/')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert 'Accept' in response.headers['Vary']
+        response = client.get('/tags/', headers={
+            'Accept': 'application/x-ndjson'})
+        assert response.mimetype == 'application/x-ndjson'
+        assert 'X-Cache' not in response.headers
+        assert 'Accept' in response.headers['Vary']
+        response = client.get('/tags/')
+        assert response.headers['X-Cache'] == 'HIT'
+        assert response.mimetype == 'application/json'
+
+    def test_views_of_cached_article(self, cached_app):
+        with cached_app.app_context():
+            article = models.Article(title='cached', content='content',
+                                     published=True)
+            db.session.add(article)
+            db.session.commit()
+            url = '/articles/%s' % article.id
+        client = cached_app.test_client()
+        response = client.get(url)
+        assert response.headers['X-Cache'] == 'MISS'
+        assert json.loads(response.data.decode())['article']['views'] == 1
+        response = client.get(url)
+        assert response.headers['X-Cache'] == 'HIT'
+
+        # a view is counted once, whether it's a hit or a miss
+        cached_app.extensions['counters'].flush()
+        with cached_app.app_context():
+            assert models.Article.query.first().views == 2
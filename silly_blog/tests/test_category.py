@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from silly_blog.app import db, models
+from silly_blog.app.category_tree import CategoryTreeCache
+
+
+@pytest.fixture
+def categories(app):
+    """Create a category tree and returns ids mapped by names."""
+    with app.app_context():
+        database = models.Category(name='database', display_order=2)
+        mysql = models.Category(name='mysql', display_order=2, parent=database)
+        sqlite = models.Category(name='sqlite', display_order=1, parent=database)
+        innodb = models.Category(name='innodb', display_order=1, parent=mysql)
+        hidden = models.Category(name='hidden', display_order=3,
+                                 protected=True, parent=database)
+        python = models.Category(name='python', display_order=1)
+        db.session.add_all([database, mysql, sqlite, innodb, hidden, python])
+        db.session.commit()
+        return {c.name: c.id for c in models.Category.query}
+
+
+@pytest.fixture
+def headers(app):
+    with app.app_context():
+        user = models.User.get(name_email='admin')
+        token = user.generate_auth_token()
+    return {'X-Auth-Token': token['id']}
+
+
+def _names(subs):
+    return [(sub['name'], _names(sub['subs'])) for sub in subs]
+
+
+class TestCategory(object):
+
+    def test_get_subtree(self, client, categories):
+        response = client.get('/categories/%s' % categories['database'])
+        assert response.status_code == 200
+        data = json.loads(response.data.decode())
+        assert _names(data['category']['subs']) == [
+            ('sqlite', []), ('mysql', [('innodb', [])])]
+
+    def test_list_roots(self, client, categories):
+        response = client.get('/categories/?parent_id=&sort=name'
+                              '&direction=asc')
+        assert response.status_code == 200
+        data = json.loads(response.data.decode())
+        assert [(c['name'], _names(c['subs'])) for c in data['categories']] == [
+            ('database', [('sqlite', []), ('mysql', [('innodb', [])])]),
+            ('python', []),
+        ]
+
+    def test_lineages(self, app, categories):
+        with app.app_context():
+            lineages = models.Category.get_lineages(
+                [categories['innodb'], categories['python']])
+        assert [name for _, name in lineages[categories['innodb']]] == [
+            'database', 'mysql', 'innodb']
+        assert [name for _, name in lineages[categories['python']]] == [
+            'python']
+
+    def test_move(self, client, app, categories, headers):
+        data = {'category': {'parent_id': categories['python']}}
+        response = client.put('/categories/%s' % categories['mysql'],
+                              data=json.dumps(data), headers=headers,
+                              content_type='application/json')
+        assert response.status_code == 200
+
+        with app.app_context():
+            lineages = models.Category.get_lineages([categories['innodb']])
+            assert [name for _, name in lineages[categories['innodb']]] == [
+                'python', 'mysql', 'innodb']
+            assert models.Category.get_subtree_ids(categories['database']) == {
+                categories[name] for name in ('database', 'sqlite', 'hidden')}
+
+    def test_move_under_descendant(self, client, categories, headers):
+        data = {'category': {'parent_id': categories['innodb']}}
+        response = client.put('/categories/%s' % categories['database'],
+                              data=json.dumps(data), headers=headers,
+                              content_type='application/json')
+        assert response.status_code == 400
+
+    def test_delete(self, client, app, categories, headers):
+        response = client.delete('/categories/%s' % categories['mysql'],
+                                 headers=headers)
+        assert response.status_code == 204
+
+        with app.app_context():
+            closure = models.category_closure
+            ids = {id_ for row in db.session.query(
+                closure.c.ancestor_id, closure.c.descendant_id) for id_ in row}
+            assert categories['mysql'] not in ids
+            assert categories['innodb'] not in ids
+
+    def test_cache_invalidation(self, client, app, categories, headers):
+        url = '/categories/%s' % categories['database']
+        response = client.get(url)
+        assert response.status_code == 200
+
+        data = {'category': {'name': 'sqlite3'}}
+        response = client.put('/categories/%s' % categories['sqlite'],
+                              data=json.dumps(data), headers=headers,
+                              content_type='application/json')
+        assert response.status_code == 200
+
+        response = client.get(url)
+        data = json.loads(response.data.decode())
+        assert _names(data['category']['subs'])[0] == ('sqlite3', [])
+
+    def test_cache_shared_stamp(self, app, categories):
+        with app.app_context():
+            cache = app.extensions['category_tree']
+            # simulate a cache in another worker process
+            other = CategoryTreeCache()
+            other.stamp = cache.stamp
+            snapshot = other.get()
+            assert other.get() is snapshot
+
+            cache.invalidate()
+            assert other.get() is not snapshot
+
+    def test_conditional(self, client, categories, headers):
+        url = '/categories/%s' % categories['database']
+        etag = client.get(url).headers['ETag']
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        # change of a sub changes the whole tree
+        data = {'category': {'name': 'sqlite3'}}
+        client.put('/categories/%s' % categories['sqlite'],
+                   data=json.dumps(data), headers=headers,
+                   content_type='application/json')
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
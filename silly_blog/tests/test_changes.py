@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from silly_blog.app import db, models
+from silly_blog.contrib import changes
+
+
+@pytest.fixture
+def committed(monkeypatch):
+    """Record tables published by commits."""
+    tables = []
+    monkeypatch.setattr(changes, '_receivers', [tables.append])
+    return tables
+
+
+class TestChanges(object):
+
+    def test_rollback(self, app, committed):
+        with app.app_context():
+            db.session.add(models.Tag(name='python'))
+            db.session.flush()
+            db.session.rollback()
+            db.session.commit()
+        assert committed == []
+
+    def test_savepoint_rollback(self, app, committed):
+        with app.app_context():
+            db.session.add(models.Tag(name='python'))
+            db.session.flush()
+            with pytest.raises(IntegrityError):
+                with db.session.begin_nested():
+                    db.session.add(models.Tag(name='python'))
+            db.session.commit()
+        # the outer transaction is still committed
+        assert committed == [{'tags'}]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from silly_blog.app import db
+from silly_blog.contrib import engine as engine_module
+
+
+@pytest.fixture
+def file_app(app, tmpdir):
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///%s' % tmpdir.join(
+        'test.sqlite')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': 2}
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+def test_sqlite_pragmas(file_app):
+    with file_app.app_context():
+        assert db.engine.pool.size() == 2
+        assert db.engine.pool.__class__.__name__ == 'QueuePool'
+        with db.engine.connect() as connection:
+            pragma = lambda name: connection.execute(
+                'PRAGMA %s' % name).scalar()
+            assert pragma('journal_mode') == 'wal'
+            assert pragma('busy_timeout') == 5000
+            assert pragma('synchronous') == 1  # NORMAL
+
+
+def test_invalid_pragma(file_app, tmpdir):
+    pragmas = file_app.config['SQLITE_PRAGMAS']
+    file_app.config['SQLITE_PRAGMAS'] = {'journal_mode': 'WAL; DROP'}
+    file_app.config['SQLALCHEMY_DATABASE_URI'] += '.invalid'
+    try:
+        with file_app.app_context():
+            with pytest.raises(ValueError):
+                db.engine
+    finally:
+        file_app.config['SQLITE_PRAGMAS'] = pragmas
+
+
+def test_pool_after_fork(file_app, monkeypatch):
+    with file_app.app_context():
+        db.engine.execute('SELECT 1')
+        metrics = db.pool_metrics()
+        assert metrics['connects'] == 1
+        assert metrics['checkedin'] == 1
+
+        # a forked worker opens its own connection
+        pid = os.getpid()
+        monkeypatch.setattr(engine_module.os, 'getpid', lambda: pid + 1)
+        db.engine.execute('SELECT 1')
+        metrics = db.pool_metrics()
+        assert metrics['connects'] == 2
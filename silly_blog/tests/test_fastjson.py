@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import json
+import datetime
+
+import pytest
+
+from silly_blog.contrib import fastjson
+from silly_blog.contrib.utils import isotime
+
+
+backends = ['json', pytest.param('orjson', marks=pytest.mark.skipif(
+    fastjson.orjson is None, reason='orjson is not installed'))]
+
+
+@pytest.mark.parametrize('backend', backends)
+@pytest.mark.parametrize('sort_keys', (True, False))
+def test_dumps(backend, sort_keys):
+    encoder = fastjson.JSONEncoder(backend, sort_keys=sort_keys)
+    times = [datetime.datetime(2018, 8, 1, 12),
+             datetime.datetime(2018, 8, 1, 12, 0, 0, 123)]
+    obj = {'b': '原创', 'a': times, 'c': [None, 1, 1.5, True]}
+    data = encoder.dumps(obj)
+    assert isinstance(data, bytes)
+    assert json.loads(data.decode()) == {
+        'b': '原创', 'a': [isotime(at) for at in times],
+        'c': [None, 1, 1.5, True]}
+    pairs = json.loads(data.decode(), object_pairs_hook=list)
+    assert [key for key, _ in pairs] == (['a', 'b', 'c'] if sort_keys
+                                         else ['b', 'a', 'c'])
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        fastjson.JSONEncoder('simplejson')
+
+
+def test_response(app, client):
+    app.extensions['json_encoder'] = fastjson.JSONEncoder('json',
+                                                          sort_keys=True)
+    response = client.get('/tags/')
+    assert response.mimetype == 'application/json'
+    assert response.data.decode().startswith('{"tags":[],"total":0}')
+    response = client.get('/tags/?sort=unknown')
+    assert response.status_code == 400
+    assert json.loads(response.data.decode())['error']['status'] == 400
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from silly_blog.app import db, models
+
+
+def test_server_timing(client):
+    response = client.get('/tags/')
+    assert response.status_code == 200
+    timing = response.headers['Server-Timing']
+    assert timing.startswith('db;desc="2 queries";dur=')
+    assert 'db-slowest;dur=' in timing
+
+
+def test_query_budget(app, client):
+    with app.app_context():
+        db.session.add(models.Tag(name='python'))
+        db.session.commit()
+    app.extensions['query_instrumentation'].budget = 1
+    response = client.get('/tags/')
+    assert response.status_code == 500
+
+    app.extensions['query_instrumentation'].action = 'log'
+    response = client.get('/tags/')
+    assert response.status_code == 200
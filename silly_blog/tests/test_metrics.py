@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from silly_blog.app.metrics import RequestMetrics
+from silly_blog.contrib.metrics import (
+    MetricsStore, Counter, Gauge, Histogram, expose)
+
+
+@pytest.fixture
+def metrics_app(app, tmpdir):
+    app.config['METRICS_ENABLED'] = True
+    app.config['METRICS_DIR'] = str(tmpdir.join('metrics'))
+    RequestMetrics(app)
+    return app
+
+
+def _samples(text):
+    return dict(line.rsplit(' ', 1) for line in text.splitlines()
+                if not line.startswith('#'))
+
+
+def test_aggregate_processes(tmpdir):
+    store = MetricsStore(str(tmpdir))
+    counter = Counter(store, 'jobs_total', 'Jobs.', ['kind'])
+    gauge = Gauge(store, 'jobs_running', 'Running jobs.')
+    histogram = Histogram(store, 'job_seconds', 'Job time.',
+                          buckets=[0.1, 1])
+
+    counter.inc(kind='a')
+    gauge.inc()
+    pid = os.fork()
+    if pid == 0:
+        # a worker writes its own files
+        counter.inc(2, kind='a')
+        counter.inc(kind='b')
+        gauge.inc()
+        histogram.observe(0.5)
+        os._exit(0)
+    os.waitpid(pid, 0)
+    histogram.observe(0.05)
+    histogram.observe(3)
+
+    samples = _samples(expose([counter, gauge, histogram], store.collect()))
+    assert samples['jobs_total{kind="a"}'] == '3'
+    assert samples['jobs_total{kind="b"}'] == '1'
+    # gauges of exited processes are dropped
+    assert samples['jobs_running'] == '1'
+    assert samples['job_seconds_bucket{le="0.1"}'] == '1'
+    assert samples['job_seconds_bucket{le="1"}'] == '2'
+    assert samples['job_seconds_bucket{le="+Inf"}'] == '3'
+    assert samples['job_seconds_count'] == '3'
+    assert samples['job_seconds_sum'] == '3.55'
+
+
+def test_metrics_endpoint(metrics_app):
+    client = metrics_app.test_client()
+    assert client.get('/tags/').status_code == 200
+    assert client.get('/tags/').status_code == 200
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    samples = _samples(response.data.decode())
+    assert samples['http_requests_total'
+                   '{endpoint="tags",method="GET",status="200"}'] == '2'
+    assert samples['http_request_duration_seconds_count'
+                   '{endpoint="tags",method="GET"}'] == '2'
+    # the scrape itself is in progress
+    assert samples['http_requests_in_progress{endpoint="metrics"}'] == '1'
+    assert samples['http_requests_in_progress{endpoint="tags"}'] == '0'
+    assert 'db_pool_connects{bind="primary"}' in samples
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import time
+import pstats
+
+import pytest
+
+from silly_blog.contrib.profiling import ProfilingMiddleware
+
+
+@pytest.fixture
+def profiled_app(app, tmpdir):
+    app.config.update(PROFILE_DIR=str(tmpdir), PROFILE_SAMPLE_RATE=0.0,
+                      PROFILE_SLOW_SECONDS=0.05, PROFILE_MAX_FILES=2)
+
+    @app.route('/slow')
+    def slow():
+        time.sleep(0.2)
+        return 'done'
+
+    return app
+
+
+def test_sampled_requests(profiled_app, tmpdir):
+    profiled_app.config['PROFILE_SAMPLE_RATE'] = 1.0
+    profiled_app.wsgi_app = ProfilingMiddleware(profiled_app)
+    client = profiled_app.test_client()
+    for _ in range(3):
+        assert client.get('/tags/', buffered=True).status_code == 200
+
+    # the latest ones are kept
+    files = tmpdir.listdir()
+    assert len(files) == 2
+    assert '-GET-tags-' in files[0].basename
+    assert files[0].ext == '.prof'
+    stats = pstats.Stats(str(files[0]))
+    assert any(func[2] == 'get' for func in stats.stats)
+
+
+def test_slow_requests(profiled_app, tmpdir):
+    profiled_app.wsgi_app = ProfilingMiddleware(profiled_app)
+    client = profiled_app.test_client()
+    assert client.get('/tags/', buffered=True).status_code == 200
+    assert tmpdir.listdir() == []
+
+    assert client.get('/slow', buffered=True).data == b'done'
+    files = tmpdir.listdir()
+    assert len(files) == 1
+    assert files[0].ext == '.folded'
+    lines = files[0].read().splitlines()
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 1
+    # sleeping in the view
+    assert stack.split(';')[-1].startswith('slow ')
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from silly_blog.app import db, models
+from silly_blog.app.replicas import ReplicaRouter
+
+
+@pytest.fixture
+def replica_app(app, tmpdir):
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///%s' % tmpdir.join(
+        'primary.sqlite')
+    app.config['SQLALCHEMY_BINDS'] = {
+        key: 'sqlite:///%s' % tmpdir.join(key + '.sqlite')
+        for key in ('replica1', 'replica2')}
+    app.config['SQLALCHEMY_REPLICAS'] = ['replica1', 'replica2']
+    app.config['REPLICA_STICKY_DIR'] = str(tmpdir.join('sticky'))
+    ReplicaRouter(app)
+    with app.app_context():
+        db.create_all()
+        models.Role.insert_default_values()
+        models.User.insert_default_values()
+        user = models.User.get(name_email='admin')
+        app.config['TEST_TOKEN'] = user.generate_auth_token()['id']
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for key in [None] + app.config['SQLALCHEMY_REPLICAS']:
+            db.get_engine(bind=key).dispose()
+
+
+def _tag_names(client, headers=None):
+    response = client.get('/tags/', headers=headers)
+    assert response.status_code == 200
+    data = json.loads(response.data.decode())
+    return [tag['name'] for tag in data['tags']]
+
+
+class TestReplicas(object):
+
+    def test_routing(self, replica_app):
+        runner = replica_app.test_cli_runner()
+        result = runner.invoke(args=['replicas', 'sync'])
+        assert result.exit_code == 0, result.output
+
+        client = replica_app.test_client()
+        headers = {'X-Auth-Token': replica_app.config['TEST_TOKEN']}
+        response = client.post('/tags/', headers=headers,
+                               data=json.dumps({'tag': {'name': 'python'}}),
+                               content_type='application/json')
+        assert response.status_code == 200
+
+        # replicas lag behind, but the writer reads its writes
+        assert _tag_names(client) == []
+        assert _tag_names(client, headers) == ['python']
+
+        result = runner.invoke(args=['replicas', 'sync'])
+        assert result.exit_code == 0, result.output
+        assert _tag_names(client) == ['python']
+
+    def test_ejection(self, replica_app, tmpdir):
+        router = replica_app.extensions['replicas']
+        binds = replica_app.config['SQLALCHEMY_BINDS']
+        uri = binds['replica2']
+        binds['replica2'] = 'sqlite:///%s' % tmpdir.join(
+            'missing', 'replica2.sqlite')
+        client = replica_app.test_client()
+        with replica_app.app_context():
+            db.session.add(models.Tag(name='python'))
+            db.session.commit()
+
+        try:
+            # empty replica1 lacks tables, replica2 fails to connect, both
+            # reads are retried on the primary
+            for _ in range(2):
+                assert _tag_names(client) == ['python']
+            assert router.healthy() == []
+            # then read from the primary
+            assert _tag_names(client) == ['python']
+        finally:
+            binds['replica2'] = uri
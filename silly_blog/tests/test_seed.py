@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from silly_blog.app import db, models
+from silly_blog.app.seed import Seeder
+
+
+class TestSeed(object):
+
+    def test_seed(self, app, runner):
+        def snapshot():
+            with app.app_context():
+                return [sorted(db.session.execute(
+                    'SELECT * FROM %s' % name).fetchall(), key=repr)
+                    for name in ('categories', 'category_closure', 'tags',
+                                 'articles', 'article_tag_mapping',
+                                 'comments')]
+
+        args = ['seed', '--articles', '10', '--users', '3', '--tags', '5',
+                '--categories-depth', '2', '--categories-fanout', '2',
+                '--content-size', '50', '--batch-size', '4', '--seed', '7']
+        result = runner.invoke(args=args + ['--workers', '2'])
+        assert result.exit_code == 0, result.output
+        assert 'Seeded 10 articles' in result.output
+        with app.app_context():
+            assert models.Article.query.count() == 10
+            assert models.Category.query.count() == 6
+            assert db.session.execute(
+                'SELECT count(*) FROM category_closure').scalar() == 6 + 4
+            assert models.LocalUser.query.filter(
+                models.LocalUser.name.like('seed7-user%')).count() == 3
+            # articles are indexed after the bulk insert
+            word = models.Article.query.first().title.split()[0]
+            assert db.session.execute(
+                'SELECT count(*) FROM articles_fts WHERE articles_fts '
+                'MATCH :q', {'q': word}).scalar() > 0
+        seeded = snapshot()
+
+        result = runner.invoke(args=args)
+        assert result.exit_code != 0
+        assert 'Data of seed 7 exists' in result.output
+
+        # the same data whatever the number of workers
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.create_all()
+            models.Role.insert_default_values()
+        result = runner.invoke(args=args + ['--workers', '1'])
+        assert result.exit_code == 0, result.output
+        assert snapshot() == seeded
+
+    def test_stop_early(self, app):
+        with app.app_context():
+            cache = app.extensions['category_tree']
+            tree = cache.get()
+            seeder = Seeder(articles=10, users=3, tags=5, depth=2, fanout=2,
+                            content_size=50, batch_size=4, workers=1)
+            batches = seeder.run()
+            assert next(batches) == 4
+            batches.close()
+            # caches are invalidated although batches are left
+            assert cache.get() is not tree
+            assert models.Article.query.count() == 4
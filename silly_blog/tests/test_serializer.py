@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from silly_blog.app import db, models
+from silly_blog.contrib.utils import isotime
+
+
+def test_to_dict(app):
+    with app.app_context():
+        user = models.LocalUser.query.filter_by(name='admin').first()
+        data = user.to_dict()
+        assert 'password' not in data and 'id' not in data
+        assert data['created_at'] == isotime(user.created_at)
+        assert 'password' in user.to_dict(password=True)
+        # generated once for every combination of included columns
+        assert models.LocalUser.serializer() is models.LocalUser.serializer(
+            password=False)
+
+
+def test_from_row(app):
+    with app.app_context():
+        db.session.add(models.Tag(name='python'))
+        db.session.commit()
+        serializer = models.Tag.serializer()
+        row = db.session.query(*serializer.columns).one()
+        assert serializer.from_row(row) == models.Tag.query.one().to_dict()
+        row = db.engine.execute(
+            db.select(serializer.columns)).first()
+        assert serializer.from_row(row) == models.Tag.query.one().to_dict()
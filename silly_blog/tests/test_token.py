@@ -2,6 +2,11 @@
 import json
 
 import pytest
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from silly_blog.app import db, models
+from silly_blog.contrib.hashing import PasswordHasher
 
 
 class TestToken(object):
@@ -37,3 +42,86 @@ class TestToken(object):
         token = json.loads(response.data.decode())
         assert 'token' in token
         assert token['token']['id']
+
+    def test_get_cached(self, client, app):
+        with app.app_context():
+            user = models.User.get(name_email='admin')
+            headers = {'X-Auth-Token': user.generate_auth_token()['id']}
+            engine = db.engine
+        response = client.get('/tokens', headers=headers)
+        assert response.status_code == 200
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = client.get('/tokens', headers=headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        assert response.status_code == 200
+        data = json.loads(response.data.decode())
+        assert data['token']['user']['role'] == models.Role.ADMIN
+        assert statements == []
+
+    def test_get_disabled(self, client, app):
+        with app.app_context():
+            user = models.User.get(name_email='admin')
+            headers = {'X-Auth-Token': user.generate_auth_token()['id']}
+        assert client.get('/tokens', headers=headers).status_code == 200
+
+        with app.app_context():
+            user = models.User.get(name_email='admin')
+            user.enabled = False
+            db.session.commit()
+        assert client.get('/tokens', headers=headers).status_code == 401
+
+    def test_get_disabled_in_bulk(self, client, app):
+        with app.app_context():
+            user = models.User.get(name_email='admin')
+            headers = {'X-Auth-Token': user.generate_auth_token()['id']}
+        assert client.get('/tokens', headers=headers).status_code == 200
+
+        # bulk updates invalidate cached principals too
+        with app.app_context():
+            models.User.query.update({'enabled': False},
+                                     synchronize_session=False)
+            db.session.commit()
+        assert client.get('/tokens', headers=headers).status_code == 401
+
+    def test_post_rehash(self, client, app):
+        with app.app_context():
+            user = models.User.get(name_email='admin')
+            user.local_user.password = generate_password_hash(
+                'admin123', 'pbkdf2:sha256:500', 8)
+            db.session.commit()
+
+        data = {'auth': {'username': 'admin', 'password': 'admin123'}}
+        response = client.post('/tokens', data=json.dumps(data),
+                               content_type='application/json')
+        assert response.status_code == 200
+
+        with app.app_context():
+            user = models.User.get(name_email='admin')
+            assert user.password.startswith(
+                app.config['PASSWORD_HASH_METHOD'] + '$')
+            assert user.check_password('admin123')
+
+    def test_needs_rehash_default_cost(self):
+        # hashes of a method without cost have werkzeug's default one
+        hasher = PasswordHasher('pbkdf2:sha256', salt_length=8)
+        assert not hasher.needs_rehash(hasher.hash('admin123'))
+        assert hasher.needs_rehash(generate_password_hash(
+            'admin123', 'pbkdf2:sha256:500', 8))
+        assert hasher.needs_rehash(generate_password_hash(
+            'admin123', 'pbkdf2:sha256', 16))
+
+    def test_post_busy(self, client, app):
+        app.extensions['password_hasher'] = PasswordHasher(max_pending=0)
+        data = {'auth': {'username': 'admin', 'password': 'admin123'}}
+        response = client.post('/tokens', data=json.dumps(data),
+                               content_type='application/json')
+        assert response.status_code == 503
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from silly_blog.app import models
+
+
+@pytest.fixture
+def headers(app):
+    with app.app_context():
+        user = models.User.get(name_email='admin')
+        token = user.generate_auth_token()
+    return {'X-Auth-Token': token['id']}
+
+
+class TestUser(object):
+
+    @pytest.mark.parametrize('sort', ('name', 'created_at', 'updated_at'))
+    def test_list_sort(self, client, sort):
+        response = client.get('/users/?cursor=&pagesize=1&sort=%s' % sort)
+        assert response.status_code == 200
+        data = json.loads(response.data.decode())
+        assert len(data['users']) == 1
+        assert data['next_cursor']
+
+    @pytest.mark.parametrize('sort', ('password', 'email', 'id'))
+    def test_list_sort_refused(self, client, sort):
+        # cursors carry sort values, which must not leak secrets
+        response = client.get('/users/?cursor=&pagesize=1&sort=%s' % sort)
+        assert response.status_code == 400
+        assert b'next_cursor' not in response.data
+
+    def test_conditional_list(self, client, app, headers):
+        response = client.get('/users/')
+        etag = response.headers['ETag']
+        response = client.get('/users/', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        # `enabled` and roles of users are part of the list
+        with app.app_context():
+            user_id = models.User.get(name_email='common').id
+        response = client.put('/users/%s' % user_id, headers=headers,
+                              data=json.dumps({'user': {'enabled': False}}),
+                              content_type='application/json')
+        assert response.status_code == 200
+        response = client.get('/users/', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag